@@ -1,8 +1,17 @@
 from xbmcgui import DialogProgressBG
 from contextlib import contextmanager
-from resources.lib.addon.plugin import kodi_log, kodi_traceback, format_name, executebuiltin
+from resources.lib.addon.plugin import kodi_log, kodi_traceback, format_name, executebuiltin, get_setting
 from timeit import default_timer as timer
-from threading import Thread
+from threading import Thread, Condition, Lock
+from collections import deque
+
+POOL_WORKERS = 32  # Default maximum worker threads shared by every ParallelThread in the process
+POOL_IDLE_TIME = 5  # Seconds a worker waits for another task before exiting
+
+TASK_PENDING = 0
+TASK_RUNNING = 1
+TASK_DONE = 2
+TASK_CANCELLED = 3
 
 
 class ProgressDialog(object):
@@ -124,29 +133,174 @@ class TimerList():
             self.list_obj.append(total_time)
 
 
+class PoolTask():
+    __slots__ = ('pool', 'func', 'args', 'kwargs', 'state', 'result')
+
+    def __init__(self, pool, func, args, kwargs):
+        """ Function call queued in a WorkerPool. Result is None if the call raised, was cancelled or timed out """
+        self.pool = pool
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.state = TASK_PENDING
+        self.result = None
+
+    def claim(self):
+        """ Mark task as running. Returns False if another thread already claimed or cancelled it """
+        with self.pool.condition:
+            if self.state != TASK_PENDING:
+                return False
+            self.state = TASK_RUNNING
+            self.pool.pending -= 1
+        return True
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except Exception as exc:
+            kodi_traceback(exc, 'lib.addon.decorators PoolTask', notification=False)
+        finally:
+            with self.pool.finished:
+                self.state = TASK_DONE
+                self.pool.stats['completed'] += 1
+                self.pool.finished.notify_all()
+
+    def cancel(self):
+        """ Cancel task if it hasn't started. Running tasks can't be interrupted so returns False """
+        with self.pool.condition:
+            if self.state != TASK_PENDING:
+                return False
+            self.state = TASK_CANCELLED
+            self.pool.pending -= 1
+            self.pool.stats['cancelled'] += 1
+            self.pool.finished.notify_all()
+        return True
+
+    def wait(self, timeout=None):
+        """ Returns True if task finished or was cancelled within timeout """
+        with self.pool.finished:
+            return self.pool.finished.wait_for(lambda: self.state in (TASK_DONE, TASK_CANCELLED), timeout)
+
+
+class WorkerPool():
+    def __init__(self, max_workers=POOL_WORKERS):
+        """
+        Bounded pool of worker threads shared by every ParallelThread in the process
+        Workers are started as tasks are queued and exit after waiting POOL_IDLE_TIME for another task
+        """
+        self.max_workers = max_workers
+        lock = Lock()  # Guards queue and task state
+        self.condition = Condition(lock)  # Idle workers wait on this for tasks
+        self.finished = Condition(lock)  # Threads joining tasks wait on this so that finishing doesn't wake idle workers
+        self.queue = deque()
+        self.pending = 0
+        self.workers = 0
+        self.idle = 0
+        self.stats = {'submitted': 0, 'completed': 0, 'cancelled': 0, 'timed_out': 0, 'max_queued': 0, 'max_workers': 0}
+
+    def submit_many(self, calls):
+        """ Queue list of (func, args, kwargs) calls. Returns list of PoolTask in same order """
+        tasks = [PoolTask(self, func, args, kwargs) for func, args, kwargs in calls]
+        with self.condition:
+            self.queue.extend(tasks)
+            self.pending += len(tasks)
+            self.stats['submitted'] += len(tasks)
+            self.stats['max_queued'] = max(self.stats['max_queued'], self.pending)
+            new_workers = min(self.max_workers - self.workers, self.pending - self.idle)
+            self.workers += max(new_workers, 0)
+            self.stats['max_workers'] = max(self.stats['max_workers'], self.workers)
+            self.condition.notify(len(tasks))
+        for _ in range(new_workers):
+            Thread(target=self._worker, name='Worker Pool', daemon=True).start()
+        return tasks
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                if not self.queue:
+                    self.idle += 1
+                    self.condition.wait(POOL_IDLE_TIME)
+                    self.idle -= 1
+                if not self.queue:
+                    self.workers -= 1
+                    return
+                task = self.queue.popleft()
+            if task.claim():
+                task.run()
+
+    def get_stats(self):
+        with self.condition:
+            return {'workers': self.workers, 'queued': self.pending, **self.stats}
+
+
+_worker_pool = None
+_worker_pool_lock = Lock()
+
+
+def get_worker_pool():
+    """ Get the process-wide worker pool. Created on first use """
+    global _worker_pool
+    if _worker_pool is not None:
+        return _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            try:
+                max_workers = int(get_setting('worker_threads', 'str'))
+            except (ValueError, TypeError):
+                max_workers = POOL_WORKERS
+            _worker_pool = WorkerPool(max_workers or POOL_WORKERS)
+    return _worker_pool
+
+
+def get_worker_pool_stats():
+    return get_worker_pool().get_stats()
+
+
 class ParallelThread():
     def __init__(self, items, func, *args, **kwargs):
-        """ ContextManager for running parallel threads alongside another function
+        """ ContextManager for running func over items in the shared worker pool alongside another function
         with ParallelThread(items, func, *args, **kwargs) as pt:
             pass
             item_queue = pt.queue
         item_queue[x]  # to get returned items
+        Exiting the context waits for all items. Use pt.join(timeout) to give up on items still running after timeout
         """
         self.queue = [None] * len(items)
-        self._pool = [None] * len(items)
-        for x, i in enumerate(items):
-            self._pool[x] = Thread(target=self._threadwrapper, args=[x, i, func, *args], kwargs=kwargs)
-            self._pool[x].start()
+        self._tasks = get_worker_pool().submit_many([(func, (i, *args), kwargs) for i in items])
 
-    def _threadwrapper(self, x, i, func, *args, **kwargs):
-        self.queue[x] = func(i, *args, **kwargs)
+    def cancel(self):
+        """ Cancel items which haven't started """
+        return sum(1 for i in self._tasks if i.cancel())
+
+    def join(self, timeout=None):
+        """
+        Wait for items to finish and copy results to queue. Returns True if every item finished
+        Without a timeout the calling thread runs any of its items which no worker has started so that
+        nested ParallelThread calls from inside workers can't deadlock the pool when it is saturated
+        With a timeout items not started by then are cancelled and items still running are left to finish unused
+        """
+        timer_z = timer() + timeout if timeout is not None else None
+        if timer_z is None:
+            for task in self._tasks:
+                if task.claim():
+                    task.run()
+        is_finished = True
+        for x, task in enumerate(self._tasks):
+            if task.wait(max(timer_z - timer(), 0) if timer_z is not None else None):
+                self.queue[x] = task.result
+                is_finished = is_finished and task.state == TASK_DONE
+                continue
+            is_finished = False
+            if not task.cancel():
+                with task.pool.condition:
+                    task.pool.stats['timed_out'] += 1
+        return is_finished
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        for i in self._pool:
-            i.join()
+        self.join()
 
 
 def log_output(func_name):
@@ -0,0 +1,48 @@
+""" Run many blocking API calls concurrently in the shared worker pool
+Calls still go through RequestAPI so cache lookup, storage, rate limiting and scheduling are unchanged
+Calls are split into lanes per host with one pool task per lane so that a host never has more than its limit in flight
+"""
+from collections import deque
+from resources.lib.addon.plugin import kodi_traceback
+from resources.lib.addon.decorators import ParallelThread
+from resources.lib.api.scheduler import get_scheduler
+
+BATCH_HOST_DEFAULT = 4
+
+
+def _call(func, args, kwargs, priority):
+    if priority is None:
+        return func(*args, **kwargs)
+    with get_scheduler().request_priority(priority):  # Keep priority of calling thread in the pool workers
+        return func(*args, **kwargs)
+
+
+def _run_lane(queue, results, priority):
+    """ Take calls for one host from queue until it is empty. Several lanes share the queue of each host """
+    while True:
+        try:
+            x, func, args, kwargs = queue.popleft()
+        except IndexError:
+            return
+        try:
+            results[x] = _call(func, args, kwargs, priority)
+        except Exception as exc:
+            kodi_traceback(exc, 'lib.api.batch run_batch', notification=False)
+
+
+def run_batch(calls, host_limits=None):
+    """
+    Run list of (host, func, args, kwargs) calls concurrently with at most host_limits[host] in flight per host
+    Returns results in the same order as calls. Calls which raised are logged and return None
+    """
+    if not calls:
+        return []
+    host_limits = host_limits or {}
+    queues = {}
+    for x, (host, func, args, kwargs) in enumerate(calls):
+        queues.setdefault(host, deque()).append((x, func, args, kwargs))
+    lanes = [queue for host, queue in queues.items() for _ in range(min(len(queue), host_limits.get(host) or BATCH_HOST_DEFAULT))]
+    results = [None] * len(calls)
+    with ParallelThread(lanes, _run_lane, results, get_scheduler().get_thread_priority()):
+        pass
+    return results
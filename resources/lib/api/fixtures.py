@@ -0,0 +1,208 @@
+""" Record API responses to fixture files and replay them from a local server for offline benchmarks
+Fixtures are stored as one JSON file per request in {folder}/{api name}/
+    api, method, path (relative to API base url without keys), status, headers, body, latency
+Replaying points RequestAPI base urls at http://host:port/{api name} via the FIXTURES_REPLAY_PROPERTY
+Only replay servers on this device are used and keys, tokens and posted credentials are never sent to them
+Module only uses the standard library so that the replay server can be run outside of Kodi:
+    python3 -m resources.lib.api.fixtures /path/to/fixtures --port 8765 --latency-scale 1 --jitter 0.05 --fault-429 0.02
+"""
+import os
+import json
+import random
+import hashlib
+from time import sleep
+from threading import Lock, Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+FIXTURES_RECORD_PROPERTY = 'Fixtures.Record'  # Folder to record responses to
+FIXTURES_REPLAY_PROPERTY = 'Fixtures.Replay'  # Base url of replay server e.g. http://127.0.0.1:8765
+FIXTURES_STRIP_PARAMS = ['api_key', 'apikey', 'client_key']  # Query params holding keys. Never recorded, matched on or replayed
+FIXTURES_STRIP_HEADERS = ['authorization', 'trakt-api-key', 'api-key', 'client-key']  # Lower case request headers never replayed
+FIXTURES_REPLAY_HOSTS = ['127.0.0.1', 'localhost', '::1']
+FIXTURES_HEADERS = [
+    'Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Retry-After',
+    'X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset', 'X-Ratelimit',
+    'X-Pagination-Page', 'X-Pagination-Limit', 'X-Pagination-Page-Count', 'X-Pagination-Item-Count',
+    'X-Sort-By', 'X-Sort-How']  # Other headers describe the original connection or the account e.g. cookies
+FIXTURES_RETRY_AFTER = 1
+FIXTURES_5XX_STATUS = 503
+
+_record_lock = Lock()
+
+
+def get_fixture_path(path):
+    """ Path relative to API base url with doubled slashes and key params removed so recording and replay match """
+    split = urlsplit(path)
+    path = '/' + '/'.join(i for i in split.path.split('/') if i)
+    query = [(k, v) for k, v in parse_qsl(split.query, keep_blank_values=True) if k not in FIXTURES_STRIP_PARAMS]
+    return f'{path}?{urlencode(query)}' if query else path
+
+
+def get_replay_url(url):
+    """ Base url of replay server without trailing slash or None if it isn't a http server on this device """
+    try:
+        split = urlsplit(url or '')
+        is_replay = split.scheme == 'http' and split.hostname in FIXTURES_REPLAY_HOSTS and split.port is not None
+    except ValueError:
+        return
+    return url.rstrip('/') if is_replay else None
+
+
+def get_replay_request(url, headers=None):
+    """ Returns (url, headers) with key params and authorization headers removed for sending to replay server """
+    split = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(split.query, keep_blank_values=True) if k not in FIXTURES_STRIP_PARAMS]
+    headers = {k: v for k, v in (headers or {}).items() if k.lower() not in FIXTURES_STRIP_HEADERS}
+    return urlunsplit(split._replace(query=urlencode(query))), headers or None
+
+
+def get_fixture_filename(api_name, method, path):
+    return os.path.join(api_name, f'{hashlib.sha1(f"{method} {path}".encode("utf-8")).hexdigest()}.json')
+
+
+def save_fixture(folder, api_name, path, response, latency, method='GET'):
+    """ Write requests response for request path to fixture file. Returns filename """
+    path = get_fixture_path(path)
+    fixture = {
+        'api': api_name,
+        'method': method,
+        'path': path,
+        'status': response.status_code,
+        'headers': {k: response.headers[k] for k in FIXTURES_HEADERS if k in response.headers},
+        'body': response.text,
+        'latency': round(latency, 4)}
+    filename = os.path.join(folder, get_fixture_filename(api_name, method, path))
+    with _record_lock:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(f'{filename}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(fixture, file, indent=2)
+        os.replace(f'{filename}.tmp', filename)
+    return filename
+
+
+def load_fixtures(folder):
+    """ Returns dict of {(api name, method, path): fixture} for every fixture file in folder """
+    fixtures = {}
+    for api_name in os.listdir(folder):
+        if not os.path.isdir(os.path.join(folder, api_name)):
+            continue
+        for filename in os.listdir(os.path.join(folder, api_name)):
+            if not filename.endswith('.json'):
+                continue
+            with open(os.path.join(folder, api_name, filename), encoding='utf-8') as file:
+                fixture = json.load(file)
+            fixtures[(fixture['api'], fixture['method'], fixture['path'])] = fixture
+    return fixtures
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive so that replay exercises the same session pools as the real APIs
+
+    def do_GET(self):
+        self.replay('GET')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.replay('POST')
+
+    def replay(self, method):
+        api_name, _, path = self.path.lstrip('/').partition('/')
+        status, headers, body, latency = self.server.get_response(api_name, method, get_fixture_path(path))
+        sleep(latency)
+        body = body.encode('utf-8')
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(
+            self, fixtures, address=('127.0.0.1', 0), latency=None, latency_scale=1.0, jitter=0.0,
+            fault_429=0.0, fault_5xx=0.0, seed=None):
+        """
+        Threaded HTTP server answering requests with recorded fixtures
+        Each response waits for the recorded latency times latency_scale or for latency if given plus up to +/- jitter
+        fault_429 and fault_5xx are the chance of answering any request with 429 or FIXTURES_5XX_STATUS instead
+        Requests without a fixture get 404
+        """
+        ThreadingHTTPServer.__init__(self, address, _ReplayHandler)
+        self.fixtures = load_fixtures(fixtures) if isinstance(fixtures, str) else fixtures
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.jitter = jitter
+        self.fault_429 = fault_429
+        self.fault_5xx = fault_5xx
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self.stats = {'replayed': 0, 'missing': 0, 'fault_429': 0, 'fault_5xx': 0}
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def get_response(self, api_name, method, path):
+        """ Returns (status, headers, body, latency) for request """
+        fixture = self.fixtures.get((api_name, method, path))
+        with self._lock:
+            roll, jitter = self._random.random(), self._random.uniform(-self.jitter, self.jitter)
+            latency = self.latency if self.latency is not None else (fixture or {}).get('latency', 0) * self.latency_scale
+            latency = max(latency + jitter, 0)
+            if roll < self.fault_429:
+                self.stats['fault_429'] += 1
+                return (429, {'Retry-After': str(FIXTURES_RETRY_AFTER), 'Content-Type': 'application/json'}, '{}', latency)
+            if roll < self.fault_429 + self.fault_5xx:
+                self.stats['fault_5xx'] += 1
+                return (FIXTURES_5XX_STATUS, {'Content-Type': 'application/json'}, '{}', latency)
+            if not fixture:
+                self.stats['missing'] += 1
+                return (404, {'Content-Type': 'application/json'}, json.dumps({'status_message': f'No fixture for {method} {path}'}), latency)
+            self.stats['replayed'] += 1
+        return (fixture['status'], fixture['headers'], fixture['body'], latency)
+
+    def start(self):
+        """ Serve from a daemon thread. Returns base url to set as FIXTURES_REPLAY_PROPERTY """
+        Thread(target=self.serve_forever, name='Fixtures Replay Server', daemon=True).start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay recorded TMDbHelper API fixtures')
+    parser.add_argument('folder')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=None, help='Fixed latency in seconds instead of recorded latency')
+    parser.add_argument('--latency-scale', type=float, default=1.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--fault-429', type=float, default=0.0)
+    parser.add_argument('--fault-5xx', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    server = ReplayServer(
+        args.folder, (args.host, args.port), latency=args.latency, latency_scale=args.latency_scale,
+        jitter=args.jitter, fault_429=args.fault_429, fault_5xx=args.fault_5xx, seed=args.seed)
+    print(f'Replaying {len(server.fixtures)} fixtures on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print(server.stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+""" Latency, transfer and cache outcome accounting for API requests
+Samples are counted in memory per process then added to a small sqlite store shared by every process
+Counters are kept per hour so the store only holds METRICS_KEEP_HOURS of history
+Requests are grouped by endpoint template of the request path e.g. tv/{id}/season/{n}
+"""
+import re
+import atexit
+import sqlite3
+from time import time
+from threading import Lock
+from resources.lib.addon.plugin import kodi_log
+from resources.lib.files.utils import get_file_path
+
+METRICS_FOLDER = 'api_metrics'
+METRICS_FILENAME = 'api_metrics.db'
+METRICS_WINDOW = 3600  # Seconds of samples counted together
+METRICS_KEEP_HOURS = 7 * 24
+METRICS_FLUSH_TIME = 60  # Seconds between writes to store by long running processes such as the service
+METRICS_MAX_TEMPLATES = 200  # Endpoint templates counted per API. Others are counted as {other}
+METRICS_TIMEOUT = 5
+METRICS_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)  # Upper bounds in seconds of latency histogram
+
+# Cache outcomes counted by record_cache. Named apart from the files.cache sentinels which they are often imported alongside
+OUTCOME_HIT = 'hit'  # Returned from cache without a request including stale objects and requests made by another thread
+OUTCOME_MISS = 'miss'  # Requested from the API including requests which failed or had nothing to return
+OUTCOME_NOT_MODIFIED = 'not_modified'  # Expired object revalidated by a 304 response
+OUTCOME_NEGATIVE = 'negative'  # Skipped because the request recently had nothing to return
+
+TEMPLATE_NUMBER_AFTER = ['season', 'seasons', 'episode', 'episodes', 'page']  # Numbers after these are {n} rather than {id}
+TEMPLATE_SLUG_AFTER = ['users', 'lists']  # Trakt user names and list slugs aren't numeric
+TEMPLATE_SLUG_WORDS = ['me', 'likes', 'comments', 'items', 'trending', 'popular']  # Endpoints rather than slugs after those
+TEMPLATE_ID = re.compile(r'^(?:tt|nm)?\d+$|^[a-z0-9-]*\d[a-z0-9-]*$')  # Numbers, IMDb ids and slugs with numbers in them
+
+_pending = {}  # {(hour, api, template, metric): value}
+_templates = {}  # {api: set of templates counted in this process}
+_lock = Lock()
+_flushed = {'time': time()}
+
+
+def get_endpoint_template(path):
+    """ Request path with query and ids replaced e.g. tv/1399/season/2?language=en -> tv/{id}/season/{n} """
+    segments = [i for i in path.split('?', 1)[0].split('/') if i]
+    template = []
+    for x, i in enumerate(segments):
+        previous = segments[x - 1] if x else ''
+        if previous in TEMPLATE_SLUG_AFTER and i not in TEMPLATE_SLUG_WORDS:
+            template.append('{slug}')
+        elif TEMPLATE_ID.match(i):
+            template.append('{n}' if previous in TEMPLATE_NUMBER_AFTER else '{id}')
+        else:
+            template.append(i)
+    return '/'.join(template) or '/'
+
+
+def _add(key, value=1):
+    _pending[key] = _pending.get(key, 0) + value
+
+
+def _get_template(api_name, path):
+    template = get_endpoint_template(path)
+    templates = _templates.setdefault(api_name, set())
+    if template not in templates:
+        if len(templates) >= METRICS_MAX_TEMPLATES:
+            return '{other}'
+        templates.add(template)
+    return template
+
+
+def record_request(api_name, path, status, latency, size=0, wire_size=0, retries=0):
+    """ Count one response from the API. status is None if the request failed without a response """
+    window = int(time() // METRICS_WINDOW * METRICS_WINDOW)
+    with _lock:
+        key = (window, api_name, _get_template(api_name, path))
+        _add(key + ('requests', ))
+        _add(key + (f'status.{status or "error"}', ))
+        _add(key + ('latency', ), latency)
+        _add(key + (f'latency.{next((x for x, i in enumerate(METRICS_LATENCY_BUCKETS) if latency <= i), len(METRICS_LATENCY_BUCKETS))}', ))
+        _pending[key + ('latency_max', )] = max(_pending.get(key + ('latency_max', ), 0), latency)
+        _add(key + ('bytes', ), size)
+        _add(key + ('wire_bytes', ), wire_size)
+        if retries:
+            _add(key + ('retries', ), retries)
+        is_flush = time() - _flushed['time'] > METRICS_FLUSH_TIME
+    if is_flush:
+        flush_metrics()
+
+
+def record_cache(api_name, path, outcome):
+    """ Count outcome of a cached request """
+    window = int(time() // METRICS_WINDOW * METRICS_WINDOW)
+    with _lock:
+        _add((window, api_name, _get_template(api_name, path), f'cache.{outcome}'))
+
+
+def _connect():
+    connection = sqlite3.connect(get_file_path(METRICS_FOLDER, METRICS_FILENAME), timeout=METRICS_TIMEOUT, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS api_metrics("
+        "hour INTEGER, api TEXT, template TEXT, metric TEXT, value REAL, "
+        "PRIMARY KEY (hour, api, template, metric)) WITHOUT ROWID")
+    return connection
+
+
+@atexit.register
+def flush_metrics():
+    """ Add counts from this process to the store and drop hours older than METRICS_KEEP_HOURS """
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _flushed['time'] = time()
+    if not pending:
+        return
+    rows = [k + (v, ) for k, v in pending.items() if k[3] != 'latency_max']
+    max_rows = [k + (v, ) for k, v in pending.items() if k[3] == 'latency_max']
+    try:
+        connection = _connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("INSERT OR IGNORE INTO api_metrics VALUES (?, ?, ?, ?, 0)", [i[:4] for i in rows + max_rows])
+            connection.executemany(
+                "UPDATE api_metrics SET value = value + ? WHERE hour = ? AND api = ? AND template = ? AND metric = ?",
+                [(i[4], ) + i[:4] for i in rows])
+            connection.executemany(
+                "UPDATE api_metrics SET value = max(value, ?) WHERE hour = ? AND api = ? AND template = ? AND metric = ?",
+                [(i[4], ) + i[:4] for i in max_rows])
+            connection.execute("DELETE FROM api_metrics WHERE hour < ?", (int(time()) - METRICS_KEEP_HOURS * 3600, ))
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+    except sqlite3.Error as exc:
+        kodi_log(f'APIMetrics: Unable to write {len(pending)} counters\n{exc}', 1)
+
+
+def _get_percentile(buckets, total, latency_max, percentile):
+    """ Upper bound of histogram bucket holding percentile """
+    count = 0
+    for x, i in enumerate(buckets):
+        count += i
+        if count >= total * percentile:
+            return METRICS_LATENCY_BUCKETS[x] if x < len(METRICS_LATENCY_BUCKETS) else latency_max
+
+
+def _get_summary(metrics):
+    requests = int(metrics.get('requests', 0))
+    buckets = [int(metrics.get(f'latency.{x}', 0)) for x in range(len(METRICS_LATENCY_BUCKETS) + 1)]
+    cache = {k[6:]: int(v) for k, v in metrics.items() if k.startswith('cache.')}
+    reads = sum(cache.values())
+    return {
+        'requests': requests,
+        'latency_total': round(metrics.get('latency', 0), 3),
+        'latency_avg': round(metrics.get('latency', 0) / requests, 3) if requests else None,
+        'latency_p50': _get_percentile(buckets, requests, metrics.get('latency_max', 0), 0.5) if requests else None,
+        'latency_p95': _get_percentile(buckets, requests, metrics.get('latency_max', 0), 0.95) if requests else None,
+        'latency_max': round(metrics.get('latency_max', 0), 3),
+        'latency_buckets': buckets,
+        'bytes': int(metrics.get('bytes', 0)),
+        'wire_bytes': int(metrics.get('wire_bytes', 0)),
+        'retries': int(metrics.get('retries', 0)),
+        'status': {k[7:]: int(v) for k, v in metrics.items() if k.startswith('status.')},
+        'cache': cache,
+        'cache_hit_rate': round(cache.get(OUTCOME_HIT, 0) / reads, 3) if reads else None}
+
+
+def get_metrics_report(hours=24):
+    """
+    Counters from every process over the last hours summed per API and per endpoint template
+    Returns dict of {api: {'total': summary, 'templates': {template: summary}}}
+    """
+    flush_metrics()
+    try:
+        connection = _connect()
+        try:
+            cursor = connection.execute(
+                "SELECT api, template, metric, sum(value), max(value) FROM api_metrics WHERE hour >= ? GROUP BY api, template, metric",
+                (int(time() // METRICS_WINDOW * METRICS_WINDOW) - (hours - 1) * METRICS_WINDOW, ))
+            rows = cursor.fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as exc:
+        kodi_log(f'APIMetrics: Unable to read counters\n{exc}', 1)
+        return {}
+    apis = {}
+    for api, template, metric, value_sum, value_max in rows:
+        value = value_max if metric == 'latency_max' else value_sum
+        templates = apis.setdefault(api, {})
+        templates.setdefault(template, {})[metric] = value
+        totals = templates.setdefault(None, {})
+        totals[metric] = max(totals.get(metric, 0), value) if metric == 'latency_max' else totals.get(metric, 0) + value
+    return {
+        api: {
+            'total': _get_summary(templates.pop(None)),
+            'templates': {k: _get_summary(v) for k, v in templates.items()}}
+        for api, templates in apis.items()}
@@ -1,5 +1,5 @@
 from resources.lib.addon.setutils import del_empty_keys, merge_two_dicts
-from resources.lib.api.request import RequestAPI
+from resources.lib.api.request import RequestAPI, NEGATIVE_EMPTY
 from resources.lib.api.omdb.mapping import ItemMapper
 from resources.lib.addon.plugin import get_setting
 
@@ -11,6 +11,11 @@ class OMDb(RequestAPI):
             req_api_name='OMDb',
             req_api_url='https://www.omdbapi.com/',
             delay_write=delay_write)
+        self.req_negative_days = {'': {NEGATIVE_EMPTY: 1}}  # Single endpoint so every lookup is in the unnamed family
+
+    def is_empty_response(self, response):
+        """ Items which aren't found are a 200 response with response="False" on the root element """
+        return not response or (response.get('root') or {}).get('response') == 'False'
 
     def get_request_item(self, imdb_id=None, title=None, year=None, tomatoes=True, fullplot=True, cache_only=False):
         kwparams = {}
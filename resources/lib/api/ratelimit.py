@@ -0,0 +1,188 @@
+import time
+import sqlite3
+import calendar
+from json import loads
+from threading import Lock
+from xbmc import Monitor
+from email.utils import parsedate_to_datetime
+from resources.lib.addon.plugin import kodi_log
+from resources.lib.files.simplecache import DATABASE_NAME
+from resources.lib.files.utils import get_file_path
+
+RATE_LIMIT_DB = 'ratelimit.db'
+RATE_LIMIT_MAX_WAIT = 30  # Give up rather than queue a request for longer than this many seconds
+RATE_LIMIT_BACKOFF = 2  # Seconds to pause an API which sent 429 without telling us how long to wait
+RATE_LIMITS = {
+    # api_name: (bucket capacity, tokens refilled per second)
+    'TMDb': (40, 40.0),
+    'TraktAPI': (40, 3.3),  # 1000 GET calls per 5 minutes
+    'FanartTV': (20, 10.0),
+    'OMDb': (10, 5.0)}
+RATE_LIMIT_DEFAULT = (20, 10.0)
+
+_limiters = {}
+_limiters_lock = Lock()
+
+
+def get_rate_limiter(api_name):
+    """ Get the process-wide rate limiter for api_name """
+    try:
+        return _limiters[api_name]
+    except KeyError:
+        pass
+    with _limiters_lock:
+        if api_name not in _limiters:
+            capacity, rate = RATE_LIMITS.get(api_name, RATE_LIMIT_DEFAULT)
+            _limiters[api_name] = RateLimiter(api_name, capacity, rate)
+    return _limiters[api_name]
+
+
+def get_retry_after(value):
+    """ Retry-After is either a number of seconds or an HTTP date """
+    if not value:
+        return
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return
+
+
+def get_iso_timestamp(value):
+    try:
+        return calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+    except (TypeError, ValueError):
+        return
+
+
+class RateLimiter():
+    def __init__(self, name, capacity, rate, max_wait=RATE_LIMIT_MAX_WAIT):
+        """
+        Token bucket shared between plugin processes via a table in the cache database
+        Each request reserves a token and sleeps until the bucket has refilled enough to pay for it
+        so that requests are paced in order rather than dropped
+        """
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+        self.max_wait = max_wait
+        self._db_file = get_file_path(DATABASE_NAME, RATE_LIMIT_DB)
+        self._connection = None
+        self._lock = Lock()
+        self._monitor = Monitor()
+
+    def _get_database(self):
+        if not self._connection:
+            self._connection = sqlite3.connect(self._db_file, timeout=5, isolation_level=None, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=normal")
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS ratelimit(
+                name TEXT PRIMARY KEY, tokens REAL, updated REAL, blocked REAL)""")
+        return self._connection
+
+    def _transaction(self, func):
+        """ Run func(tokens, blocked, now) atomically and store the returned (tokens, blocked, result) """
+        with self._lock:
+            connection = self._get_database()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = connection.execute(
+                    "SELECT tokens, updated, blocked FROM ratelimit WHERE name = ?", (self.name,)).fetchone()
+                tokens, updated, blocked = row if row else (self.capacity, now, 0)
+                tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+                tokens, blocked, result = func(tokens, blocked, now)
+                connection.execute(
+                    "INSERT OR REPLACE INTO ratelimit(name, tokens, updated, blocked) VALUES (?, ?, ?, ?)",
+                    (self.name, tokens, now, blocked))
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return result
+
+    def _reserve(self, tokens, blocked, now):
+        if blocked > now:
+            return tokens, blocked, blocked - now
+        tokens -= 1
+        wait_time = -tokens / self.rate if tokens < 0 else 0
+        if wait_time > self.max_wait:
+            return tokens + 1, blocked, -1  # Queue is too long so refund token and give up
+        return tokens, blocked, wait_time
+
+    def acquire(self):
+        """ Wait for a token. Returns False if the wait would be longer than max_wait """
+        timer_z = time.time() + self.max_wait
+        while not self._monitor.abortRequested():
+            try:
+                wait_time = self._transaction(self._reserve)
+            except sqlite3.Error as exc:
+                kodi_log(f'RateLimiter {self.name}: {exc}', 1)
+                return True  # Don't block requests because the database is unavailable
+            if wait_time < 0 or time.time() + wait_time > timer_z:
+                kodi_log(f'RateLimiter {self.name}: Queue wait exceeds {self.max_wait}s. Dropping request.', 1)
+                return False
+            if not wait_time:
+                return True
+            self._monitor.waitForAbort(wait_time)
+            if not self._is_blocked():
+                return True  # Slept off our reservation
+        return False
+
+    def _is_blocked(self):
+        try:
+            return self._transaction(lambda tokens, blocked, now: (tokens, blocked, blocked > now))
+        except sqlite3.Error:
+            return False
+
+    def block(self, wait_time):
+        """ Pause all requests to the API for wait_time seconds and empty the bucket """
+        def _block(tokens, blocked, now):
+            return min(tokens, 0), max(blocked, now + wait_time), None
+        try:
+            self._transaction(_block)
+        except sqlite3.Error as exc:
+            kodi_log(f'RateLimiter {self.name}: {exc}', 1)
+        kodi_log(f'RateLimiter {self.name}: Pausing requests for {wait_time:.1f} seconds', 1)
+
+    def _set_remaining(self, remaining, reset_time=None):
+        def _remaining(tokens, blocked, now):
+            if remaining < 1 and reset_time and reset_time > now:
+                blocked = max(blocked, reset_time)
+            return min(tokens, remaining), blocked, None
+        try:
+            self._transaction(_remaining)
+        except sqlite3.Error as exc:
+            kodi_log(f'RateLimiter {self.name}: {exc}', 1)
+
+    def update(self, status_code, headers):
+        """ Adjust the bucket from the response status and rate limit headers """
+        headers = headers or {}
+        retry_after = get_retry_after(headers.get('Retry-After'))
+        if status_code == 429:
+            return self.block(retry_after if retry_after is not None else RATE_LIMIT_BACKOFF)
+        if retry_after and status_code == 503:
+            return self.block(retry_after)
+
+        # Trakt sends a JSON object describing the limit that was applied to the request
+        trakt_limit = headers.get('X-Ratelimit')
+        if trakt_limit:
+            try:
+                trakt_limit = loads(trakt_limit)
+                return self._set_remaining(int(trakt_limit['remaining']), get_iso_timestamp(trakt_limit.get('until')))
+            except (ValueError, KeyError, TypeError):
+                pass
+
+        # Generic X-RateLimit-Remaining / X-RateLimit-Reset (epoch) headers
+        remaining = headers.get('X-RateLimit-Remaining')
+        if remaining is None:
+            return
+        try:
+            reset_time = float(headers.get('X-RateLimit-Reset') or 0) or None
+            self._set_remaining(int(remaining), reset_time)
+        except ValueError:
+            return
@@ -4,14 +4,44 @@ from resources.lib.addon.window import get_property
 from resources.lib.addon.plugin import kodi_log, get_localized, get_condvisibility
 from resources.lib.addon.parser import try_int
 from resources.lib.addon.timedate import get_timestamp, set_timestamp
-from resources.lib.files.cache import BasicCache, CACHE_SHORT, CACHE_LONG
+from resources.lib.files.cache import BasicCache, CACHE_SHORT, CACHE_LONG, CACHE_STALE, CACHE_NOT_MODIFIED
+from resources.lib.api.ratelimit import get_rate_limiter
+from resources.lib.api.scheduler import get_scheduler, PRIORITY_FOREGROUND
+from resources.lib.api.batch import run_batch
+from resources.lib.api.fixtures import save_fixture, get_replay_url, get_replay_request, FIXTURES_RECORD_PROPERTY, FIXTURES_REPLAY_PROPERTY
+from resources.lib.api.metrics import record_request, record_cache, OUTCOME_HIT, OUTCOME_MISS, OUTCOME_NOT_MODIFIED, OUTCOME_NEGATIVE
 from copy import copy
 from json import loads, dumps
+from threading import Lock, local
+from timeit import default_timer as timer
+from urllib.parse import urlparse
 # from resources.lib.addon.decorators import timer_func
 # import requests
 
 requests = None  # Requests module is slow to import so lazy import via decorator instead
 
+SESSION_POOL_MAXSIZE = {
+    'api.themoviedb.org': 20,  # ItemBuilder makes parallel details requests for every item on a page
+    'api.trakt.tv': 10,
+    'webservice.fanart.tv': 10,
+    'www.omdbapi.com': 4}
+SESSION_POOL_DEFAULT = 4
+SESSION_RETRIES = 2
+SESSION_BACKOFF = 0.3
+SESSION_RETRY_STATUS = [502, 503, 504]
+RATE_LIMIT_RETRIES = 2
+
+NEGATIVE_NOT_FOUND = 'not_found'  # API responded 404/410 for the request
+NEGATIVE_EMPTY = 'empty'  # API responded 200 with nothing in it
+NEGATIVE_CACHE_DAYS = {NEGATIVE_NOT_FOUND: 1, NEGATIVE_EMPTY: 0}  # Empty responses are only remembered for families opted in
+NEGATIVE_NOT_FOUND_STATUS = [404, 410]
+
+_sessions = {}
+_sessions_lock = Lock()
+_sessions_stats = {}
+_negative_stats = {'avoided': 0, NEGATIVE_NOT_FOUND: 0, NEGATIVE_EMPTY: 0}
+_replay_hosts = {}  # {replay server host/api name: API host} so replayed requests use the session pool sized for the API
+
 
 def lazyimport_requests(func):
     def wrapper(*args, **kwargs):
@@ -22,6 +52,83 @@ def lazyimport_requests(func):
     return wrapper
 
 
+def get_negative_cache_stats():
+    return _negative_stats
+
+
+def get_api_url(req_api_url=None, req_api_name=None):
+    """ Base url of API or of the fixtures replay server whilst FIXTURES_REPLAY_PROPERTY is set to a server on this device """
+    req_api_url = req_api_url or ''
+    replay_url = get_replay_url(get_property(FIXTURES_REPLAY_PROPERTY)) if req_api_name else None
+    if not replay_url:
+        return req_api_url
+    _replay_hosts[f'{urlparse(replay_url).netloc}/{req_api_name}'] = urlparse(req_api_url).netloc
+    return f'{replay_url}/{req_api_name}{"/" if req_api_url.endswith("/") else ""}'
+
+
+def get_session_host(request):
+    url = urlparse(request or '')
+    if not _replay_hosts:
+        return url.netloc
+    return _replay_hosts.get(f'{url.netloc}/{url.path.lstrip("/").split("/", 1)[0]}', url.netloc)
+
+
+def get_session(request):
+    """ Get a keep-alive session with a connection pool sized for the host of the request url
+    Sessions are shared by every RequestAPI instance in the process so ParallelThread workers reuse connections
+    """
+    host = get_session_host(request)
+    try:
+        return _sessions[host]
+    except KeyError:
+        pass
+    with _sessions_lock:
+        if host in _sessions:
+            return _sessions[host]
+        pool_maxsize = SESSION_POOL_MAXSIZE.get(host, SESSION_POOL_DEFAULT)
+        retries = requests.adapters.Retry(
+            total=SESSION_RETRIES, read=1, status=SESSION_RETRIES,
+            backoff_factor=SESSION_BACKOFF, status_forcelist=SESSION_RETRY_STATUS,
+            raise_on_status=False)  # Return the final response so RequestAPI error checking still applies
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retries)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _sessions_stats[host] = {'requests': 0, 'adapter': adapter}
+        _sessions[host] = session
+    return session
+
+
+def get_session_stats():
+    """ Per host counts of requests made and connections opened by the session pools
+    reused is the number of requests which did not need a new TCP/TLS handshake
+    """
+    stats = {}
+    with _sessions_lock:
+        sessions_stats = {k: dict(v) for k, v in _sessions_stats.items()}
+    for host, data in sessions_stats.items():
+        connections = 0
+        try:
+            pools = data['adapter'].poolmanager.pools
+            connections = sum(pools[k].num_connections for k in pools.keys())
+        except Exception:
+            pass
+        stats[host] = {
+            'requests': data['requests'],
+            'connections': connections,
+            'reused': max(data['requests'] - connections, 0)}
+    return stats
+
+
+def close_sessions():
+    """ Close pooled connections. Called by the service on exit since its process outlives plugin calls """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _sessions_stats.clear()
+
+
 def dictify(r, root=True):
     if root:
         return {r.tag: dictify(r, False)}
@@ -44,7 +151,8 @@ def translate_xml(request):
 
 class RequestAPI(object):
     def __init__(self, req_api_url=None, req_api_key=None, req_api_name=None, timeout=None, delay_write=False):
-        self.req_api_url = req_api_url or ''
+        self.req_api_url = get_api_url(req_api_url, req_api_name)
+        self.req_replay = self.req_api_url != (req_api_url or '')  # Requests go to fixtures replay server
         self.req_api_key = req_api_key or ''
         self.req_api_name = req_api_name or ''
         self.req_timeout_err_prop = f'TimeOutError.{self.req_api_name}'
@@ -54,19 +162,49 @@ class RequestAPI(object):
         self.req_500_err_prop = f'500Error.{self.req_api_name}'
         self.req_500_err = get_property(self.req_500_err_prop)
         self.req_500_err = loads(self.req_500_err) if self.req_500_err else {}
+        self.req_rate_limiter = get_rate_limiter(self.req_api_name)
+        self.req_priority = PRIORITY_FOREGROUND  # Scheduler priority of requests to this API unless thread asks for another
+        self.req_status = local()  # Status code of last response in this thread for negative caching
+        self.req_negative_days = {}  # Endpoint family: {marker type: days} to override NEGATIVE_CACHE_DAYS
         self.req_strip = [(self.req_api_url, self.req_api_name), (self.req_api_key, ''), ('is_xml=False', ''), ('is_xml=True', '')]
+        self.req_fixtures = get_property(FIXTURES_RECORD_PROPERTY)  # Folder to record responses to for replaying offline
         self.headers = None
         self.timeout = timeout or 10
         self._cache = BasicCache(filename=f'{req_api_name or "requests"}.db', delay_write=delay_write)
+        self._negative_cache = BasicCache(filename=f'{req_api_name or "requests"}_negative.db')  # Kept apart from objects and their statistics
 
-    def get_api_request_json(self, request=None, postdata=None, headers=None, is_xml=False):
-        request = self.get_api_request(request=request, postdata=postdata, headers=headers)
+    def get_api_request_json(self, request=None, postdata=None, headers=None, is_xml=False, validators=None):
+        """
+        Get the request and translate to dict
+        Passing validators dict makes a conditional request and returns a tuple of (dict, validators)
+        CACHE_NOT_MODIFIED is returned as the dict if the server responds 304
+        """
+        if validators is not None:
+            return self.get_api_request_json_validated(request, postdata, headers, is_xml, validators)
+        self.req_status.outcome = OUTCOME_MISS
+        response = self.get_api_request(request=request, postdata=postdata, headers=headers)
         if is_xml:
-            return translate_xml(request)
-        if request:
-            return request.json()
+            return self.get_nonempty_response(request, translate_xml(response))
+        if response:
+            return self.get_nonempty_response(request, response.json())
         return {}
 
+    def get_api_request_json_validated(self, request=None, postdata=None, headers=None, is_xml=False, validators=None):
+        headers = dict(headers or {})
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('modified'):
+            headers['If-Modified-Since'] = validators['modified']
+        response = self.get_api_request(request=request, postdata=postdata, headers=headers or None)
+        if response is not None and response.status_code == 304:
+            self.req_status.outcome = OUTCOME_NOT_MODIFIED
+            return (CACHE_NOT_MODIFIED, None)
+        self.req_status.outcome = OUTCOME_MISS
+        if not response:
+            return (translate_xml(response) if is_xml else {}, None)
+        validators = {'etag': response.headers.get('ETag'), 'modified': response.headers.get('Last-Modified')}
+        return (self.get_nonempty_response(request, translate_xml(response) if is_xml else response.json()), validators)
+
     def nointernet_err(self, err, log_time=900):
         # Check Kodi internet status to confirm network is down
         if get_condvisibility("System.InternetState"):
@@ -118,14 +256,22 @@ class RequestAPI(object):
 
     @lazyimport_requests
     def get_simple_api_request(self, request=None, postdata=None, headers=None, method=None):
+        if self.req_replay:  # Keys, tokens and posted credentials are never sent to the replay server
+            request, headers = get_replay_request(request, headers)
+            method, postdata = method or ('post' if postdata else None), None
         try:
+            session = get_session(request)
+            with _sessions_lock:
+                stats = _sessions_stats.get(get_session_host(request))  # Cleared if sessions are closed whilst in use
+                if stats:
+                    stats['requests'] += 1
             if method == 'delete':
-                return requests.delete(request, headers=headers, timeout=self.timeout)
+                return session.delete(request, headers=headers, timeout=self.timeout)
             if method == 'put':
-                return requests.put(request, data=postdata, headers=headers, timeout=self.timeout)
+                return session.put(request, data=postdata, headers=headers, timeout=self.timeout)
             if postdata or method == 'post':  # If pass postdata assume we want to post
-                return requests.post(request, data=postdata, headers=headers, timeout=self.timeout)
-            return requests.get(request, headers=headers, timeout=self.timeout)
+                return session.post(request, data=postdata, headers=headers, timeout=self.timeout)
+            return session.get(request, headers=headers, timeout=self.timeout)
         except requests.exceptions.ConnectionError as errc:
             self.connection_error(errc, check_status=True)
         except requests.exceptions.Timeout as errt:
@@ -144,9 +290,24 @@ class RequestAPI(object):
             return
 
         # Get response
-        response = self.get_simple_api_request(request, postdata, headers)
-        if response is None or not response.status_code:
-            return
+        # Requests wait for a scheduler slot so that foreground requests go ahead of background ones
+        # Requests are paced by the shared rate limiter and retried after waiting if the API still sends 429
+        with get_scheduler().slot(self.req_priority):
+            for x in range(RATE_LIMIT_RETRIES + 1):
+                if not self.req_rate_limiter.acquire():
+                    return
+                timer_a = timer()
+                response = self.get_simple_api_request(request, postdata, headers)
+                latency = timer() - timer_a
+                self.record_metrics(request, response, latency, retries=x)
+                if self.req_fixtures and response is not None and request.startswith(self.req_api_url):
+                    self.record_fixture(request, postdata, response, latency)
+                self.req_status.code = response.status_code if response is not None else None
+                if response is None or not response.status_code:
+                    return
+                self.req_rate_limiter.update(response.status_code, response.headers)
+                if response.status_code != 429:
+                    break
 
         # Some error checking
         if not response.status_code == 200 and try_int(response.status_code) >= 400:  # Error Checking
@@ -154,9 +315,9 @@ class RequestAPI(object):
             # In this case let's set a connection error and suppress retries for a minute
             if response.status_code == 500:
                 self.fivehundred_error(request)
-            # 429 is too many requests code so suppress retries for a minute
+            # 429 is too many requests code and we've already waited and retried so give up on this request
             elif response.status_code == 429:
-                self.connection_error(429)
+                kodi_log(f'HTTP Error Code: 429\nRequest: {request.replace(self.req_api_key, "") if request else None}', 1)
             # Don't write 400 Bad Request error to log
             # 401 == OAuth / API key required
             elif try_int(response.status_code) > 400:
@@ -172,6 +333,34 @@ class RequestAPI(object):
         # Return our response
         return response
 
+    def get_request_path(self, request):
+        """ Request url relative to base url of API """
+        if request.startswith(self.req_api_url):
+            return request[len(self.req_api_url):]
+        return urlparse(request).path
+
+    def record_metrics(self, request, response, latency, retries=0):
+        """ Count latency, transfer size and status of response for api_report """
+        if response is None:
+            record_request(self.req_api_name, self.get_request_path(request), None, latency, retries=retries)
+            return
+        raw_retries = getattr(getattr(response.raw, 'retries', None), 'history', None) or ()  # Retried by session adapter
+        try:
+            wire_size = response.raw.tell()  # Bytes read from socket before decompression
+        except (AttributeError, OSError):
+            wire_size = 0
+        record_request(
+            self.req_api_name, self.get_request_path(request), response.status_code, latency,
+            size=len(response.content or b''), wire_size=wire_size, retries=retries + len(raw_retries))
+
+    def record_fixture(self, request, postdata, response, latency):
+        try:
+            save_fixture(
+                self.req_fixtures, self.req_api_name, request[len(self.req_api_url):], response, latency,
+                method='POST' if postdata else 'GET')
+        except (OSError, ValueError) as exc:
+            kodi_log(f'Fixtures: Unable to record {self.req_api_name} response\n{exc}', 1)
+
     def get_request_url(self, *args, **kwargs):
         """
         Creates a url request string:
@@ -187,25 +376,120 @@ class RequestAPI(object):
         kws = '&'.join((f'{k}={v}' for k, v in kwargs.items() if v is not None))
         return sep.join((url, kws)) if kws else url
 
+    def get_negative_name(self, request_url):
+        for k, v in self.req_strip:
+            request_url = request_url.replace(k, v)
+        return f'negative.{request_url}'
+
+    def get_negative_family(self, request_url):
+        """ First path segment of request e.g. search, movie, tv """
+        path = request_url[len(self.req_api_url):] if request_url.startswith(self.req_api_url) else request_url
+        return path.lstrip('/').split('?', 1)[0].split('/', 1)[0].split('&', 1)[0]
+
+    def get_negative_days(self, request_url, marker):
+        return self.req_negative_days.get(self.get_negative_family(request_url), {}).get(marker, NEGATIVE_CACHE_DAYS[marker])
+
+    def is_empty_response(self, response):
+        """ Response has nothing in it. Overridden by APIs which describe an empty result instead of returning nothing """
+        return not response
+
+    def get_nonempty_response(self, request_url, response):
+        """
+        Empty results are returned as {} for families which remember them
+        Then they are kept by the negative cache for its days instead of by the cache for cache_days
+        """
+        if not response or not self.get_negative_days(request_url, NEGATIVE_EMPTY) or not self.is_empty_response(response):
+            return response
+        return {}
+
+    def get_negative_cache(self, negative_name):
+        """ Returns marker type if request recently had nothing to return """
+        marker = self._negative_cache.get_cache(negative_name)
+        if not marker:
+            return
+        _negative_stats['avoided'] += 1
+        return marker.get('negative')
+
+    def is_negative_cache(self, negative_name):
+        """ Checked by use_cache once object is missing from cache so that cached objects never need the extra lookup """
+        self.req_status.negative = bool(self.get_negative_cache(negative_name))
+        return self.req_status.negative
+
+    def set_negative_cache(self, negative_name, request_url):
+        """ Remember that request had nothing to return. Only 404/410 and empty 200 responses are remembered """
+        status_code = getattr(self.req_status, 'code', None)
+        if status_code in NEGATIVE_NOT_FOUND_STATUS:
+            marker = NEGATIVE_NOT_FOUND
+        elif status_code == 200:
+            marker = NEGATIVE_EMPTY
+        else:
+            return  # Connection errors, timeouts and server errors are transient so request again
+        cache_days = self.get_negative_days(request_url, marker)
+        if not cache_days:
+            return
+        _negative_stats[marker] += 1
+        self._negative_cache.set_cache({'negative': marker}, negative_name, cache_days=cache_days)
+
+    def get_request_many(self, specs, func=None):
+        """
+        Run list of (args, kwargs) request specs concurrently. Returns results in the same order as specs
+        func defaults to get_request and can be any method which makes requests to this API e.g. get_request_sc
+        Concurrency is capped at the connection pool size of the API host
+        """
+        host = get_session_host(self.req_api_url)
+        func = func or self.get_request
+        return run_batch(
+            [(host, func, args, kwargs) for args, kwargs in specs],
+            host_limits={host: SESSION_POOL_MAXSIZE.get(host, SESSION_POOL_DEFAULT)})
+
     def get_request_sc(self, *args, **kwargs):
         """ Get API request using the short cache """
         kwargs['cache_days'] = CACHE_SHORT
         return self.get_request(*args, **kwargs)
 
     def get_request_lc(self, *args, **kwargs):
-        """ Get API request using the long cache """
+        """ Get API request using the long cache. Expired items are returned whilst a refresh is queued """
         kwargs['cache_days'] = CACHE_LONG
+        kwargs.setdefault('cache_stale', CACHE_STALE)
         return self.get_request(*args, **kwargs)
 
+    def get_stale_refresh(self, args, kwargs, **cache_kwargs):
+        """ Data needed to rebuild request in service when refreshing a stale cache object """
+        return {
+            'api_name': self.req_api_name,
+            'args': [i for i in args if i is not None],
+            'kwargs': kwargs,
+            'cache_kwargs': cache_kwargs}
+
+    def get_refresh_request(self, args=None, kwargs=None, cache_kwargs=None, **params):
+        """ Refresh a request queued by get_stale_refresh """
+        kwargs = kwargs or {}
+        kwargs.update(cache_kwargs or {})
+        kwargs['cache_strip'] = [tuple(i) for i in kwargs.get('cache_strip') or []]
+        return self.get_request(*(args or []), cache_refresh=True, **kwargs)
+
     def get_request(
             self, *args,
             cache_days=0, cache_name='', cache_only=False, cache_force=False, cache_fallback=False, cache_refresh=False,
-            cache_combine_name=False, cache_strip=[], headers=None, postdata=None, is_xml=False,
+            cache_combine_name=False, cache_strip=[], cache_stale=0, headers=None, postdata=None, is_xml=False,
             **kwargs):
         """ Get API request from cache (or online if no cached version) """
+        cache_stale_refresh = self.get_stale_refresh(
+            args, kwargs,
+            cache_days=cache_days, cache_name=cache_name, cache_force=cache_force, cache_fallback=cache_fallback,
+            cache_combine_name=cache_combine_name, cache_strip=cache_strip, is_xml=is_xml
+        ) if cache_stale and not postdata and not headers else None
         cache_strip = self.req_strip + cache_strip
         request_url = self.get_request_url(*args, **kwargs)
-        return self._cache.use_cache(
+
+        # Negative cache for requests which had nothing to return is kept apart from real objects
+        # Skipped if caller forces caching of a fallback object since it has its own policy for missing items
+        negative_name = self.get_negative_name(request_url) if cache_days and not cache_force and not postdata else None
+        self.req_status.negative = False
+        self.req_status.outcome = None  # Set by get_api_request_json if the object is fetched in this thread
+        self.req_status.code = None
+
+        response = self._cache.use_cache(
             self.get_api_request_json, request_url,
             headers=headers or self.headers,  # Optional override to default headers.
             postdata=postdata,  # Postdata if need to POST to a RESTful API.
@@ -217,4 +501,26 @@ class RequestAPI(object):
             cache_force=cache_force,  # Force retrieved object to be saved in cache. Use int to specify cache_days for fallback object.
             cache_fallback=cache_fallback,  # Object to force cache if no object retrieved.
             cache_combine_name=cache_combine_name,  # Combine given cache_name with auto naming via args/kwargs
+            cache_stale=cache_stale if not postdata and not headers else 0,  # Days to serve expired object whilst refreshing
+            cache_stale_refresh=cache_stale_refresh,  # Queue refresh of stale object for service
+            cache_validate=not postdata,  # Revalidate expired objects with ETag/Last-Modified instead of downloading again
+            cache_skip=(lambda: self.is_negative_cache(negative_name)) if negative_name and not cache_refresh else None,  # Recently had nothing to return
             cache_strip=cache_strip)  # Strip out api key and url from cache name
+
+        if self.req_status.negative:
+            record_cache(self.req_api_name, self.get_request_path(request_url), OUTCOME_NEGATIVE)
+            return {}
+
+        # No fetch in this thread means the object came from cache or from a request made by another thread
+        if cache_days and not cache_only:
+            record_cache(
+                self.req_api_name, self.get_request_path(request_url),
+                self.req_status.outcome or (OUTCOME_HIT if response else OUTCOME_MISS))
+
+        if not negative_name:
+            return response
+        if not response and not cache_only:
+            self.set_negative_cache(negative_name, request_url)
+        elif response and cache_refresh:
+            self._negative_cache.del_cache(negative_name)
+        return response
@@ -0,0 +1,162 @@
+import os
+from xbmc import Monitor
+from time import time
+from threading import Condition, local
+from contextlib import contextmanager
+from timeit import default_timer as timer
+from resources.lib.addon.window import get_property
+from resources.lib.addon.plugin import get_condvisibility
+
+PRIORITY_FOREGROUND = 0  # Requests for the listing or item the user is waiting on
+PRIORITY_BACKGROUND = 1  # Prefetching and extra details which can wait for the user to stop navigating
+PRIORITY_NAMES = {PRIORITY_FOREGROUND: 'foreground', PRIORITY_BACKGROUND: 'background'}
+
+SCHEDULER_MAX_ACTIVE = 24  # Requests in flight per process
+SCHEDULER_MAX_BACKGROUND = 2  # Background requests in flight per process
+SCHEDULER_WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Upper bounds in seconds of queue wait histogram
+
+FOREGROUND_PROPERTY = 'Scheduler.Foreground'  # "timestamp pid" of last foreground request by any process
+FOREGROUND_SIGNAL_TIME = 1  # Seconds between updates of FOREGROUND_PROPERTY by a process
+BACKGROUND_QUIET_TIME = 1  # Seconds without navigation or foreground requests in another process before background requests go
+BACKGROUND_MAX_DEFER = 5  # Seconds a background request is deferred at most
+BACKGROUND_POLL = 0.25
+
+
+class RequestScheduler():
+    def __init__(self, max_active=SCHEDULER_MAX_ACTIVE, max_background=SCHEDULER_MAX_BACKGROUND):
+        """
+        Orders network requests in the process by priority
+        Foreground requests always take the next free slot. Background requests only start when no foreground
+        request is waiting, are limited to max_background at once and are deferred whilst the user is navigating
+        """
+        self.max_active = max_active
+        self.max_background = max_background
+        self._condition = Condition()
+        self._active = {i: 0 for i in PRIORITY_NAMES}
+        self._waiting = {i: 0 for i in PRIORITY_NAMES}
+        self._local = local()
+        self._default = PRIORITY_FOREGROUND
+        self._signalled = 0
+        self._pid = f'{os.getpid()}'
+        self.stats = {i: {'requests': 0, 'deferred': 0, 'total': 0.0, 'max': 0.0, 'buckets': [0] * (len(SCHEDULER_WAIT_BUCKETS) + 1)} for i in PRIORITY_NAMES}
+
+    def set_default_priority(self, priority=PRIORITY_FOREGROUND):
+        """ Priority for every request in the process which doesn't ask for lower e.g. prewarming plugin calls """
+        self._default = priority
+
+    def get_thread_priority(self):
+        """ Priority set for the current thread by request_priority or None """
+        return getattr(self._local, 'priority', None)
+
+    def get_priority(self, priority=PRIORITY_FOREGROUND):
+        """ Priority set for the current thread by request_priority overrides the priority of the API """
+        thread_priority = self.get_thread_priority()
+        if thread_priority is not None:
+            return thread_priority
+        return max(priority, self._default)
+
+    @contextmanager
+    def request_priority(self, priority):
+        """ Run all requests made by the current thread within the block at priority """
+        previous = getattr(self._local, 'priority', None)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def _is_navigating(self):
+        if not get_condvisibility(f'System.IdleTime({BACKGROUND_QUIET_TIME})'):
+            return True
+        try:
+            timestamp, pid = get_property(FOREGROUND_PROPERTY).split(' ')
+            return pid != self._pid and float(timestamp) + BACKGROUND_QUIET_TIME > time()
+        except ValueError:
+            return False
+
+    def _signal_foreground(self):
+        """ Let other processes know this process is making foreground requests """
+        now = time()
+        if now - self._signalled < FOREGROUND_SIGNAL_TIME:
+            return
+        self._signalled = now
+        get_property(FOREGROUND_PROPERTY, f'{now} {self._pid}')
+
+    def _defer(self):
+        """ Wait until user stops navigating or BACKGROUND_MAX_DEFER. Returns True if request was deferred """
+        timer_z = timer() + BACKGROUND_MAX_DEFER
+        is_deferred = False
+        monitor = None
+        while timer() < timer_z and self._is_navigating():
+            monitor = monitor or Monitor()
+            is_deferred = True
+            if monitor.waitForAbort(BACKGROUND_POLL):
+                break
+        return is_deferred
+
+    def _is_allowed(self, priority):
+        if sum(self._active.values()) >= self.max_active:
+            return False
+        if priority == PRIORITY_FOREGROUND:
+            return True
+        return not self._waiting[PRIORITY_FOREGROUND] and self._active[priority] < self.max_background
+
+    def _record(self, priority, wait_time, is_deferred):
+        stats = self.stats[priority]
+        stats['requests'] += 1
+        stats['deferred'] += 1 if is_deferred else 0
+        stats['total'] += wait_time
+        stats['max'] = max(stats['max'], wait_time)
+        stats['buckets'][next((x for x, i in enumerate(SCHEDULER_WAIT_BUCKETS) if wait_time <= i), -1)] += 1
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_FOREGROUND):
+        """ Hold a request slot for the duration of the block """
+        priority = self.get_priority(priority)
+        timer_a = timer()
+        if priority == PRIORITY_FOREGROUND:
+            self._signal_foreground()
+            is_deferred = False
+        else:
+            is_deferred = self._defer()
+        with self._condition:
+            self._waiting[priority] += 1
+            self._condition.wait_for(lambda: self._is_allowed(priority))
+            self._waiting[priority] -= 1
+            self._active[priority] += 1
+            self._record(priority, timer() - timer_a, is_deferred)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active[priority] -= 1
+                self._condition.notify_all()
+
+    def get_stats(self):
+        with self._condition:
+            return {PRIORITY_NAMES[k]: {**v, 'buckets': list(v['buckets'])} for k, v in self.stats.items()}
+
+
+_scheduler = RequestScheduler()
+
+
+def get_scheduler():
+    return _scheduler
+
+
+def get_scheduler_stats():
+    return _scheduler.get_stats()
+
+
+def format_wait_histogram(buckets):
+    """ Histogram as "<=0.001s:n <=0.01s:n ... >10s:n" skipping empty buckets """
+    labels = [f'<={i}s' for i in SCHEDULER_WAIT_BUCKETS] + [f'>{SCHEDULER_WAIT_BUCKETS[-1]}s']
+    return ' '.join(f'{label}:{count}' for label, count in zip(labels, buckets) if count)
+
+
+def request_priority(priority):
+    return _scheduler.request_priority(priority)
+
+
+def set_default_priority(priority):
+    _scheduler.set_default_priority(priority)
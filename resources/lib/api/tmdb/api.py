@@ -6,10 +6,11 @@ from resources.lib.addon.window import get_property
 from resources.lib.addon.timedate import get_datetime_now, get_timedelta
 from resources.lib.files.cache import CACHE_SHORT, CACHE_LONG
 from resources.lib.files.downloader import Downloader
-from resources.lib.files.utils import use_pickle, validify_filename
+from resources.lib.files.utils import validify_filename
+from resources.lib.files.records import use_records
 from resources.lib.items.listitem import ListItem
 from resources.lib.items.pages import PaginatedItems
-from resources.lib.api.request import RequestAPI
+from resources.lib.api.request import RequestAPI, NEGATIVE_EMPTY
 from resources.lib.api.tmdb.mapping import ItemMapper, get_episode_to_air
 from resources.lib.api.mapping import is_excluded
 from urllib.parse import quote_plus
@@ -35,6 +36,7 @@ class TMDb(RequestAPI):
             req_api_url=API_URL,
             req_api_key=f'api_key={api_key}',
             delay_write=delay_write)
+        self.req_negative_days = {'search': {NEGATIVE_EMPTY: 1}, 'find': {NEGATIVE_EMPTY: 1}}
         self.language = language
         self.iso_language = language[:2]
         self.iso_country = language[-2:]
@@ -44,6 +46,13 @@ class TMDb(RequestAPI):
         self.req_strip += [(self.append_to_response, ''), (self.req_language, f'{self.iso_language}{"_en" if ARTLANG_FALLBACK else ""}')]
         self.mapper = ItemMapper(self.language, self.mpaa_prefix)
 
+    def is_empty_response(self, response):
+        """ Search returns an empty results list and find returns an empty list for every type if nothing matched """
+        if not response:
+            return True
+        results = [v for k, v in response.items() if k == 'results' or k.endswith('_results')]
+        return bool(results) and not any(results)
+
     def get_url_separator(self, separator=None):
         if separator == 'AND':
             return '%2C'
@@ -151,9 +160,13 @@ class TMDb(RequestAPI):
         If tmdb_type specified will look-up IDs using search function otherwise assumes item ID is passed
         """
         separator = self.get_url_separator(separator)
+        if tmdb_type and separator:  # Look-up every item so do look-ups concurrently
+            item_ids = self.get_request_many([((), {'tmdb_type': tmdb_type, 'query': i}) for i in items], func=self.get_tmdb_id)
+        else:
+            item_ids = None
         temp_list = ''
-        for item in items:
-            item_id = self.get_tmdb_id(tmdb_type=tmdb_type, query=item) if tmdb_type else item
+        for x, item in enumerate(items):
+            item_id = (item_ids[x] if item_ids else self.get_tmdb_id(tmdb_type=tmdb_type, query=item)) if tmdb_type else item
             if not item_id:
                 continue
             if separator:  # If we've got a url separator then concatinate the list with it
@@ -213,9 +226,9 @@ class TMDb(RequestAPI):
         request = self.get_request_sc(f'tv/{tmdb_id}')
         if not request or not request.get('seasons'):
             return []
-        return [
-            j for i in request['seasons'] for j in self.get_episode_list(tmdb_id, i['season_number'])
-            if i.get('season_number')]
+        seasons = [i['season_number'] for i in request['seasons'] if i.get('season_number')]
+        responses = self.get_request_many([((f'tv/{tmdb_id}/season/{i}',), {}) for i in seasons], func=self.get_request_sc)
+        return [j for i in responses for j in self._get_episode_list_items(tmdb_id, i)]
 
     def get_episode_group_episodes_list(self, tmdb_id, group_id, position):
         request = self.get_request_sc(f'tv/episode_group/{group_id}')
@@ -344,7 +357,9 @@ class TMDb(RequestAPI):
         return item
 
     def get_episode_list(self, tmdb_id, season):
-        request = self.get_request_sc(f'tv/{tmdb_id}/season/{season}')
+        return self._get_episode_list_items(tmdb_id, self.get_request_sc(f'tv/{tmdb_id}/season/{season}'))
+
+    def _get_episode_list_items(self, tmdb_id, request):
         if not request:
             return []
         items = [
@@ -397,7 +412,7 @@ class TMDb(RequestAPI):
         if not export_list or not datestamp:
             return
         download_url = f'https://files.tmdb.org/p/exports/{export_list}_ids_{datestamp}.json.gz'
-        raw_list = [loads(i) for i in Downloader(download_url=download_url).get_gzip_text().splitlines()]
+        raw_list = (loads(i) for i in Downloader(download_url=download_url).get_gzip_text().splitlines())
         return sorted(raw_list, key=lambda k: k.get(sorting, ''), reverse=reverse) if sorting else raw_list
 
     def get_daily_list(self, export_list, sorting=None, reverse=False):
@@ -405,8 +420,8 @@ class TMDb(RequestAPI):
             return
         datestamp = get_datetime_now() - get_timedelta(days=2)
         datestamp = datestamp.strftime("%m_%d_%Y")
-        # Pickle results rather than cache due to being such a large list
-        return use_pickle(
+        # Store as records rather than cache due to being such a large list. Pages are read without loading whole list
+        return use_records(
             self._get_downloaded_list,
             export_list=export_list, sorting=sorting, reverse=reverse, datestamp=datestamp,
             cache_name=f'TMDb.Downloaded.List.v2.{export_list}.{sorting}.{reverse}')
@@ -8,7 +8,7 @@ from resources.lib.addon.parser import try_int
 from resources.lib.addon.timedate import set_timestamp, get_timestamp
 from resources.lib.files.cache import CACHE_SHORT, CACHE_LONG, use_simple_cache
 from resources.lib.items.pages import PaginatedItems, get_next_page
-from resources.lib.api.request import RequestAPI
+from resources.lib.api.request import RequestAPI, NEGATIVE_EMPTY
 from resources.lib.api.trakt.items import TraktItems
 from resources.lib.api.trakt.decorators import is_authorized, use_activity_cache
 from resources.lib.api.trakt.progress import _TraktProgress
@@ -411,6 +411,7 @@ class _TraktSync():
 class TraktAPI(RequestAPI, _TraktSync, _TraktLists, _TraktProgress):
     def __init__(self, force=False, delay_write=False):
         super(TraktAPI, self).__init__(req_api_url=API_URL, req_api_name='TraktAPI', timeout=20, delay_write=delay_write)
+        self.req_negative_days = {'search': {NEGATIVE_EMPTY: 1}}  # ID lookups return an empty list if item isn't on Trakt
         self.authorization = ''
         self.attempted_login = False
         self.dialog_noapikey_header = f'{get_localized(32007)} {self.req_api_name} {get_localized(32011)}'
@@ -450,7 +451,7 @@ class TraktAPI(RequestAPI, _TraktSync, _TraktLists, _TraktProgress):
             if not get_timestamp(get_property('TraktRefreshTimeStamp', is_type=float) or 0):
                 # Check if we can get a response from user account
                 kodi_log('Checking Trakt authorization', 2)
-                response = self.get_simple_api_request('https://api.trakt.tv/sync/last_activities', headers=self.headers)
+                response = self.get_simple_api_request(f'{self.req_api_url}sync/last_activities', headers=self.headers)
                 # 401 is unauthorized error code so let's try refreshing the token
                 if not response or response.status_code == 401:
                     kodi_log('Trakt unauthorized!', 2)
@@ -4,8 +4,13 @@ from resources.lib.addon.constants import NO_LABEL_FORMATTING, RANDOMISED_TRAKT,
 from resources.lib.addon.plugin import convert_type, reconfigure_legacy_params, kodi_log, get_setting, executebuiltin
 from resources.lib.addon.parser import parse_paramstring, try_int
 from resources.lib.addon.setutils import split_items, random_from_list, merge_two_dicts
-from resources.lib.addon.decorators import TimerList, ParallelThread
+from resources.lib.addon.decorators import TimerList, ParallelThread, get_worker_pool_stats
 from resources.lib.api.mapping import set_show, get_empty_item, is_excluded
+from resources.lib.api.request import get_session_stats, get_negative_cache_stats
+from resources.lib.api.scheduler import get_scheduler_stats, set_default_priority, format_wait_histogram, PRIORITY_BACKGROUND
+from resources.lib.files.cache import get_singleflight_stats, get_revalidation_stats, get_prewarm_stats, set_prewarm_path, set_prewarm_window
+from resources.lib.files.simplecache import get_lock_wait_stats, get_memory_stats
+from resources.lib.files.cachewriter import get_cache_writer_stats
 from resources.lib.api.kodi.rpc import get_kodi_library, get_movie_details, get_tvshow_details, get_episode_details, get_season_details, set_playprogress
 from resources.lib.api.tmdb.api import TMDb
 from resources.lib.api.tmdb.lists import TMDbLists
@@ -23,6 +28,7 @@ from resources.lib.player.players import Players
 from threading import Thread
 
 
+PREWARM_IGNORE_PARAMS = ['reload', 'prewarm']  # Params which change between calls to the same list
 PREBUILD_PARENTSHOW = ['seasons', 'episodes', 'episode_groups', 'trakt_upnext', 'episode_group_seasons']
 LOG_TIMER_ITEMS = ['item_api', 'item_tmdb', 'item_ftv', 'item_map', 'item_cache', 'item_set', 'item_get', 'item_getx', 'item_non', 'item_nonx', 'item_art']
 
@@ -38,6 +44,10 @@ class Container(TMDbLists, BaseDirLists, SearchLists, UserDiscoverLists, TraktLi
         self.is_cacheonly = self.params.pop('cacheonly', '').lower() == 'true'
         self.is_fanarttv = self.params.pop('fanarttv', '').lower()
         self.is_nextpage = self.params.pop('nextpage', '').lower() != 'false'
+        self.is_prewarm = try_int(self.params.pop('prewarm', 0))  # Seconds before expiry to refresh cached objects
+        set_prewarm_window(self.is_prewarm)
+        if self.is_prewarm:
+            set_default_priority(PRIORITY_BACKGROUND)  # Prewarming shouldn't hold up listings the user is waiting on
         self.filters = {
             'filter_key': self.params.get('filter_key', None),
             'filter_value': split_items(self.params.get('filter_value', None))[0],
@@ -164,6 +174,10 @@ class Container(TMDbLists, BaseDirLists, SearchLists, UserDiscoverLists, TraktLi
                 tmdb_type='tv', tmdb_id=self.parent_params.get('tmdb_id'),
                 season=self.parent_params.get('season', None) if self.parent_params['info'] == 'episodes' else None)
 
+        # Load cached item details in bulk so threads don't each query the database
+        with TimerList(self.timer_lists, '--preload', log_threshold=0.05, logging=self.log_timers):
+            self.ib.preload_cache(items)
+
         # Build items in threadss
         with TimerList(self.timer_lists, '--build', log_threshold=0.05, logging=self.log_timers):
             self.ib.parent_params = self.parent_params
@@ -426,11 +440,35 @@ class Container(TMDbLists, BaseDirLists, SearchLists, UserDiscoverLists, TraktLi
         timer_log.append('------------------------------\n')
         tot_time = f'{sum(total_log) / len(total_log):7.3f} sec' if total_log else '  None'
         timer_log.append(f'{"Total":15s}: {tot_time}\n')
+        timer_log.append(f'{"Deduplicated":15s}: {get_singleflight_stats()["suppressed"]:7} requests\n')
+        revalidated = get_revalidation_stats()
+        timer_log.append(f'{"Not Modified":15s}: {revalidated["not_modified"]:7} requests | {revalidated["bytes_saved"]} bytes saved\n')
+        lock_waits = get_lock_wait_stats()
+        timer_log.append(f'{"DB Lock Waits":15s}: {lock_waits["total"]:7.3f} sec all | {lock_waits["max"]:7.3f} sec max | {lock_waits["count"]:3}\n')
+        negative = get_negative_cache_stats()
+        timer_log.append(f'{"Negative Cache":15s}: {negative["avoided"]:7} requests avoided | {negative["not_found"]:3} not found | {negative["empty"]:3} empty stored\n')
+        writer = get_cache_writer_stats()
+        timer_log.append(f'{"Cache Writes":15s}: {writer["handed_off"]:7} to service | {writer["direct"]:3} direct\n')
+        for k, v in get_scheduler_stats().items():
+            if not v['requests']:
+                continue
+            timer_log.append(
+                f'{f"Wait {k}":15s}: {v["total"] / v["requests"]:7.3f} sec avg | {v["max"]:7.3f} sec max | {v["requests"]:3} | '
+                f'{v["deferred"]} deferred | {format_wait_histogram(v["buckets"])}\n')
+        pool = get_worker_pool_stats()
+        timer_log.append(f'{"Worker Pool":15s}: {pool["completed"]:7} tasks | {pool["max_workers"]:3} workers max | {pool["max_queued"]:3} queued max | {pool["timed_out"]:3} timed out\n')
+        memory = get_memory_stats()
+        timer_log.append(f'{"Memory Cache":15s}: {memory["hits"]:7} hits | {memory["misses"]:3} misses | {memory["evictions"]:3} evicted | {memory["bytes"]} bytes\n')
+        for k, v in get_session_stats().items():
+            timer_log.append(f' - {k:24s}: {v["requests"]:3} requests | {v["connections"]:3} connections | {v["reused"]:3} reused\n')
         for k, v in self.timer_lists.items():
             if v and k in LOG_TIMER_ITEMS:
                 timer_log.append(f'\n{k}:\n{" ".join([f"{i:.3f} " for i in v])}\n')
         kodi_log(timer_log, 1)
 
+    def get_prewarm_paramstring(self):
+        return '&'.join(i for i in self.paramstring.split('&') if i.split('=', 1)[0] not in PREWARM_IGNORE_PARAMS)
+
     def get_directory(self):
         with TimerList(self.timer_lists, 'total', logging=self.log_timers):
             self._pre_sync = Thread(target=self.pre_sync_trakt)
@@ -439,6 +477,8 @@ class Container(TMDbLists, BaseDirLists, SearchLists, UserDiscoverLists, TraktLi
                 items = self.get_items(**self.params)
             if not items:
                 return
+            if not self.is_prewarm:
+                set_prewarm_path(self.get_prewarm_paramstring(), is_widget=self.is_widget)
             self.plugin_category = self.params.get('plugin_category') or self.plugin_category
             with TimerList(self.timer_lists, 'add_items', logging=self.log_timers):
                 self.add_items(
@@ -452,6 +492,8 @@ class Container(TMDbLists, BaseDirLists, SearchLists, UserDiscoverLists, TraktLi
                 container_content=self.container_content)
         if self.log_timers:
             self.log_timer_report()
+        if self.is_prewarm:
+            kodi_log(f'Prewarm refreshed {get_prewarm_stats()["refreshed"]} expiring objects for {self.paramstring}', 2)
         if self.container_update:
             executebuiltin(f'Container.Update({self.container_update})')
         if self.container_refresh:
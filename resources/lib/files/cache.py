@@ -1,15 +1,90 @@
 from resources.lib.addon.plugin import kodi_log, format_name
 from resources.lib.addon.decorators import try_except_log
-from resources.lib.files.simplecache import SimpleCache
-from resources.lib.files.utils import get_pickle_name
-# from resources.lib.files.utils import pickle_deepcopy
-# from threading import Thread
+from resources.lib.files.simplecache import SimpleCache, STATS_PREFIX_DEPTH, LEASE_POLL, get_cache_key  # noqa: F401
+from resources.lib.files.utils import pickle_deepcopy
+from resources.lib.api.scheduler import get_scheduler, PRIORITY_BACKGROUND
+from xbmc import Monitor
+from xbmcgui import Window
+from time import time
+from threading import Event, Lock, Thread
 # from resources.lib.addon.decorators import TimerList
 
 CACHE_LONG = 14
 CACHE_SHORT = 1
 CACHE_EXTENDED = 90
+CACHE_STALE = 3  # Days after expiry that an object can be served while a refresh is scheduled
 SEARCH_HISTORY = 'search_history.db'
+PREWARM_HISTORY = 'prewarm_history.db'
+PREWARM_MAX_PATHS = 50  # Plugin paths remembered for prewarming. Least recently used are dropped
+PREWARM_INTERVAL = 3600  # Uses of a plugin path within the same hour are counted once so that most listings don't write history
+PREWARM_LEASE_WAIT = 1  # Seconds to wait for another process updating history before leaving this use uncounted
+CACHE_REFRESH_PROPERTY = 'TMDbHelper.CacheRefresh'  # Set whilst the service is draining refresh queues
+
+
+class _SingleFlightCall():
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+
+
+class SingleFlight():
+    def __init__(self):
+        """ Registry of in-flight function calls so that concurrent cache misses for the same key share one call """
+        self._lock = Lock()
+        self._calls = {}
+        self.suppressed = 0
+
+    def do(self, key, func, args=(), kwargs=None):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _SingleFlightCall()
+            else:
+                self.suppressed += 1
+        if not is_leader:
+            call.event.wait()
+            return pickle_deepcopy(call.result) if call.result else call.result  # Copy so threads can't mutate each other's object
+        try:
+            call.result = func(*args, **(kwargs or {}))
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result
+
+
+_single_flight = SingleFlight()
+_revalidation_stats = {'not_modified': 0, 'bytes_saved': 0}
+_prewarm = {'window': 0, 'refreshed': 0}
+
+CACHE_NOT_MODIFIED = object()  # Returned by cache_validate funcs when the validators show the cached object is current
+
+
+def get_singleflight_stats():
+    return {'suppressed': _single_flight.suppressed}
+
+
+def get_revalidation_stats():
+    return _revalidation_stats
+
+
+def get_prewarm_stats():
+    return {'refreshed': _prewarm['refreshed']}
+
+
+def set_prewarm_window(seconds=0):
+    """ Cached objects expiring within seconds are refreshed by use_cache instead of returned """
+    _prewarm['window'] = seconds
+
+
+def is_same_validators(validators, stored):
+    return all((validators.get(i) or None) == (stored.get(i) or None) for i in ('etag', 'modified'))
+
+
+def is_refresh_running():
+    """ True if the service is running to drain refresh queues """
+    return bool(Window(10000).getProperty(CACHE_REFRESH_PROPERTY))
 
 
 class BasicCache(object):
@@ -30,15 +105,35 @@ class BasicCache(object):
     @try_except_log('lib.addon.cache get_cache')
     def get_cache(self, cache_name):
         self.ret_cache()
-        cache_name = get_pickle_name(cache_name or '')
-        no_hdd = True if self._id_list and cache_name not in self._id_list else False
-        return self._cache.get(cache_name, no_hdd=no_hdd)
+        cache_key = get_cache_key(cache_name)
+        no_hdd = True if self._id_list and cache_key not in self._id_list else False
+        return self._cache.get(cache_key, no_hdd=no_hdd, name=cache_name)
         # with TimerList(self._timers, 'item_getx' if no_hdd else 'item_get', log_threshold=0) as tl:
         #     item = self._cache.get(cache_name, no_hdd=no_hdd)
         #     if not item:
         #         tl.list_obj = self._timers.setdefault('item_nonx' if no_hdd else 'item_non', [])
         # return item
 
+    @try_except_log('lib.addon.cache get_cache_many')
+    def get_cache_many(self, cache_names):
+        """ Get multiple objects in one database query. Returns dict of {cache_name: object} for objects found """
+        self.ret_cache()
+        endpoints = {get_cache_key(i): i for i in cache_names}
+        results = self._cache.get_many(endpoints)
+        return {endpoints[k]: v for k, v in results.items()}
+
+    @try_except_log('lib.addon.cache get_cache_report')
+    def get_cache_report(self, depth=STATS_PREFIX_DEPTH):
+        """ Get row counts, sizes, expiry distribution and hit rates grouped by cache name prefix """
+        self.ret_cache()
+        return self._cache.get_report(depth=depth)
+
+    @try_except_log('lib.addon.cache purge_cache')
+    def purge_cache(self, prefix=None, days=None):
+        """ Delete objects with cache names starting with prefix and/or not accessed for more than days """
+        self.ret_cache()
+        return self._cache.purge(prefix=prefix, days=days)
+
     def get_id_list(self):
         self.ret_cache()
         self._id_list = self._cache.get_id_list() or []
@@ -56,40 +151,150 @@ class BasicCache(object):
         """ set object to cache """
         # with TimerList(self._timers, 'item_set'):
         self.ret_cache()
-        cache_name = get_pickle_name(cache_name or '')
         if force and (not my_object or not cache_name or not cache_days):
             my_object = my_object or fallback
             cache_days = force if isinstance(force, int) else cache_days
-        self._cache.set(cache_name, my_object, cache_days=cache_days)
+        self._cache.set(get_cache_key(cache_name), my_object, cache_days=cache_days, name=cache_name)
 
     @try_except_log('lib.addon.cache del_cache')
     def del_cache(self, cache_name):
         self.ret_cache()
-        cache_name = get_pickle_name(cache_name or '')
-        self._cache.set(cache_name, None, cache_days=0)
+        self._cache.set(get_cache_key(cache_name), None, cache_days=0, name=cache_name)
 
     @try_except_log('lib.addon.cache use_cache')
     def use_cache(
             self, func, *args,
             cache_days=14, cache_name='', cache_only=False, cache_force=False, cache_strip=[], cache_fallback=False,
-            cache_refresh=False, cache_combine_name=False, headers=None,
-            **kwargs):
+            cache_refresh=False, cache_combine_name=False, cache_stale=0, cache_stale_refresh=None, cache_validate=False,
+            cache_skip=None, headers=None, **kwargs):
         """
         Simplecache takes func with args and kwargs
         Returns the cached item if it exists otherwise does the function
+        cache_stale days after expiry to return expired item and refresh in background (stale-while-revalidate)
+        cache_stale_refresh data for queueing refresh in service instead of refreshing in a thread whilst service is running
+        cache_validate func accepts validators kwarg and returns (object, validators) or (CACHE_NOT_MODIFIED, None)
+        cache_skip callable checked only once object is missing from cache. Nothing is fetched if it returns True
         """
         if not cache_name or cache_combine_name:
             cache_name = format_name(cache_name, *args, **kwargs)
             for k, v in cache_strip:
                 cache_name = cache_name.replace(k, v)
+        is_prewarm = False
+        if not cache_refresh and not cache_only and _prewarm['window']:
+            cache_refresh = is_prewarm = self.is_expiring(cache_name, _prewarm['window'])
         my_cache = self.get_cache(cache_name) if not cache_refresh else None
         if my_cache:
             return my_cache
+        if headers:
+            kwargs['headers'] = headers
+        my_cache = self.get_stale_cache(cache_name, cache_stale) if cache_stale and not cache_refresh else None
+        if my_cache:
+            if cache_stale_refresh and (cache_only or is_refresh_running()):
+                self.queue_refresh(cache_name, cache_stale_refresh)
+            elif not cache_only:
+                Thread(target=self._refresh_stale, args=[
+                    func, args, kwargs, cache_name, cache_days, cache_force, cache_fallback, cache_validate]).start()
+            return my_cache
+        if cache_skip and not cache_only and cache_skip():
+            return
         if not cache_only:
-            if headers:
-                kwargs['headers'] = headers
-            my_object = func(*args, **kwargs)
+            my_cache = _single_flight.do(
+                (self._filename, cache_name), self._use_cache_func,
+                (func, args, kwargs, cache_name, cache_days, cache_force, cache_fallback, cache_validate))
+            _prewarm['refreshed'] += 1 if is_prewarm and my_cache else 0  # Only count expiring objects which were replaced
+            return my_cache
+
+    def _refresh_stale(
+            self, func, args, kwargs, cache_name, cache_days=14, cache_force=False, cache_fallback=False, cache_validate=False):
+        """ Refresh stale object in a thread of this process at background priority so that requests being waited on go first """
+        with get_scheduler().request_priority(PRIORITY_BACKGROUND):
+            _single_flight.do(
+                (self._filename, cache_name), self._use_cache_func,
+                (func, args, kwargs, cache_name, cache_days, cache_force, cache_fallback, cache_validate))
+
+    def _use_cache_func(
+            self, func, args, kwargs, cache_name, cache_days=14, cache_force=False, cache_fallback=False, cache_validate=False):
+        """ Take the cross-process lease before fetching so that other plugin processes wait for our result """
+        lease = self.get_lease(cache_name)
+        if not lease:
+            my_cache = self.wait_for_lease(cache_name)
+            if my_cache:
+                return my_cache
+        try:
+            if not cache_validate:
+                my_object = func(*args, **kwargs)
+                return self.set_cache(my_object, cache_name, cache_days, force=cache_force, fallback=cache_fallback)
+            stored = self.get_validators(cache_name) or {}
+            my_object, validators = func(*args, validators=stored, **kwargs)
+            if my_object is CACHE_NOT_MODIFIED:
+                my_object = self.renew_cache(cache_name, cache_days)
+                if my_object:
+                    return my_object
+                my_object, validators = func(*args, validators={}, **kwargs)  # Cached object missing so get it in full
+            if validators is not None and not is_same_validators(validators, stored):
+                self.set_validators(cache_name, validators)  # Most refreshes return the same validators so only write changes
             return self.set_cache(my_object, cache_name, cache_days, force=cache_force, fallback=cache_fallback)
+        finally:
+            if lease:
+                self.del_lease(cache_name)
+
+    @try_except_log('lib.addon.cache get_validators')
+    def get_validators(self, cache_name):
+        self.ret_cache()
+        return self._cache.get_validators(get_cache_key(cache_name))
+
+    @try_except_log('lib.addon.cache set_validators')
+    def set_validators(self, cache_name, validators=None):
+        self.ret_cache()
+        self._cache.set_validators(get_cache_key(cache_name), **(validators or {}))
+
+    @try_except_log('lib.addon.cache renew_cache')
+    def renew_cache(self, cache_name, cache_days=14):
+        """ Extend expiry of cached object after server confirms it is unchanged """
+        self.ret_cache()
+        renewed = self._cache.renew(get_cache_key(cache_name), cache_days=cache_days)
+        if not renewed:
+            return
+        _revalidation_stats['not_modified'] += 1
+        _revalidation_stats['bytes_saved'] += renewed[1]
+        return renewed[0]
+
+    @try_except_log('lib.addon.cache is_expiring')
+    def is_expiring(self, cache_name, window=0):
+        """ True if object is cached but expires within window seconds """
+        self.ret_cache()
+        expires = self._cache.get_expires(get_cache_key(cache_name))
+        return bool(expires) and expires - window <= time()
+
+    @try_except_log('lib.addon.cache get_stale_cache')
+    def get_stale_cache(self, cache_name, cache_stale=CACHE_STALE):
+        self.ret_cache()
+        return self._cache.get_stale(get_cache_key(cache_name), grace_time=int(cache_stale * 86400))
+
+    @try_except_log('lib.addon.cache queue_refresh')
+    def queue_refresh(self, cache_name, refresh_data):
+        self.ret_cache()
+        self._cache.queue_refresh(get_cache_key(cache_name), refresh_data)
+
+    @try_except_log('lib.addon.cache pop_refresh_queue')
+    def pop_refresh_queue(self, limit=20):
+        self.ret_cache()
+        return [i[1] for i in self._cache.pop_refresh_queue(limit)]
+
+    @try_except_log('lib.addon.cache get_lease')
+    def get_lease(self, cache_name):
+        self.ret_cache()
+        return self._cache.get_lease(get_cache_key(cache_name))
+
+    @try_except_log('lib.addon.cache del_lease')
+    def del_lease(self, cache_name):
+        self.ret_cache()
+        self._cache.del_lease(get_cache_key(cache_name))
+
+    @try_except_log('lib.addon.cache wait_for_lease')
+    def wait_for_lease(self, cache_name):
+        self.ret_cache()
+        return self._cache.wait_for_lease(get_cache_key(cache_name))
 
 
 def use_simple_cache(cache_days=None):
@@ -110,6 +315,39 @@ def get_search_history(tmdb_type=None):
     return BasicCache(SEARCH_HISTORY).get_cache(tmdb_type) or []
 
 
+def get_prewarm_paths():
+    """ Returns dict of {paramstring: (count, last_time, is_widget)} for recently used plugin paths """
+    return BasicCache(PREWARM_HISTORY).get_cache('paths') or {}
+
+
+def set_prewarm_path(paramstring, is_widget=False, max_entries=PREWARM_MAX_PATHS, cache_days=30):
+    """
+    Count use of plugin path once per PREWARM_INTERVAL. History is only written when the entry changes
+    Processes take the lease on history in turn so that paths used at the same time are all kept
+    """
+    if not paramstring:
+        return
+    cur_time = int(time())
+    interval = cur_time - cur_time % PREWARM_INTERVAL
+    count, last_time, was_widget = get_prewarm_paths().get(paramstring, (0, 0, False))
+    if last_time >= interval and (was_widget or not is_widget):
+        return
+    cache, monitor = BasicCache(PREWARM_HISTORY), Monitor()
+    timer_z = time() + PREWARM_LEASE_WAIT
+    while not cache.get_lease('paths'):
+        if time() > timer_z or monitor.waitForAbort(LEASE_POLL):
+            return
+    try:
+        history = cache.get_cache('paths') or {}
+        count, last_time, was_widget = history.pop(paramstring, (0, 0, False))  # Pop so that most recently used is last
+        history[paramstring] = (count + 1 if last_time < interval else count, cur_time, was_widget or is_widget)
+        for i in list(history)[:-max_entries]:
+            history.pop(i)
+        cache.set_cache(history, cache_name='paths', cache_days=cache_days)
+    finally:
+        cache.del_lease('paths')
+
+
 def _add_search_history(tmdb_type=None, query=None, max_entries=9, **kwargs):
     search_history = get_search_history(tmdb_type)
     if query in search_history:  # Remove query if in history because we want it to be first in list
@@ -0,0 +1,79 @@
+""" Hand off cache writes from plugin processes to the single writer hosted by the service monitor
+The service advertises "port token" in a window property whilst it is accepting writes
+Rows and ETag/Last-Modified validators are sent as one line of JSON on a localhost socket and the service replies 1 once they are queued
+Each process keeps its connection open between writes so that a write doesn't pay for a new connection
+"""
+import json
+import socket
+from threading import Lock
+from base64 import b64encode, b64decode
+from xbmcgui import Window
+
+CACHE_WRITER_PROPERTY = 'TMDbHelper.CacheWriter'
+CACHE_WRITER_TIMEOUT = 2  # Seconds to wait for service before writing directly instead
+
+_writer_stats = {'handed_off': 0, 'direct': 0}
+_connection = {}
+_connection_lock = Lock()
+
+
+def get_cache_writer_stats():
+    return _writer_stats
+
+
+def encode_rows(rows):
+    """ Rows are (endpoint, expires, data, name) tuples. Blobs are base64 so that rows can be sent as JSON """
+    return [
+        (endpoint, expires, b64encode(data).decode('ascii') if isinstance(data, bytes) else None, data if isinstance(data, str) else None, name)
+        for endpoint, expires, data, name in rows]
+
+
+def decode_rows(rows):
+    return [
+        (endpoint, expires, b64decode(blob) if blob is not None else text, name)
+        for endpoint, expires, blob, text, name in rows]
+
+
+def _close_connection():
+    for i in (_connection.pop('file', None), _connection.pop('sock', None)):
+        if i:
+            i.close()
+    _connection.clear()
+
+
+def _send_line(address, line):
+    """ Send line on the connection kept open to address and return the reply. Caller must hold _connection_lock """
+    for attempt in range(2):
+        try:
+            if _connection.get('address') != address:
+                _close_connection()
+                sock = socket.create_connection(address, timeout=CACHE_WRITER_TIMEOUT)
+                _connection.update(address=address, sock=sock, file=sock.makefile('rb'))
+            _connection['sock'].sendall(line)
+            reply = _connection['file'].readline()
+        except ConnectionError:
+            reply = b''
+        except OSError:
+            _close_connection()
+            raise
+        if reply:
+            return reply
+        _close_connection()  # Service closed an idle connection so try again once on a new connection
+    return b''
+
+
+def send_rows(folder, filename, rows=(), validators=()):
+    """
+    Send rows and (endpoint, etag, modified) validators to service writer
+    Returns False if service isn't accepting writes so caller should write directly
+    """
+    try:
+        port, token = Window(10000).getProperty(CACHE_WRITER_PROPERTY).split(' ', 1)
+        request = {'token': token, 'folder': folder, 'filename': filename, 'rows': encode_rows(rows), 'validators': list(validators)}
+        line = json.dumps(request, separators=(',', ':')).encode('utf-8') + b'\n'
+        with _connection_lock:
+            is_queued = _send_line(('127.0.0.1', int(port)), line).strip() == b'1'
+    except (OSError, ValueError):
+        is_queued = False
+    _writer_stats['handed_off' if is_queued else 'direct'] += len(rows) + len(validators)
+    return is_queued
@@ -0,0 +1,96 @@
+""" Serialization of cache objects
+Rows are stored as BLOBs with a leading version byte identifying the codec
+Rows written before the codec layer are TEXT and are still read as JSON
+Objects are marshalled rather than pickled because blobs are read from window properties which any add-on or skin can set
+Marshal only builds plain types so decoding a blob never runs code. Objects were JSON before so are always plain types
+"""
+import zlib
+import lzma
+import marshal
+from base64 import b64encode, b64decode
+from resources.lib.files.utils import json_loads
+
+CODEC_MARSHAL = 4
+CODEC_ZLIB = 5
+CODEC_LZMA = 6
+CODEC_DEFAULT = CODEC_ZLIB  # Codecs 1 to 3 were pickles. They are never read so their rows are fetched again
+
+COMPRESS_THRESHOLD = 512  # Blobs smaller than this many bytes are stored uncompressed
+ZLIB_LEVEL = 6
+TEXT_PREFIX = '~'  # Marks base64 encoded blobs in text stores. JSON never starts with ~
+
+_compress = {
+    CODEC_MARSHAL: lambda data: data,
+    CODEC_ZLIB: lambda data: zlib.compress(data, ZLIB_LEVEL),
+    CODEC_LZMA: lambda data: lzma.compress(data)}
+
+_decompress = {
+    CODEC_MARSHAL: lambda data: data,
+    CODEC_ZLIB: zlib.decompress,
+    CODEC_LZMA: lzma.decompress}
+
+
+def _loads(data):
+    return marshal.loads(data, allow_code=False)  # Python 3.13 can refuse code objects too
+
+
+try:
+    _loads(marshal.dumps(None))
+except TypeError:
+    _loads = marshal.loads  # Code objects are never called so they are as inert as any other value
+
+
+def int_keys(obj):
+    """
+    Convert numeric string dictionary keys to int as json_loads does and lists/tuples to lists
+    Done once when writing so that reading doesn't need to walk the object
+    """
+    if isinstance(obj, dict):
+        result = {}
+        for key, value in obj.items():
+            if isinstance(key, str):
+                try:
+                    key = int(key)
+                except ValueError:
+                    pass
+            result[key] = int_keys(value)
+        return result
+    if isinstance(obj, (list, tuple)):
+        return [int_keys(i) for i in obj]
+    return obj
+
+
+def encode(obj, codec=CODEC_DEFAULT):
+    data = marshal.dumps(int_keys(obj))
+    if len(data) < COMPRESS_THRESHOLD:
+        codec = CODEC_MARSHAL
+    return bytes((codec,)) + _compress[codec](data)
+
+
+def decode(data):
+    """ Returns object. Raises ValueError for data which isn't a cache object """
+    if isinstance(data, str):
+        return json_loads(data)  # Row written before codec layer
+    try:
+        decompress = _decompress[data[0]]
+    except (KeyError, IndexError):
+        raise ValueError(f'Unknown cache codec {data[:1]!r}')
+    try:
+        return _loads(decompress(memoryview(data)[1:]))
+    except (EOFError, TypeError, zlib.error, lzma.LZMAError) as exc:
+        raise ValueError(f'Unreadable cache object {exc}')
+
+
+def encode_text(data):
+    """ Window properties only hold strings so blobs are base64 encoded """
+    return f'{TEXT_PREFIX}{b64encode(data).decode("ascii")}'
+
+
+def decode_text(data):
+    """
+    Returns blob for decode. Text without the prefix is JSON written before codec layer so is returned as is
+    Raises ValueError if the base64 is invalid
+    """
+    if not data.startswith(TEXT_PREFIX):
+        return data
+    return b64decode(data[1:])
@@ -0,0 +1,198 @@
+""" Memory-mapped record store for large lists which are read a page at a time
+Each store is a pair of files in addon_data/records
+    .dat -- header then each record as compact JSON one after the other
+    .idx -- header then the end offset of each record in .dat as an unsigned 64-bit int
+Record n spans from the end of record n - 1 (or the end of the .dat header) to its own end
+so a page is read by unpacking a slice of the index and decoding only those records
+Both headers carry the same generation so that a reader never pairs files from different writes
+Records can be appended to a store in place. Its generation is kept so that open lists stay valid and see the old length
+"""
+import os
+import json
+import mmap
+import struct
+from time import time
+from resources.lib.files.utils import get_write_path, get_pickle_name
+
+RECORDS_FOLDER = 'records'
+RECORDS_VERSION = 1
+RECORDS_MAGIC = b'TMDR'
+RECORDS_CHUNK = 1000  # Records encoded and written at a time
+DATA_HEADER = struct.Struct('<4sBI')  # magic, version, generation
+INDEX_HEADER = struct.Struct('<4sBIq')  # magic, version, generation, expires
+INDEX_ENTRY = struct.Struct('<Q')
+
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def _chunked(records, size=RECORDS_CHUNK):
+    chunk = []
+    for i in records:
+        chunk.append(i)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write_records(dat, idx, records, end):
+    """ Write records at current position of dat and their end offsets at current position of idx. Returns (count, end) """
+    count = 0
+    for chunk in _chunked(records):
+        data = [_encoder.encode(i).encode('utf-8') for i in chunk]
+        ends = []
+        for i in data:
+            end += len(i)
+            ends.append(end)
+        dat.write(b''.join(data))
+        dat.flush()  # Records are written before the index entries which point at them so readers never see one without the other
+        idx.write(struct.pack(f'<{len(ends)}Q', *ends))
+        count += len(ends)
+    return count, end
+
+
+def _get_end(idx, dat_size):
+    """ Returns (count, end) of whole records in store. Index entries past the end of the data are from an append which didn't finish """
+    count = (os.fstat(idx.fileno()).st_size - INDEX_HEADER.size) // INDEX_ENTRY.size
+    while count:
+        idx.seek(INDEX_HEADER.size + (count - 1) * INDEX_ENTRY.size)
+        end = INDEX_ENTRY.unpack(idx.read(INDEX_ENTRY.size))[0]
+        if end <= dat_size:
+            return count, end
+        count -= 1
+    return 0, DATA_HEADER.size
+
+
+def get_records_path(cache_name):
+    cache_name = get_pickle_name(cache_name)
+    if not cache_name:
+        return
+    return os.path.join(get_write_path(RECORDS_FOLDER), cache_name)
+
+
+class RecordList():
+    def __init__(self, path):
+        """
+        Read-only list of records in a store. Supports len(), indexing, slicing and iteration
+        Files are mapped only for the duration of each read so that writers can replace them
+        """
+        self._path = path
+        with open(f'{path}.idx', 'rb') as idx:
+            magic, version, self._generation, self.expires = INDEX_HEADER.unpack(idx.read(INDEX_HEADER.size))
+        if magic != RECORDS_MAGIC or version != RECORDS_VERSION:
+            raise ValueError(f'Not a record store {path}')
+        self._length = (os.path.getsize(f'{path}.idx') - INDEX_HEADER.size) // INDEX_ENTRY.size
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._length)
+            if step == 1:
+                return self.get_page(start, stop)
+            return [self[i] for i in range(start, stop, step)]
+        key = key + self._length if key < 0 else key
+        if not 0 <= key < self._length:
+            raise IndexError('record index out of range')
+        return self.get_page(key, key + 1)[0]
+
+    def __iter__(self):
+        for x in range(0, self._length, RECORDS_CHUNK):
+            yield from self.get_page(x, x + RECORDS_CHUNK)
+
+    def get_page(self, start, stop):
+        """ Decode records from start up to but not including stop """
+        start, stop = max(start, 0), min(stop, self._length)
+        if start >= stop:
+            return []
+        with open(f'{self._path}.idx', 'rb') as idx, open(f'{self._path}.dat', 'rb') as dat:
+            with mmap.mmap(idx.fileno(), 0, access=mmap.ACCESS_READ) as idx_map, \
+                    mmap.mmap(dat.fileno(), 0, access=mmap.ACCESS_READ) as dat_map:
+                if DATA_HEADER.unpack_from(dat_map)[2] != self._generation or INDEX_HEADER.unpack_from(idx_map)[2] != self._generation:
+                    return []  # Store was replaced since it was opened
+                pos = INDEX_HEADER.size + start * INDEX_ENTRY.size
+                ends = struct.unpack_from(f'<{stop - start}Q', idx_map, pos)
+                begin = INDEX_ENTRY.unpack_from(idx_map, pos - INDEX_ENTRY.size)[0] if start else DATA_HEADER.size
+                records = []
+                for end in ends:
+                    records.append(json.loads(dat_map[begin:end]))
+                    begin = end
+        return records
+
+
+def get_records(cache_name):
+    """ Returns RecordList for store or None if it doesn't exist, is expired or is unreadable """
+    path = get_records_path(cache_name)
+    if not path:
+        return
+    try:
+        records = RecordList(path)
+    except (OSError, ValueError, struct.error):
+        return
+    if records.expires > time() and len(records):
+        return records
+
+
+def set_records(records, cache_name, cache_days=14):
+    """ Replace store with records from iterable. Returns RecordList or None if there were no records """
+    path = get_records_path(cache_name)
+    if not path or not records:
+        return
+    generation = int.from_bytes(os.urandom(4), 'little')
+    tmp_path = f'{path}.{generation:08x}'
+    count = 0
+    try:
+        with open(f'{tmp_path}.dat', 'wb') as dat, open(f'{tmp_path}.idx', 'wb') as idx:
+            dat.write(DATA_HEADER.pack(RECORDS_MAGIC, RECORDS_VERSION, generation))
+            idx.write(INDEX_HEADER.pack(RECORDS_MAGIC, RECORDS_VERSION, generation, int(time() + cache_days * 86400)))
+            count = _write_records(dat, idx, records, DATA_HEADER.size)[0]
+    finally:
+        if not count:  # Don't leave partial files behind if records failed part way through
+            for i in ('dat', 'idx'):
+                if os.path.exists(f'{tmp_path}.{i}'):
+                    os.remove(f'{tmp_path}.{i}')
+    if not count:
+        return
+    # Replace index last. Readers check generation so won't pair the new data with the old index in between
+    os.replace(f'{tmp_path}.dat', f'{path}.dat')
+    os.replace(f'{tmp_path}.idx', f'{path}.idx')
+    return RecordList(path)
+
+
+def add_records(records, cache_name):
+    """
+    Append records from iterable to end of existing store. Only one process should write to a store at a time
+    Anything left after the last whole record by an append which didn't finish is written over
+    Returns number of records added
+    """
+    path = get_records_path(cache_name)
+    if not path:
+        return 0
+    try:
+        with open(f'{path}.idx', 'r+b') as idx, open(f'{path}.dat', 'r+b') as dat:
+            magic, version, generation, expires = INDEX_HEADER.unpack(idx.read(INDEX_HEADER.size))
+            if magic != RECORDS_MAGIC or version != RECORDS_VERSION or DATA_HEADER.unpack(dat.read(DATA_HEADER.size))[2] != generation:
+                return 0
+            count, end = _get_end(idx, os.fstat(dat.fileno()).st_size)
+            idx.seek(INDEX_HEADER.size + count * INDEX_ENTRY.size)
+            idx.truncate()
+            dat.seek(end)
+            count = _write_records(dat, idx, records, end)[0]
+            dat.truncate()
+    except (OSError, struct.error):
+        return 0
+    return count
+
+
+def use_records(func, *args, cache_name='', cache_days=14, cache_only=False, cache_refresh=False, **kwargs):
+    """
+    Returns RecordList from store if it exists otherwise stores the records from func
+    func can return any iterable of JSON serializable records such as a generator
+    """
+    my_object = get_records(cache_name) if not cache_refresh else None
+    if my_object:
+        return my_object
+    elif not cache_only:
+        return set_records(func(*args, **kwargs), cache_name, cache_days=cache_days)
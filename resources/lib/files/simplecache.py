@@ -7,17 +7,28 @@ Code cleanup
 - Leia/Matrix Python-2/3 cross-compatibility
 - Allow setting folder and filename of DB
 """
+import os
+import re
+import atexit
+import weakref
 import xbmcvfs
 import sqlite3
 from xbmcgui import Window
 from xbmc import Monitor, sleep
+from hashlib import blake2b
 from contextlib import contextmanager
+from collections import OrderedDict
 from resources.lib.addon.plugin import kodi_log
 from resources.lib.addon.timedate import set_timestamp
-from resources.lib.files.utils import get_file_path
+from threading import get_ident, local, Lock
+from timeit import default_timer as timer
+from resources.lib.files.utils import get_file_path, get_pickle_name
 from resources.lib.files.utils import json_loads as data_loads
+from resources.lib.files.cachewriter import send_rows
+from resources.lib.files.codec import encode as data_encode, decode as codec_decode, encode_text, decode_text, CODEC_DEFAULT
 from json import dumps as data_dumps
 DATABASE_NAME = 'database_v4'
+DATABASE_VERSION = 7  # Schema version stored in PRAGMA user_version for in-place migrations
 
 # data_loads = eval
 # data_dumps = repr
@@ -27,6 +38,179 @@ TIME_MINUTES = 60
 TIME_HOURS = 60 * TIME_MINUTES
 TIME_DAYS = 24 * TIME_HOURS
 
+DATABASE_TIMEOUT = 10  # Seconds sqlite busy handler waits for another process to release the database
+DATABASE_OPEN_ATTEMPTS = 3
+DATABASE_BUSY_WAIT = 1  # Seconds to back off when database is still locked after DATABASE_TIMEOUT. Doubles each attempt
+DATABASE_STATEMENTS = 64  # Prepared statements kept per connection
+
+_thread_local = local()  # Persistent connections per thread per database file
+_writer_locks = {}
+_writer_locks_lock = Lock()
+_lock_waits = {'count': 0, 'total': 0.0, 'max': 0.0}  # Running totals so the service process doesn't keep every wait
+_write_behind = weakref.WeakSet()  # Caches with delayed writes or access times which still need flushing at interpreter exit
+
+STATS_PREFIX_DEPTH = 5  # Maximum name segments used to group keys for statistics
+STATS_PREFIX_SPLIT = re.compile(r'[./?&=]')
+CACHE_KEY_SIZE = 16  # Bytes of digest used as database key. Stored as hex so keys are twice this length
+STATS_EXPIRY_BUCKETS = (
+    ('expired', 0), ('1h', TIME_HOURS), ('1d', TIME_DAYS), ('7d', 7 * TIME_DAYS), ('30d', 30 * TIME_DAYS), ('later', None))
+
+MEMORY_BUDGET = 16 * 1024 * 1024  # Bytes of encoded objects kept in the in-process memory tier
+MEMORY_TTL = 5 * 60  # Seconds before an object in the memory tier is checked again against the shared tiers
+
+WRITE_BEHIND_SIZE = 100  # Flush delayed writes once this many objects are queued
+WRITE_BEHIND_TIME = 10  # Flush delayed writes once the oldest queued object has waited this many seconds
+
+SQL_VARIABLE_LIMIT = 500  # Stay well below SQLITE_MAX_VARIABLE_NUMBER (999 on older builds)
+
+LEASE_TIME = 15  # Leases older than this are from a crashed or hung process and can be taken over
+LEASE_POLL = 0.1
+
+CLEANUP_BATCH = 500  # Rows deleted per statement
+CLEANUP_BUDGET = 0.5  # Seconds a plugin process spends on cleanup before leaving the rest for the next call
+CLEANUP_FORCE_CUTOFF = 2 ** 62
+VACUUM_PAGES = 256  # Pages released per incremental_vacuum step
+VACUUM_FULL_RATE = 16 * 1024 * 1024  # Bytes per second assumed for a full VACUUM when checking it fits in the time budget
+AUTO_VACUUM_INCREMENTAL = 2
+
+MEGABYTES = 1024 * 1024
+DATABASE_QUOTA = 128 * MEGABYTES  # Bytes of pages in use before least recently accessed objects are evicted
+DATABASE_QUOTAS = {
+    'TMDb.db': 256 * MEGABYTES,
+    'ItemBuilder.db': 128 * MEGABYTES,
+    'FanartTV.db': 32 * MEGABYTES,
+    'OMDb.db': 32 * MEGABYTES}
+QUOTA_TARGET = 0.9  # Evict down to this fraction of quota so that eviction doesn't run on every cleanup
+EVICT_BATCH = 100  # Rows evicted per statement. Smaller than CLEANUP_BATCH to avoid evicting far below quota
+ACCESS_BATCH = 200  # Write access times once this many objects have been read
+
+STALE_RETENTION = 7 * TIME_DAYS  # Keep expired rows this long so they can be served stale while revalidating
+STALE_RETENTIONS = {  # Only caches which serve stale objects keep them after expiry. Others are cleaned up when they expire
+    'TMDb.db': STALE_RETENTION,
+    'TraktAPI.db': STALE_RETENTION,
+    'FanartTV.db': STALE_RETENTION,
+    'OMDb.db': STALE_RETENTION}
+
+
+@atexit.register
+def _flush_write_behind():
+    for i in list(_write_behind):
+        i.flush()
+
+
+class MemoryCache():
+    def __init__(self, budget=MEMORY_BUDGET, ttl=MEMORY_TTL):
+        """
+        Least recently used in-process tier in front of the window property tier
+        Holds encoded objects so that size is known and callers cannot mutate each other's objects
+        """
+        self.budget = budget
+        self.ttl = ttl
+        self.size = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, cur_time):
+        with self._lock:
+            try:
+                expires, data = self._items[key]
+            except KeyError:
+                self.stats['misses'] += 1
+                return
+            if expires <= cur_time:
+                self._pop(key)
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return
+            self._items.move_to_end(key)
+            self.stats['hits'] += 1
+            return data
+
+    def set(self, key, expires, data, cur_time, replace=True):
+        """ replace=False only adds objects read from a slower tier so that a newer object set meanwhile is kept """
+        size = len(data)
+        with self._lock:
+            if key in self._items and not replace:
+                return
+            if key in self._items:
+                self._pop(key)  # Drop old value first so it isn't served in place of an object too large to keep
+            if size > self.budget // 4:
+                return  # Don't let one huge object flush everything else
+            self._items[key] = (min(int(expires), cur_time + self.ttl), data)
+            self.size += size
+            while self.size > self.budget:
+                self._pop(next(iter(self._items)))
+                self.stats['evictions'] += 1
+
+    def _pop(self, key):
+        self.size -= len(self._items.pop(key)[1])
+
+    def clear(self, prefix):
+        with self._lock:
+            for key in [i for i in self._items if i[0] == prefix]:
+                self._pop(key)
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, 'items': len(self._items), 'bytes': self.size}
+
+
+_memory_cache = MemoryCache()
+
+
+def get_memory_stats():
+    return _memory_cache.get_stats()
+
+
+def get_key_prefix(name, depth=STATS_PREFIX_DEPTH):
+    '''
+        group cache name by its leading segments for statistics
+        stops at the first segment containing digits because that is usually an id or other parameter
+        e.g. TMDb.get_request_lc.tv.1399.credits -> TMDb.get_request_lc.tv
+    '''
+    prefix = []
+    for i in STATS_PREFIX_SPLIT.split(name, depth)[:depth]:
+        if not i or any(c.isdigit() for c in i):
+            break
+        prefix.append(i)
+    return '.'.join(prefix) or STATS_PREFIX_SPLIT.split(name, 1)[0]
+
+
+def get_key_segments(name, depth=None):
+    '''name split into segments however they are separated e.g. TMDb/tv/1399 and TMDb.tv.1399 -> [TMDb, tv, 1399]'''
+    return [i for i in STATS_PREFIX_SPLIT.split(name or '') if i][:depth]
+
+
+def get_cache_key(cache_name):
+    '''fixed length digest of the cache name used as the database key. the name itself is only kept for diagnostics'''
+    return blake2b((cache_name or '').encode('utf-8', 'surrogatepass'), digest_size=CACHE_KEY_SIZE).hexdigest()
+
+
+def _get_report_stats(report, prefix):
+    try:
+        return report[prefix]
+    except KeyError:
+        report[prefix] = {'rows': 0, 'bytes': 0, 'expires': {k: 0 for k, v in STATS_EXPIRY_BUCKETS}, 'hits': 0, 'misses': 0}
+        return report[prefix]
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def data_decode(data):
+    '''object stored in data or None if it can't be read e.g. written by an older codec or set by another add-on'''
+    try:
+        return codec_decode(data)
+    except ValueError:
+        return
+
+
+def get_lock_wait_stats():
+    with _writer_locks_lock:
+        return dict(_lock_waits)
+
 
 class SimpleCache(object):
     '''simple stateless caching system for Kodi'''
@@ -36,18 +220,37 @@ class SimpleCache(object):
     _busy_tasks = []
     _database = None
 
-    def __init__(self, folder=None, filename=None, mem_only=False, delay_write=False):
-        '''Initialize our caching class'''
+    def __init__(
+            self, folder=None, filename=None, mem_only=False, delay_write=False, codec=CODEC_DEFAULT, quota=None,
+            service_write=True, stale_retention=None):
+        '''
+            Initialize our caching class
+            service_write hands off writes to the service cache writer when it is running
+            stale_retention seconds to keep expired rows for serving stale. Defaults to STALE_RETENTIONS for filename
+        '''
         folder = folder or DATABASE_NAME
         filename = filename or 'defaultcache.db'
+        self._folder = folder
+        self._filename = filename
+        self._service_write = service_write
         self._win = Window(10000)
         self._monitor = Monitor()
         self._db_file = get_file_path(folder, filename)
         self._sc_name = f'{folder}_{filename}_simplecache'
         self._mem_only = mem_only
-        self._queue = []
+        self._codec = codec
+        self._quota = quota if quota is not None else DATABASE_QUOTAS.get(filename, DATABASE_QUOTA)
+        self._stale_retention = stale_retention if stale_retention is not None else STALE_RETENTIONS.get(filename, 0)
+        self._queue = {}
+        self._queue_time = 0
+        self._queue_lock = Lock()
+        self._accessed = {}
+        self._hit_stats = {}
+        self._reads = 0
         self._delaywrite = delay_write
-        self._connection = None
+        if not mem_only:
+            _write_behind.add(self)
+        self._lease_owner = f'{os.getpid()}.{get_ident()}'
         self.check_cleanup()
         kodi_log("CACHE: Initialized")
 
@@ -61,13 +264,62 @@ class SimpleCache(object):
 
     def __del__(self):
         '''make sure close is called'''
-        if self._queue:
-            kodi_log(f'CACHE: Write {len(self._queue)} Items in Queue\n{self._sc_name}', 2)
-        for i in self._queue:
-            self._set_db_cache(*i)
-        self._queue = []
+        self.flush()
         self.close()
 
+    def flush(self):
+        '''write all objects in the delayed write queue to the database in a single transaction'''
+        self._flush_accessed()
+        with self._queue_lock:
+            queue, self._queue = self._queue, {}
+        if not queue:
+            return
+        timer_a = timer()
+        if not self._hand_off(list(queue.values())):
+            self._set_db_cache_many(list(queue.values()))
+        kodi_log(f'CACHE: Wrote {len(queue)} Items in Queue in {timer() - timer_a:.3f} sec\n{self._sc_name}', 2)
+
+    def _hand_off(self, rows=(), validators=()):
+        '''send rows and validators to service cache writer. returns False if they need writing directly instead'''
+        if not self._service_write or self._exit:
+            return False
+        return send_rows(self._folder, self._filename, rows, validators)
+
+    def _set_accessed(self, endpoint, cur_time, is_hit=True, name=None):
+        '''note read of endpoint for least recently used eviction and hit rates. written in batches'''
+        if self._mem_only:
+            return
+        prefix = get_key_prefix(name or endpoint)
+        with self._queue_lock:
+            if is_hit:
+                self._accessed[endpoint] = cur_time
+            self._hit_stats.setdefault(prefix, [0, 0])[0 if is_hit else 1] += 1
+            self._reads += 1
+            is_flush = self._reads >= ACCESS_BATCH
+        if is_flush:
+            self._flush_accessed()
+
+    def _flush_accessed(self):
+        with self._queue_lock:
+            accessed, self._accessed = self._accessed, {}
+            hit_stats, self._hit_stats = self._hit_stats, {}
+            self._reads = 0
+        if accessed:
+            query = "UPDATE simplecache SET accessed = ? WHERE id = ?"
+            self._execute_transaction(query, [(v, k) for k, v in accessed.items()])
+        if hit_stats:
+            query = "INSERT OR IGNORE INTO simplecache_stats(prefix, hits, misses) VALUES (?, 0, 0)"
+            self._execute_transaction(query, [(k,) for k in hit_stats])
+            query = "UPDATE simplecache_stats SET hits = hits + ?, misses = misses + ? WHERE prefix = ?"
+            self._execute_transaction(query, [(v[0], v[1], k) for k, v in hit_stats.items()])
+
+    def _get_queued(self, endpoint):
+        '''write queued object for endpoint to database now so that it is visible to other processes'''
+        with self._queue_lock:
+            queued = self._queue.pop(endpoint, None)
+        if queued:
+            self._set_db_cache(*queued)
+
     @contextmanager
     def busy_tasks(self, task_name):
         self._busy_tasks.append(task_name)
@@ -76,31 +328,220 @@ class SimpleCache(object):
         finally:
             self._busy_tasks.remove(task_name)
 
-    def get(self, endpoint, no_hdd=False):
+    def get(self, endpoint, no_hdd=False, name=None):
         '''
             get object from cache and return the results
             endpoint: the (unique) name of the cache object as reference
+            name: readable name of the object for statistics if endpoint is a key
         '''
         cur_time = set_timestamp(0, True)
         result = self._get_mem_cache(endpoint, cur_time)  # Try from memory first
-        if result is not None or self._mem_only or no_hdd:
-            return result
-        return self._get_db_cache(endpoint, cur_time)  # Fallback to checking database if not in memory
+        if result is None and not self._mem_only and not no_hdd:
+            result = self._get_db_cache(endpoint, cur_time)  # Fallback to checking database if not in memory
+        self._set_accessed(endpoint, cur_time, result is not None, name)
+        return result
 
-    def set(self, endpoint, data, cache_days=30):
-        """ set data in cache """
+    def get_many(self, endpoints):
+        '''
+            get multiple objects from cache using a single database query for those not in memory
+            objects found in the database are added to the memory cache
+            endpoints can be a dict of {endpoint: name} to record statistics by readable name
+            returns dict of {endpoint: object} for objects found
+        '''
+        names = endpoints if isinstance(endpoints, dict) else {}
+        cur_time = set_timestamp(0, True)
+        results = {}
+        for endpoint in endpoints:
+            result = self._get_mem_cache(endpoint, cur_time)
+            if result is not None:
+                results[endpoint] = result
+        if self._mem_only:
+            return results
+        missing = list({i for i in endpoints if i not in results})
+        for x in range(0, len(missing), SQL_VARIABLE_LIMIT):
+            chunk = missing[x:x + SQL_VARIABLE_LIMIT]
+            query = f"SELECT id, expires, data FROM simplecache WHERE id IN ({','.join('?' * len(chunk))})"
+            cache_data = self._execute_sql(query, tuple(chunk))
+            if not cache_data:
+                continue
+            for endpoint, expires, data in cache_data.fetchall():
+                result = data_decode(data) if int(expires) > cur_time else None
+                if result is None:
+                    continue
+                self._set_mem_cache(endpoint, expires, data, replace=False)
+                results[endpoint] = result
+        for endpoint in endpoints:
+            self._set_accessed(endpoint, cur_time, endpoint in results, names.get(endpoint))
+        return results
+
+    def get_stale(self, endpoint, grace_time=0):
+        '''
+            get expired object from database if it expired less than grace_time seconds ago
+            returns None if the object is fresh (use get instead) or too old
+        '''
+        if self._mem_only or not grace_time:
+            return
+        cur_time = set_timestamp(0, True)
+        query = "SELECT expires, data FROM simplecache WHERE id = ? LIMIT 1"
+        cache_data = self._execute_sql(query, (endpoint,))
+        if not cache_data:
+            return
+        cache_data = cache_data.fetchone()
+        if not cache_data or int(cache_data[0]) + grace_time <= cur_time:
+            return
+        return data_decode(cache_data[1])
+
+    def get_expires(self, endpoint):
+        '''get expiry timestamp of object in database or None if it isn't cached'''
+        if self._mem_only:
+            return
+        query = "SELECT expires FROM simplecache WHERE id = ? LIMIT 1"
+        cache_data = self._execute_sql(query, (endpoint,))
+        if not cache_data:
+            return
+        cache_data = cache_data.fetchone()
+        return int(cache_data[0]) if cache_data else None
+
+    def queue_refresh(self, endpoint, data):
+        '''add endpoint to refresh queue with the data needed to rebuild its request'''
+        if self._mem_only:
+            return
+        query = "INSERT OR REPLACE INTO simplecache_refresh(id, queued, data) VALUES (?, ?, ?)"
+        self._execute_sql(query, (endpoint, set_timestamp(0, True), data_dumps(data)))
+
+    def pop_refresh_queue(self, limit=20):
+        '''remove and return the oldest items in the refresh queue'''
+        if self._mem_only:
+            return []
+        query = "SELECT id, data FROM simplecache_refresh ORDER BY queued LIMIT ?"
+        cache_data = self._execute_sql(query, (limit,))
+        if not cache_data:
+            return []
+        cache_data = cache_data.fetchall()
+        if cache_data:
+            self._execute_sql("DELETE FROM simplecache_refresh WHERE id = ?", [(i[0],) for i in cache_data])
+        return [(i[0], data_loads(i[1])) for i in cache_data]
+
+    def get_validators(self, endpoint):
+        '''get the ETag and Last-Modified validators stored for endpoint'''
+        if self._mem_only:
+            return
+        query = "SELECT etag, modified FROM simplecache_validator WHERE id = ? LIMIT 1"
+        cache_data = self._execute_sql(query, (endpoint,))
+        if not cache_data:
+            return
+        cache_data = cache_data.fetchone()
+        if not cache_data:
+            return
+        return {'etag': cache_data[0], 'modified': cache_data[1]}
+
+    def set_validators(self, endpoint, etag=None, modified=None):
+        '''store validators for endpoint via service cache writer when it is running'''
+        if self._mem_only:
+            return
+        validators = [(endpoint, etag, modified)]
+        if not self._hand_off(validators=validators):
+            self._set_validators_many(validators)
+
+    def _set_validators_many(self, validators):
+        '''store list of (endpoint, etag, modified). endpoints without either validator have their validators deleted'''
+        deleted = [(i[0],) for i in validators if not i[1] and not i[2]]
+        if deleted:
+            self._execute_transaction("DELETE FROM simplecache_validator WHERE id = ?", deleted)
+        validators = [i for i in validators if i[1] or i[2]]
+        if validators:
+            self._execute_transaction("INSERT OR REPLACE INTO simplecache_validator(id, etag, modified) VALUES (?, ?, ?)", validators)
+
+    def renew(self, endpoint, cache_days=30):
+        '''
+            extend the expiry of an object without rewriting its data
+            returns the object and the size of its stored data or None if it isn't in the database
+        '''
+        if self._mem_only:
+            return
+        self._get_queued(endpoint)  # Make sure an object waiting in the queue is in the database to be renewed
+        expires = set_timestamp(cache_days * TIME_DAYS, True)
+        self._execute_sql("UPDATE simplecache SET expires = ? WHERE id = ?", (expires, endpoint))
+        cache_data = self._execute_sql("SELECT data FROM simplecache WHERE id = ? LIMIT 1", (endpoint,))
+        cache_data = cache_data.fetchone() if cache_data else None
+        if not cache_data:
+            return
+        self._set_mem_cache(endpoint, expires, cache_data[0])
+        return data_decode(cache_data[0]), len(cache_data[0])
+
+    def set(self, endpoint, data, cache_days=30, name=None):
+        """ set data in cache. name is the readable name kept for diagnostics if endpoint is a key """
         with self.busy_tasks(f'set.{endpoint}'):
             expires = set_timestamp(cache_days * TIME_DAYS, True)
-            data = data_dumps(data)
+            data = data_encode(data, self._codec)
             self._set_mem_cache(endpoint, expires, data)
             if self._mem_only:
                 return
+            if cache_days <= 0:
+                # Deletes go straight to the database so that get doesn't fall back to an older row still queued there
+                # They are also handed off so that the service doesn't write its queued row back over them
+                with self._queue_lock:
+                    self._queue.pop(endpoint, None)
+                self._hand_off([(endpoint, expires, data, name)])
+                self._set_db_cache(endpoint, expires, data, name)
+                return
             if self._delaywrite:
-                self._queue.append((endpoint, expires, data))
+                with self._queue_lock:
+                    self._queue_time = self._queue_time if self._queue else timer()
+                    self._queue[endpoint] = (endpoint, expires, data, name)  # Only the last object set for endpoint is written
+                    is_flush = len(self._queue) >= WRITE_BEHIND_SIZE or timer() - self._queue_time > WRITE_BEHIND_TIME
+                if is_flush:
+                    self.flush()
+                return
+            if not self._hand_off([(endpoint, expires, data, name)]):
+                self._set_db_cache(endpoint, expires, data, name)
+
+    def get_lease(self, endpoint, lease_time=LEASE_TIME):
+        '''
+            take the cross-process lease for fetching endpoint
+            returns True if this process holds the lease and should do the fetch
+        '''
+        if self._mem_only:
+            return True
+        cur_time = set_timestamp(0, True)
+        self._execute_sql("DELETE FROM simplecache_lease WHERE id = ? AND expires <= ?", (endpoint, cur_time))
+        query = "INSERT OR IGNORE INTO simplecache_lease(id, expires, owner) VALUES (?, ?, ?)"
+        result = self._execute_sql(query, (endpoint, cur_time + lease_time, self._lease_owner))
+        if result is None:
+            return True  # Couldn't access lease table so don't block fetching
+        return result.rowcount == 1
+
+    def del_lease(self, endpoint):
+        '''release lease after making sure any queued write for endpoint is in the database for waiting processes'''
+        if self._mem_only:
+            return
+        self._get_queued(endpoint)
+        query = "DELETE FROM simplecache_lease WHERE id = ? AND owner = ?"
+        self._execute_sql(query, (endpoint, self._lease_owner))
+
+    def _has_lease(self, endpoint, cur_time):
+        query = "SELECT 1 FROM simplecache_lease WHERE id = ? AND expires > ? LIMIT 1"
+        cache_data = self._execute_sql(query, (endpoint, cur_time))
+        return True if cache_data and cache_data.fetchone() else False
+
+    def wait_for_lease(self, endpoint, timeout=LEASE_TIME):
+        '''
+            wait for the process holding the lease on endpoint to write its result
+            returns the cached object or None if the lease was released or expired without a result
+        '''
+        timer_z = timer() + timeout
+        while not self._monitor.abortRequested():
+            cur_time = set_timestamp(0, True)
+            # Writes handed off to the service are in window properties before they are in the database
+            result = self._get_mem_cache(endpoint, cur_time)
+            result = self._get_db_cache(endpoint, cur_time) if result is None else result
+            if result is not None:
+                return result
+            if timer() > timer_z or not self._has_lease(endpoint, cur_time):
                 return
-            self._set_db_cache(endpoint, expires, data)
+            self._monitor.waitForAbort(LEASE_POLL)
 
-    def check_cleanup(self):
+    def check_cleanup(self, time_budget=CLEANUP_BUDGET, full_vacuum=False):
         '''check if cleanup is needed - public method, may be called by calling addon'''
         if self._mem_only:
             return
@@ -109,14 +550,18 @@ class SimpleCache(object):
         lastexecuted = self._win.getProperty(f'{self._sc_name}.clean.lastexecuted')
         if not lastexecuted:
             self._win.setProperty(f'{self._sc_name}.clean.lastexecuted', str(cur_time))
-        elif (int(lastexecuted) + set_timestamp(self._auto_clean_interval, True)) < cur_time:
-            self._do_cleanup()
+        elif (int(lastexecuted) + self._auto_clean_interval) < cur_time:
+            return self._do_cleanup(time_budget=time_budget, full_vacuum=full_vacuum)
 
     def _get_mem_cache(self, endpoint, cur_time):
         '''
             get cache data from memory cache
-            we use window properties because we need to be stateless
+            in-process tier first then window properties which are shared by (stateless) plugin processes
         '''
+        data = _memory_cache.get((self._sc_name, endpoint), cur_time)
+        if data is not None:
+            return data_decode(data)
+
         # Check expiration time
         expr_endpoint = f'{self._sc_name}_expr_{endpoint}'
         expr_propdata = self._win.getProperty(expr_endpoint)
@@ -129,17 +574,127 @@ class SimpleCache(object):
         if not data_propdata:
             return
 
-        return data_loads(data_propdata)
+        try:
+            data = decode_text(data_propdata)
+        except ValueError:
+            return
+        result = data_decode(data)
+        if result is None:
+            return
+        _memory_cache.set((self._sc_name, endpoint), expr_propdata, data, cur_time, replace=False)
+        return result
 
-    def _set_mem_cache(self, endpoint, expires, data):
+    def _set_mem_cache(self, endpoint, expires, data, replace=True):
         '''
-            window property cache as alternative for memory cache
-            usefull for (stateless) plugins
+            in-process memory tier plus window property cache as alternative for memory cache
+            window properties are usefull for (stateless) plugins
+            replace=False for objects read from the database so that an object set meanwhile isn't replaced by an older one
         '''
         expr_endpoint = f'{self._sc_name}_expr_{endpoint}'
         data_endpoint = f'{self._sc_name}_data_{endpoint}'
+        if not replace:
+            expr_propdata = self._win.getProperty(expr_endpoint)
+            if expr_propdata and int(expr_propdata) > set_timestamp(0, True):
+                return
         self._win.setProperty(expr_endpoint, str(expires))
-        self._win.setProperty(data_endpoint, data)
+        self._win.setProperty(data_endpoint, data if isinstance(data, str) else encode_text(data))
+        _memory_cache.set((self._sc_name, endpoint), expires, data, set_timestamp(0, True), replace=replace)
+
+    def get_report(self, depth=STATS_PREFIX_DEPTH):
+        '''
+            summarise rows grouped by key prefix with sizes, expiry distribution and recorded hit rates
+            returns dict of {prefix: stats}
+        '''
+        if self._mem_only:
+            return {}
+        self._flush_accessed()
+        cur_time = set_timestamp(0, True)
+        report = {}
+        cache_data = self._execute_sql("SELECT IFNULL(name, id), expires, length(data) FROM simplecache")
+        for name, expires, size in (cache_data.fetchall() if cache_data else []):
+            stats = _get_report_stats(report, get_key_prefix(name, depth))
+            stats['rows'] += 1
+            stats['bytes'] += size or 0
+            remaining = int(expires) - cur_time
+            stats['expires'][next(k for k, v in STATS_EXPIRY_BUCKETS if v is None or remaining <= v)] += 1
+        cache_data = self._execute_sql("SELECT prefix, hits, misses FROM simplecache_stats")
+        for prefix, hits, misses in (cache_data.fetchall() if cache_data else []):
+            stats = _get_report_stats(report, get_key_prefix(prefix, depth))
+            stats['hits'] += hits
+            stats['misses'] += misses
+        for stats in report.values():
+            reads = stats['hits'] + stats['misses']
+            stats['hit_rate'] = round(stats['hits'] / reads, 3) if reads else None
+        return report
+
+    def purge(self, prefix=None, days=None):
+        '''
+            delete objects with names starting with prefix and/or not accessed for more than days
+            prefix is matched by whole segments as grouped by get_report e.g. TMDb.tv matches TMDb/tv/1399 but not TMDb/tvshows
+            returns number of objects deleted
+        '''
+        segments = get_key_segments(prefix)
+        if self._mem_only or (not segments and days is None):
+            return 0
+        self.flush()
+        where, data = [], []
+        if segments:
+            where.append("name LIKE ? ESCAPE '\\'")  # Narrow down to first segment then compare segments of each name
+            data.append(f'{escape_like(segments[0])}%')
+        if days is not None:
+            where.append("IFNULL(accessed, 0) < ?")
+            data.append(set_timestamp(0, True) - int(days * TIME_DAYS))
+        cache_data = self._execute_sql(f"SELECT id, name FROM simplecache WHERE {' AND '.join(where)}", tuple(data))
+        endpoints = [
+            endpoint for endpoint, name in (cache_data.fetchall() if cache_data else [])
+            if not segments or get_key_segments(name, len(segments)) == segments]
+        for x in range(0, len(endpoints), SQL_VARIABLE_LIMIT):
+            chunk = endpoints[x:x + SQL_VARIABLE_LIMIT]
+            self._execute_sql(f"DELETE FROM simplecache WHERE id IN ({','.join('?' * len(chunk))})", tuple(chunk))
+        for endpoint in endpoints:
+            self._win.clearProperty(f'{self._sc_name}_expr_{endpoint}')
+            self._win.clearProperty(f'{self._sc_name}_data_{endpoint}')
+        _memory_cache.clear(self._sc_name)
+        kodi_log(f'CACHE: Purged {len(endpoints)} objects from {self._sc_name}', 1)
+        return len(endpoints)
+
+    def get_rows(self, prefix=None):
+        '''
+            yield (id, expires, data, name) for objects which haven't expired
+            only objects with names starting with prefix if given. rows stored before names were kept are skipped
+        '''
+        if self._mem_only:
+            return
+        self.flush()
+        query = "SELECT id, expires, data, name FROM simplecache WHERE expires > ? AND name IS NOT NULL"
+        data = [set_timestamp(0, True)]
+        if prefix:
+            query = f"{query} AND name LIKE ? ESCAPE '\\'"
+            data.append(f'{escape_like(prefix)}%')
+        cache_data = self._execute_sql(query, tuple(data))
+        while cache_data:
+            rows = cache_data.fetchmany(SQL_VARIABLE_LIMIT)
+            if not rows:
+                return
+            yield from rows
+
+    def merge_rows(self, rows):
+        '''
+            add list of (id, expires, data, name) rows without duplicating objects already in database
+            the row with the later expiry is kept if the object is already cached
+        '''
+        if self._mem_only or not rows:
+            return
+        self.flush()
+        cur_time = set_timestamp(0, True)
+        query = "INSERT OR IGNORE INTO simplecache( id, expires, data, checksum, accessed, name) VALUES (?, ?, ?, ?, ?, ?)"
+        self._execute_transaction(query, [(endpoint, expires, data, 0, cur_time, name) for endpoint, expires, data, name in rows])
+        query = "UPDATE simplecache SET expires = ?, data = ?, name = ? WHERE id = ? AND expires < ?"
+        self._execute_transaction(query, [(expires, data, name, endpoint, expires) for endpoint, expires, data, name in rows])
+        for endpoint, expires, data, name in rows:
+            self._win.clearProperty(f'{self._sc_name}_expr_{endpoint}')
+            self._win.clearProperty(f'{self._sc_name}_data_{endpoint}')
+        _memory_cache.clear(self._sc_name)
 
     def get_id_list(self):
         query = "SELECT id FROM simplecache"
@@ -158,14 +713,23 @@ class SimpleCache(object):
         cache_data = cache_data.fetchone()
         if not cache_data or int(cache_data[0]) <= cur_time:
             return
-        self._set_mem_cache(endpoint, cache_data[0], cache_data[1])
-        result = data_loads(cache_data[1])
+        result = data_decode(cache_data[1])
+        if result is None:
+            return
+        self._set_mem_cache(endpoint, cache_data[0], cache_data[1], replace=False)
         return result
 
-    def _set_db_cache(self, endpoint, expires, data):
+    def _set_db_cache(self, endpoint, expires, data, name=None):
         ''' store cache data in _database '''
-        query = "INSERT OR REPLACE INTO simplecache( id, expires, data, checksum) VALUES (?, ?, ?, ?)"
-        self._execute_sql(query, (endpoint, expires, data, 0))
+        query = "INSERT OR REPLACE INTO simplecache( id, expires, data, checksum, accessed, name) VALUES (?, ?, ?, ?, ?, ?)"
+        self._execute_sql(query, (endpoint, expires, data, 0, set_timestamp(0, True), name or endpoint))
+
+    def _set_db_cache_many(self, items):
+        ''' store list of (endpoint, expires, data, name) in _database with one transaction '''
+        cur_time = set_timestamp(0, True)
+        query = "INSERT OR REPLACE INTO simplecache( id, expires, data, checksum, accessed, name) VALUES (?, ?, ?, ?, ?, ?)"
+        self._execute_transaction(query, [
+            (endpoint, expires, data, 0, cur_time, name or endpoint) for endpoint, expires, data, name in items])
 
     def _do_delete(self):
         '''perform cleanup task'''
@@ -180,6 +744,7 @@ class SimpleCache(object):
 
             query = 'DELETE FROM simplecache'
             self._execute_sql(query)
+            _memory_cache.clear(self._sc_name)
             self._execute_sql("VACUUM")
 
         # Washup
@@ -187,108 +752,331 @@ class SimpleCache(object):
         self._win.clearProperty(f'{self._sc_name}.cleanbusy')
         kodi_log(f'CACHE: Delete {self._sc_name} done')
 
-    def _do_cleanup(self, force=False):
-        '''perform cleanup task'''
+    def _do_cleanup(self, force=False, time_budget=None, full_vacuum=False):
+        '''
+            perform cleanup task
+            time_budget limits seconds spent so that cleanup can run in slices
+            lastexecuted is only updated when finished so the next call continues an unfinished cleanup
+            full_vacuum allows one-off conversion of databases created before incremental vacuum
+        '''
         if self._exit or self._monitor.abortRequested():
             return
 
         with self.busy_tasks(__name__):
             cur_time = set_timestamp(0, True)
+            timer_z = timer() + time_budget if time_budget else None
             kodi_log("CACHE: Running cleanup...")
             if self._win.getProperty(f'{self._sc_name}.cleanbusy'):
                 return
             self._win.setProperty(f'{self._sc_name}.cleanbusy', "busy")
 
-            query = "SELECT id, expires FROM simplecache"
-            for cache_data in self._execute_sql(query).fetchall():
-                cache_id = cache_data[0]
-                cache_expires = cache_data[1]
-                if self._exit or self._monitor.abortRequested():
-                    return
-                # always cleanup all memory objects on each interval
-                self._win.clearProperty(cache_id)
-                # clean up db cache object only if expired
-                if force or int(cache_expires) < cur_time:
-                    query = 'DELETE FROM simplecache WHERE id = ?'
-                    self._execute_sql(query, (cache_id,))
-                    kodi_log(f'CACHE: delete from db {cache_id}')
-
-            # compact db
-            self._execute_sql("VACUUM")
+            try:
+                # clean up db cache objects in batches only if expired and too old to be served stale
+                is_done = self._do_cleanup_expired(CLEANUP_FORCE_CUTOFF if force else cur_time - self._stale_retention, timer_z)
+
+                # evict least recently accessed objects if database is still over quota
+                is_done = is_done and self._do_cleanup_quota(timer_z)
+
+                # remove leases left behind by crashed processes and validators for deleted objects
+                if is_done:
+                    self._execute_sql("DELETE FROM simplecache_lease WHERE expires < ?", (cur_time,))
+                    self._execute_sql("DELETE FROM simplecache_validator WHERE id NOT IN (SELECT id FROM simplecache)")
+
+                # compact db
+                is_done = is_done and self._do_cleanup_vacuum(timer_z, full_vacuum)
+            finally:
+                self._win.clearProperty(f'{self._sc_name}.cleanbusy')
 
         # Washup
+        if not is_done:
+            kodi_log("CACHE: Auto cleanup paused")
+            return
         self._win.setProperty(f'{self._sc_name}.clean.lastexecuted', str(cur_time))
-        self._win.clearProperty(f'{self._sc_name}.cleanbusy')
         kodi_log("CACHE: Auto cleanup done")
+        return True
+
+    def _is_cleanup_paused(self, timer_z=None):
+        if self._exit or self._monitor.abortRequested():
+            return True
+        if timer_z and timer() > timer_z:
+            return True
+        return False
+
+    def _do_cleanup_expired(self, cutoff, timer_z=None):
+        '''delete rows which expired before cutoff in batches using expires index. returns True when finished'''
+        query = "DELETE FROM simplecache WHERE rowid IN (SELECT rowid FROM simplecache WHERE expires < ? LIMIT ?)"
+        while not self._is_cleanup_paused(timer_z):
+            result = self._execute_sql(query, (cutoff, CLEANUP_BATCH))
+            if not result or result.rowcount < CLEANUP_BATCH:
+                return True
+            kodi_log(f'CACHE: delete from db {result.rowcount} rows')
+        return False
+
+    def _get_db_size(self):
+        '''bytes of database pages in use. free pages waiting for vacuum are not counted'''
+        try:
+            page_size, page_count, freelist_count = (
+                self._execute_sql(f"PRAGMA {i}").fetchone()[0] for i in ('page_size', 'page_count', 'freelist_count'))
+        except (AttributeError, TypeError):
+            return
+        return (page_count - freelist_count) * page_size
+
+    def _do_cleanup_quota(self, timer_z=None, evict_batch=EVICT_BATCH):
+        '''evict least recently accessed rows in batches until below quota. returns True when finished'''
+        if not self._quota:
+            return True
+        db_size = self._get_db_size()
+        if not db_size or db_size <= self._quota:
+            return True
+        kodi_log(f'CACHE: {self._sc_name} {db_size} bytes exceeds quota {self._quota} bytes', 1)
+        self._flush_accessed()
+        query = "DELETE FROM simplecache WHERE rowid IN (SELECT rowid FROM simplecache ORDER BY accessed LIMIT ?)"
+        while not self._is_cleanup_paused(timer_z):
+            result = self._execute_sql(query, (evict_batch,))
+            if not result or result.rowcount < evict_batch:
+                return True
+            kodi_log(f'CACHE: evict from db {result.rowcount} rows')
+            db_size = self._get_db_size()
+            if not db_size or db_size <= self._quota * QUOTA_TARGET:
+                return True
+        return False
+
+    def _do_cleanup_vacuum(self, timer_z=None, full_vacuum=False):
+        '''release free pages in bounded incremental_vacuum steps. returns True when finished'''
+        auto_vacuum = self._execute_sql("PRAGMA auto_vacuum")
+        if not auto_vacuum or auto_vacuum.fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            if not full_vacuum:
+                return True  # Conversion needs a full VACUUM which is left to the service
+            return self._do_cleanup_full_vacuum(timer_z)
+        while not self._is_cleanup_paused(timer_z):
+            freelist_count = self._execute_sql("PRAGMA freelist_count")
+            if not freelist_count or not freelist_count.fetchone()[0]:
+                return True
+            result = self._execute_sql(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+            if not result:
+                return True
+            result.fetchall()  # Each step of the statement frees one page
+        return False
+
+    def _do_cleanup_full_vacuum(self, timer_z=None):
+        '''
+            convert to incremental vacuum with a one-off full VACUUM which rewrites the whole file
+            only started if it is expected to finish within the time budget and interrupted if it doesn't
+            files too large to convert within the budget keep reusing their free pages instead of releasing them
+        '''
+        if timer_z:
+            db_size = self._get_db_size()
+            if not db_size or db_size > (timer_z - timer()) * VACUUM_FULL_RATE:
+                kodi_log(f'CACHE: Skipping conversion of {self._sc_name} to incremental vacuum. {db_size} bytes exceeds time budget')
+                return True
+        connection = self._get_database()
+        if not connection:
+            return True
+        kodi_log(f'CACHE: Converting {self._sc_name} to incremental vacuum...', 1)
+        if timer_z:
+            connection.set_progress_handler(lambda: timer() > timer_z, 1000)  # Non-zero return aborts VACUUM which rolls back
+        try:
+            self._execute_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            self._execute_sql("VACUUM")
+        finally:
+            connection.set_progress_handler(None, 0)
+        return True
+
+    def _migrate(self, connection):
+        '''upgrade schema of databases created by older versions'''
+        if connection.execute("PRAGMA user_version").fetchone()[0] >= DATABASE_VERSION:
+            return
+        connection.execute("BEGIN IMMEDIATE")  # Check again inside transaction in case another process just migrated
+        try:
+            user_version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if user_version < DATABASE_VERSION:
+                kodi_log(f'CACHE: Migrating {self._db_file} to schema version {DATABASE_VERSION}...', 1)
+            if user_version < 5:  # database_v4 has no expires index
+                connection.execute("CREATE INDEX IF NOT EXISTS idx_expires ON simplecache(expires)")
+            if user_version < 6:  # Access time for least recently used eviction. Existing rows are evicted first
+                connection.execute("ALTER TABLE simplecache ADD COLUMN accessed INTEGER")
+                connection.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON simplecache(accessed)")
+            if user_version < 7:  # Ids are hashed keys with the readable name kept for diagnostics
+                connection.execute("ALTER TABLE simplecache ADD COLUMN name TEXT")
+                self._migrate_legacy(connection)
+            connection.execute(f"PRAGMA user_version={max(user_version, DATABASE_VERSION)}")
+            connection.execute("COMMIT")
+        except Exception:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+
+    def _migrate_legacy(self, connection):
+        '''
+            rekey rows stored under names munged by get_pickle_name before keys were hashed so objects such as search history are kept
+            the name is only known if munging left it unchanged. munging turns separators into _ so ids containing _ are ambiguous
+            other rows could never be looked up again so they are deleted rather than left to count towards the quota
+        '''
+        rows = connection.execute("SELECT rowid, id FROM simplecache").fetchall()
+        connection.executemany("UPDATE OR IGNORE simplecache SET id = ?, name = ? WHERE rowid = ?", [
+            (get_cache_key(endpoint), endpoint, rowid) for rowid, endpoint in rows
+            if endpoint and '_' not in endpoint and get_pickle_name(endpoint) == endpoint])
+        connection.execute("DELETE FROM simplecache WHERE name IS NULL")
+
+    def _migrate_database(self, connection, attempts=DATABASE_OPEN_ATTEMPTS):
+        '''
+            migrate schema separately from opening so that a failed migration never deletes the database
+            a migration blocked by another process is retried. returns True once schema is current
+        '''
+        for attempt in range(attempts):
+            try:
+                self._migrate(connection)
+                return True
+            except sqlite3.OperationalError as error:
+                kodi_log(f'CACHE: Busy while migrating {self._db_file}: {error} ({attempt + 1}/{attempts})', 1)
+                if self._monitor.waitForAbort(DATABASE_BUSY_WAIT * 2 ** attempt):
+                    return False
+            except sqlite3.Error as error:
+                kodi_log(f'CACHE: Unable to migrate {self._db_file}\n{error}', 1)
+                return False
+        return False
+
+    def _create_tables(self, connection):
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS simplecache_lease(
+            id TEXT PRIMARY KEY, expires INTEGER, owner TEXT)""")
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS simplecache_refresh(
+            id TEXT PRIMARY KEY, queued INTEGER, data TEXT)""")
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS simplecache_validator(
+            id TEXT PRIMARY KEY, etag TEXT, modified TEXT)""")
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS simplecache_stats(
+            prefix TEXT PRIMARY KEY, hits INTEGER, misses INTEGER)""")
 
     def _set_pragmas(self, connection):
-        if not self._connection:
-            connection.execute("PRAGMA synchronous=normal")
-            connection.execute("PRAGMA journal_mode=WAL")
-            # connection.execute("PRAGMA temp_store=memory")
-            # connection.execute("PRAGMA mmap_size=2000000000")
-            # connection.execute("PRAGMA cache_size=-500000000")
-        if self._delaywrite:
-            self._connection = connection
+        connection.execute("PRAGMA synchronous=normal")
+        connection.execute("PRAGMA journal_mode=WAL")
+        # connection.execute("PRAGMA temp_store=memory")
+        # connection.execute("PRAGMA mmap_size=2000000000")
+        # connection.execute("PRAGMA cache_size=-500000000")
         return connection
 
-    def _get_database(self, attempts=2):
-        '''get reference to our sqllite _database - performs basic integrity check'''
+    def _connect(self):
+        return sqlite3.connect(self._db_file, timeout=DATABASE_TIMEOUT, isolation_level=None, cached_statements=DATABASE_STATEMENTS)
+
+    def _init_database(self, connection):
+        '''create simplecache table in a new database file'''
+        if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'simplecache'").fetchone():
+            return
+        kodi_log(f'CACHE: Initialising: {self._db_file}...', 1)
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")  # Must be set before first table is created
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS simplecache(
+            id TEXT UNIQUE, expires INTEGER, data TEXT, checksum INTEGER)""")
+        connection.execute("CREATE INDEX IF NOT EXISTS idx ON simplecache(id)")
+
+    def _open_database(self):
+        connection = self._connect()
         try:
-            connection = self._connection or sqlite3.connect(self._db_file, timeout=5, isolation_level=None, check_same_thread=not self._delaywrite)
-            connection.execute('SELECT * FROM simplecache LIMIT 1')
+            self._init_database(connection)
+            self._create_tables(connection)
             return self._set_pragmas(connection)
         except Exception:
-            # our _database is corrupt or doesn't exist yet, we simply try to recreate it
-            if xbmcvfs.exists(self._db_file):
-                kodi_log(f'CACHE: Deleting Corrupt File: {self._db_file}...', 1)
-                xbmcvfs.delete(self._db_file)
+            connection.close()
+            raise
+
+    def _delete_database(self):
+        '''delete database file along with its write-ahead log so that a stale log isn't applied to the new file'''
+        for i in ('', '-wal', '-shm'):
+            if xbmcvfs.exists(f'{self._db_file}{i}'):
+                xbmcvfs.delete(f'{self._db_file}{i}')
+
+    def _get_database(self, attempts=DATABASE_OPEN_ATTEMPTS):
+        '''
+            get this thread's persistent connection to our sqllite _database
+            connection is created on first use in each thread and performs basic integrity check
+            database is only deleted and recreated if sqlite says it is corrupt. a locked database is retried instead
+        '''
+        connections = _thread_local.__dict__.setdefault('connections', {})
+        try:
+            return connections[self._db_file]
+        except KeyError:
+            pass
+        for attempt in range(attempts):
             try:
-                kodi_log(f'CACHE: Initialising: {self._db_file}...', 1)
-                connection = self._connection or sqlite3.connect(self._db_file, timeout=5, isolation_level=None, check_same_thread=not self._delaywrite)
-                connection.execute(
-                    """CREATE TABLE IF NOT EXISTS simplecache(
-                    id TEXT UNIQUE, expires INTEGER, data TEXT, checksum INTEGER)""")
-                connection.execute("CREATE INDEX idx ON simplecache(id)")
-                return self._set_pragmas(connection)
-            except Exception as error:
-                kodi_log(f'CACHE: Exception while initializing _database: {error} ({attempts})', 1)
-                if attempts < 1:
+                connection = self._open_database()
+            except sqlite3.OperationalError as error:
+                # Another process held a lock for longer than DATABASE_TIMEOUT e.g. a long write or migration
+                kodi_log(f'CACHE: Busy while opening {self._db_file}: {error} ({attempt + 1}/{attempts})', 1)
+                if self._monitor.waitForAbort(DATABASE_BUSY_WAIT * 2 ** attempt):
                     return
-                attempts -= 1
-                self._monitor.waitForAbort(1)
-                return self._get_database(attempts)
+            except sqlite3.DatabaseError as error:
+                # File is not a database or its image is malformed so the only option is to start again
+                kodi_log(f'CACHE: Deleting Corrupt File: {self._db_file}...\n{error}', 1)
+                self._delete_database()
+            else:
+                break
+        else:
+            kodi_log(f'CACHE: Unable to open {self._db_file} after {attempts} attempts', 1)
+            return
+        if not self._migrate_database(connection, attempts):
+            connection.close()  # Left for next call to try again rather than using old schema
+            return
+        connections[self._db_file] = connection
+        return connection
 
-    def _execute_sql(self, query, data=None):
-        '''little wrapper around execute and executemany to just retry a db command if db is locked'''
-        retries = 10
-        result = None
-        error = ''
-        # always use new db object because we need to be sure that data is available for other simplecache instances
-        with self._get_database() as _database:
-            while retries > 0 and not self._monitor.abortRequested():
-                if self._exit:
-                    return None
+    @contextmanager
+    def _writer(self, query):
+        '''
+            serialize writes from all threads in this process through one lock per database file
+            sqlite only allows one writer so threads queue here instead of failing with database is locked
+        '''
+        if query.lstrip()[:6].upper() == 'SELECT':
+            yield
+            return
+        with _writer_locks_lock:
+            lock = _writer_locks.setdefault(self._db_file, Lock())
+        timer_a = timer()
+        with lock:
+            lock_wait = timer() - timer_a
+            if lock_wait > 0.001:
+                with _writer_locks_lock:
+                    _lock_waits['count'] += 1
+                    _lock_waits['total'] += lock_wait
+                    _lock_waits['max'] = max(_lock_waits['max'], lock_wait)
+            yield
+
+    def _execute_transaction(self, query, data):
+        '''executemany inside a single transaction so that all rows are committed together'''
+        _database = self._get_database()
+        if not _database:
+            return None
+        with self._writer(query):
+            try:
+                _database.execute("BEGIN IMMEDIATE")
+                result = _database.executemany(query, data)
+                _database.execute("COMMIT")
+                return result
+            except Exception as error:
+                kodi_log(f'CACHE: _database ERROR ! -- {error}', 1)
                 try:
-                    if isinstance(data, list):
-                        result = _database.executemany(query, data)
-                    elif data:
-                        result = _database.execute(query, data)
-                    else:
-                        result = _database.execute(query)
-                    return result
-                except sqlite3.OperationalError as err:
-                    error = err
-                    try:
-                        if "database is locked" == f'{error}':
-                            kodi_log("CACHE: Locked: Retrying DB commit...", 1)
-                            retries -= 1
-                            self._monitor.waitForAbort(0.5)
-                        else:
-                            break
-                    except TypeError:
-                        break
+                    _database.execute("ROLLBACK")
                 except Exception:
-                    break
+                    pass
+        return None
+
+    def _execute_sql(self, query, data=None):
+        '''little wrapper around execute and executemany using this thread's connection'''
+        if self._exit or self._monitor.abortRequested():
+            return None
+        _database = self._get_database()
+        if not _database:
+            return None
+        try:
+            with self._writer(query):
+                if isinstance(data, list):
+                    return _database.executemany(query, data)
+                if data:
+                    return _database.execute(query, data)
+                return _database.execute(query)
+        except Exception as error:
+            # Busy timeout already waited DATABASE_TIMEOUT seconds for other processes to release lock
             kodi_log(f'CACHE: _database ERROR ! -- {error}', 1)
         return None
@@ -0,0 +1,179 @@
+""" Portable snapshots of cache databases for seeding a fresh install or another device
+File layout:
+    magic | version (1 byte) | body length (8 bytes) | body | header length (4 bytes) | header | sha256 (32 bytes)
+Body is a zlib stream of records and header is JSON describing the snapshot
+Checksum covers body and header so that a corrupt or truncated file is rejected before anything is imported
+Checksum isn't a signature as anyone can recompute it. Objects are encoded again on export in the data only codec
+and each object is decoded on import so that anything else in a crafted file is never merged
+"""
+import os
+import re
+import json
+import zlib
+import struct
+import hashlib
+from resources.lib.addon.timedate import get_datetime_now
+from resources.lib.files.simplecache import SimpleCache
+from resources.lib.files.codec import encode, decode
+
+SNAPSHOT_MAGIC = b'TMDHSNAP'
+SNAPSHOT_VERSION = 2  # Version 1 held pickled objects so isn't imported
+SNAPSHOT_FILES = ['TMDb.db', 'ItemBuilder.db', 'FanartTV.db']
+SNAPSHOT_RECORD = struct.Struct('>BHHqBI')  # database index, id length, name length, expires, is text, data length
+SNAPSHOT_CHUNK = 1024 * 1024
+SNAPSHOT_BATCH = 500  # Rows merged per transaction on import
+
+ITEM_LANGUAGE = re.compile(r'^[a-z]{2}-[A-Z]{2}\.')  # ItemBuilder names start with language e.g. en-US.movie.550
+REQUEST_LANGUAGE = re.compile(r'language=([a-zA-Z]{2})')
+
+
+def is_language_match(name, language):
+    """ Names for another language are excluded. Names without a language (e.g. artwork) always match """
+    if ITEM_LANGUAGE.match(name):
+        return name.startswith(f'{language}.')
+    match = REQUEST_LANGUAGE.search(name)
+    if match:
+        return match.group(1) == language[:2]
+    return True
+
+
+def export_snapshot(path, filenames=None, prefix=None, language=None):
+    """
+    Write rows which haven't expired from each database in filenames to path
+    Only rows with names starting with prefix and matching language are included if given
+    Returns dict of {filename: rows exported}
+    """
+    filenames = filenames or SNAPSHOT_FILES
+    counts = {i: 0 for i in filenames}
+    checksum = hashlib.sha256()
+    compressor = zlib.compressobj(6)
+    with open(path, 'wb') as file:
+        file.write(SNAPSHOT_MAGIC + bytes((SNAPSHOT_VERSION,)) + struct.pack('>Q', 0))
+        body_len = 0
+
+        def write(chunk):
+            nonlocal body_len
+            if not chunk:
+                return
+            checksum.update(chunk)
+            file.write(chunk)
+            body_len += len(chunk)
+
+        for x, filename in enumerate(filenames):
+            for endpoint, expires, data, name in SimpleCache(filename=filename).get_rows(prefix=prefix):
+                if language and not is_language_match(name, language):
+                    continue
+                try:
+                    data = encode(decode(data))
+                except ValueError:
+                    continue  # Written by an earlier codec so it would be fetched again anyway
+                endpoint, name = endpoint.encode('utf-8'), name.encode('utf-8')
+                write(compressor.compress(
+                    SNAPSHOT_RECORD.pack(x, len(endpoint), len(name), expires, False, len(data)) + endpoint + name + data))
+                counts[filename] += 1
+        write(compressor.flush())
+
+        header = json.dumps({
+            'version': SNAPSHOT_VERSION,
+            'created': get_datetime_now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'databases': filenames,
+            'rows': counts,
+            'prefix': prefix,
+            'language': language}).encode('utf-8')
+        checksum.update(header)
+        file.write(struct.pack('>I', len(header)) + header + checksum.digest())
+        file.seek(len(SNAPSHOT_MAGIC) + 1)
+        file.write(struct.pack('>Q', body_len))
+    return counts
+
+
+def _read_header(file):
+    """ Check magic, version and checksum. Returns (header, body length) with file positioned at start of body """
+    if file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+        raise ValueError('Not a cache snapshot')
+    version = file.read(1)[0]
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f'Unsupported cache snapshot version {version}')
+    body_len = struct.unpack('>Q', file.read(8))[0]
+    body_pos = file.tell()
+    checksum = hashlib.sha256()
+    remaining = body_len
+    while remaining:
+        chunk = file.read(min(SNAPSHOT_CHUNK, remaining))
+        if not chunk:
+            raise ValueError('Cache snapshot is truncated')
+        checksum.update(chunk)
+        remaining -= len(chunk)
+    header_len = struct.unpack('>I', file.read(4))[0]
+    header = file.read(header_len)
+    checksum.update(header)
+    if file.read(32) != checksum.digest():
+        raise ValueError('Cache snapshot checksum does not match')
+    file.seek(body_pos)
+    return json.loads(header), body_len
+
+
+def _parse_records(buffer):
+    """ Returns list of records and bytes left over from a partial record at the end of buffer """
+    records, pos = [], 0
+    while len(buffer) - pos >= SNAPSHOT_RECORD.size:
+        x, id_len, name_len, expires, is_text, data_len = SNAPSHOT_RECORD.unpack_from(buffer, pos)
+        start = pos + SNAPSHOT_RECORD.size
+        end = start + id_len + name_len + data_len
+        if len(buffer) < end:
+            break
+        endpoint = buffer[start:start + id_len].decode('utf-8')
+        name = buffer[start + id_len:start + id_len + name_len].decode('utf-8')
+        data = buffer[start + id_len + name_len:end]
+        records.append((x, (endpoint, expires, data.decode('utf-8') if is_text else data, name)))
+        pos = end
+    return records, buffer[pos:]
+
+
+def _read_records(file, body_len):
+    decompressor = zlib.decompressobj()
+    buffer, remaining = b'', body_len
+    while remaining:
+        chunk = file.read(min(SNAPSHOT_CHUNK, remaining))
+        remaining -= len(chunk)
+        records, buffer = _parse_records(buffer + decompressor.decompress(chunk))
+        yield from records
+    records, buffer = _parse_records(buffer + decompressor.flush())
+    yield from records
+    if buffer:
+        raise ValueError('Cache snapshot ends with a partial record')
+
+
+def import_snapshot(path):
+    """
+    Merge rows from snapshot at path into the cache databases
+    Rows already cached keep whichever of the two expiry times is later
+    Rows which don't decode to a cache object are skipped
+    Returns dict of {filename: rows imported}
+    """
+    with open(path, 'rb') as file:
+        header, body_len = _read_header(file)
+        filenames = header['databases']
+        if any(os.path.basename(i) != i for i in filenames):
+            raise ValueError('Cache snapshot database names must be plain filenames')
+        counts = {i: 0 for i in filenames}
+        caches = {}
+        batches = {}
+
+        def merge_rows(x):
+            if x not in caches:
+                caches[x] = SimpleCache(filename=filenames[x])
+            caches[x].merge_rows(batches.pop(x))
+
+        for x, (endpoint, expires, data, name) in _read_records(file, body_len):
+            try:
+                decode(data)
+            except ValueError:
+                continue
+            batches.setdefault(x, []).append((endpoint, expires, data, name))
+            counts[filenames[x]] += 1
+            if len(batches[x]) >= SNAPSHOT_BATCH:
+                merge_rows(x)
+        for x in list(batches):
+            merge_rows(x)
+    return counts
@@ -242,14 +242,34 @@ class ItemBuilder(_ArtworkSelector):
         set_artwork(artwork.get('manual'))
         return art_dict
 
-    def get_listitem(self, i):
-        li = ListItem(parent_params=self.parent_params, **i)
+    def get_listitem_args(self, li):
+        """ Get the (tmdb_type, tmdb_id, season, episode) args for get_item from a ListItem """
         mediatype = li.infolabels.get('mediatype')
-        item = self.get_item(
+        return (
             li.get_tmdb_type(),
             li.unique_ids.get('tvshow.tmdb') if mediatype in ['season', 'episode'] else li.unique_ids.get('tmdb'),
             li.infolabels.get('season', 0) if mediatype in ['season', 'episode'] else None,
             li.infolabels.get('episode') if mediatype == 'episode' else None)
+
+    def preload_cache(self, items):
+        """ Load cached details for all items and their parents in one query before starting item threads """
+        cache_names = set()
+        for i in items:
+            if not i or i.get('next_page'):
+                continue
+            tmdb_type, tmdb_id, season, episode = self.get_listitem_args(ListItem(**i))
+            if not tmdb_type or not tmdb_id:
+                continue
+            cache_names.add(self.get_cache_name(tmdb_type, tmdb_id, season, episode))
+            if season is not None:
+                cache_names.add(self.get_cache_name(tmdb_type, tmdb_id))
+                cache_names.add(self.get_cache_name(tmdb_type, tmdb_id, season))
+        return self._cache.get_cache_many(cache_names) if cache_names else {}
+
+    def get_listitem(self, i):
+        li = ListItem(parent_params=self.parent_params, **i)
+        mediatype = li.infolabels.get('mediatype')
+        item = self.get_item(*self.get_listitem_args(li))
         if not item or 'listitem' not in item:
             return li
         li.set_details(item['listitem'])
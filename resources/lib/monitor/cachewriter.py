@@ -0,0 +1,122 @@
+import os
+import json
+import hmac
+import socketserver
+from uuid import uuid4
+from xbmc import Monitor
+from threading import Thread, Lock
+from resources.lib.addon.plugin import kodi_log
+from resources.lib.files.simplecache import SimpleCache
+from resources.lib.files.cachewriter import CACHE_WRITER_PROPERTY, decode_rows
+from xbmcgui import Window
+
+WRITER_MAX_QUEUE = 5000  # Refuse rows so that plugins write directly if the queue is this long
+WRITER_MAX_REQUEST = 64 * 1024 * 1024
+WRITER_IDLE_TIMEOUT = 60  # Plugins keep their connection open between writes so close it after this many idle seconds
+
+
+class _CacheWriterHandler(socketserver.StreamRequestHandler):
+    timeout = WRITER_IDLE_TIMEOUT
+
+    def handle(self):
+        while True:
+            try:
+                line = self.rfile.readline(WRITER_MAX_REQUEST)
+            except OSError:
+                return
+            if not line:
+                return
+            try:
+                request = json.loads(line)
+                is_queued = self.server.cache_writer.put(request)
+            except Exception as exc:
+                kodi_log(f'CacheWriterMonitor: Bad request {exc}', 1)
+                is_queued = False
+            self.wfile.write(b'1\n' if is_queued else b'0\n')
+            if not line.endswith(b'\n'):
+                return  # Request was longer than limit so rest of line can't be read as next request
+
+
+class _CacheWriterServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Default backlog of 5 drops connections when many plugin processes write at once
+
+
+class CacheWriterMonitor(Thread):
+    def __init__(self, flush_time=1):
+        """
+        Single writer for the cache databases so that plugin processes don't contend for sqlite write locks
+        Plugin processes send rows over a localhost socket and rows are written here in one transaction per database
+        Plugins write directly whenever the writer isn't advertised or doesn't answer
+        """
+        Thread.__init__(self)
+        self.exit = False
+        self.flush_time = flush_time
+        self.xbmc_monitor = Monitor()
+        self._token = uuid4().hex
+        self._queues = {}
+        self._validators = {}
+        self._queue_size = 0
+        self._lock = Lock()
+        self._caches = {}
+        self._closed = False
+
+    def put(self, request):
+        if not hmac.compare_digest(request.get('token', ''), self._token):
+            return False
+        folder, filename = request['folder'], request['filename']
+        if os.path.basename(folder) != folder or os.path.basename(filename) != filename:
+            return False  # Only accept database files in addon_data folders
+        rows = decode_rows(request.get('rows') or [])
+        validators = [tuple(i) for i in request.get('validators') or []]
+        with self._lock:
+            if self._closed:
+                return False  # Connections left open by plugins can still send rows after the last flush
+            if self._queue_size + len(rows) + len(validators) > WRITER_MAX_QUEUE:
+                return False
+            for queues, items in ((self._queues, rows), (self._validators, validators)):
+                queue = queues.setdefault((folder, filename), {})
+                for row in items:
+                    self._queue_size += 0 if row[0] in queue else 1
+                    queue[row[0]] = row  # Only the last row sent for endpoint is written
+        return True
+
+    def get_cache(self, folder, filename):
+        if (folder, filename) not in self._caches:
+            self._caches[(folder, filename)] = SimpleCache(folder=folder, filename=filename, service_write=False)
+        return self._caches[(folder, filename)]
+
+    def flush(self):
+        with self._lock:
+            queues, self._queues, self._queue_size = self._queues, {}, 0
+            validators, self._validators = self._validators, {}
+        for (folder, filename), queue in queues.items():
+            if queue:
+                self.get_cache(folder, filename)._set_db_cache_many(list(queue.values()))
+        for (folder, filename), queue in validators.items():
+            if queue:
+                self.get_cache(folder, filename)._set_validators_many(list(queue.values()))
+
+    def run(self):
+        try:
+            server = _CacheWriterServer(('127.0.0.1', 0), _CacheWriterHandler)
+        except OSError as exc:
+            kodi_log(f'CacheWriterMonitor: Unable to start {exc}', 1)
+            return
+        server.cache_writer = self
+        Thread(target=server.serve_forever, name='Cache Writer Server').start()
+        Window(10000).setProperty(CACHE_WRITER_PROPERTY, f'{server.server_address[1]} {self._token}')
+        kodi_log(f'CacheWriterMonitor: Accepting writes on port {server.server_address[1]}', 2)
+
+        while not self.xbmc_monitor.abortRequested() and not self.exit:
+            self.xbmc_monitor.waitForAbort(self.flush_time)
+            self.flush()
+
+        # Stop advertising before shutdown so that plugins go back to writing directly then write anything left
+        Window(10000).clearProperty(CACHE_WRITER_PROPERTY)
+        server.shutdown()
+        server.server_close()
+        with self._lock:
+            self._closed = True
+        self.flush()
+        del self.xbmc_monitor
@@ -1,8 +1,16 @@
 from xbmc import Monitor
+from time import time
 from resources.lib.addon.parser import try_int
 from threading import Thread
 from resources.lib.addon.timedate import convert_timestamp, get_datetime_now, get_timedelta, get_datetime_today, get_datetime_time, get_datetime_combine
-from resources.lib.addon.plugin import get_setting, executebuiltin, get_infolabel
+from resources.lib.addon.plugin import get_setting, executebuiltin, get_infolabel, get_condvisibility, kodi_log
+from resources.lib.api.kodi.rpc import get_directory
+from resources.lib.files.cache import get_prewarm_paths
+
+PREWARM_LIMIT = 10  # Most used plugin paths replayed each time the job runs
+PREWARM_BUDGET = 120  # Seconds spent replaying paths each time the job runs. Time paused for playback isn't counted
+PREWARM_DELAY = 2  # Seconds between paths so that prewarming doesn't compete with the user for requests
+PREWARM_PAUSE = 10  # Seconds between checks for playback stopping whilst paused
 
 
 class CronJobMonitor(Thread):
@@ -13,6 +21,39 @@ class CronJobMonitor(Thread):
         self.update_hour = update_hour
         self.xbmc_monitor = Monitor()
 
+    def is_stopping(self):
+        return self.exit or self.xbmc_monitor.abortRequested()
+
+    def wait_for_idle(self):
+        """ Pause whilst something is playing. Returns False if service is stopping """
+        while get_condvisibility('Player.HasMedia'):
+            if self.xbmc_monitor.waitForAbort(PREWARM_PAUSE) or self.exit:
+                return False
+        return not self.is_stopping()
+
+    def get_prewarm_queue(self, limit=PREWARM_LIMIT):
+        """ Widgets first then most used then most recently used """
+        history = get_prewarm_paths()
+        return sorted(history, key=lambda i: (history[i][2], history[i][0], history[i][1]), reverse=True)[:limit]
+
+    def prewarm(self, budget=PREWARM_BUDGET):
+        """
+        Replay most used plugin paths so that widgets find a warm cache
+        Cached objects which would expire before the next run are refreshed by the plugin
+        """
+        queue = self.get_prewarm_queue()
+        replayed, elapsed = [], 0
+        for paramstring in queue:
+            if elapsed >= budget or not self.wait_for_idle():
+                break
+            timer = time()
+            get_directory(f'plugin://plugin.video.themoviedb.helper/?{paramstring}&prewarm={self.poll_time * 2}')
+            elapsed += time() - timer
+            replayed.append(f'{time() - timer:.3f} {paramstring}')
+            self.xbmc_monitor.waitForAbort(PREWARM_DELAY)
+        if replayed:
+            kodi_log([f'CronJobMonitor: Prewarmed {len(replayed)}/{len(queue)} paths in {elapsed:.3f}s\n', '\n'.join(replayed)], 2)
+
     def run(self):
         self.xbmc_monitor.waitForAbort(600)  # Wait 10 minutes before doing updates to give boot time
         if self.xbmc_monitor.abortRequested():
@@ -31,6 +72,8 @@ class CronJobMonitor(Thread):
                     executebuiltin('RunScript(plugin.video.themoviedb.helper,library_autoupdate)')
                     executebuiltin(f'Skin.SetString(TMDbHelper.AutoUpdate.LastTime,{get_datetime_now().strftime("%Y-%m-%dT%H:%M:%S")})')
                     self.next_time += get_timedelta(hours=24)  # Set next update for tomorrow
+            if get_setting('cache_prewarm'):
+                self.prewarm()
             self.xbmc_monitor.waitForAbort(self.poll_time)
 
         del self.xbmc_monitor
@@ -4,6 +4,7 @@ from resources.lib.monitor.common import CommonMonitorFunctions, SETMAIN_ARTWORK
 from resources.lib.monitor.images import ImageFunctions
 from resources.lib.addon.plugin import convert_media_type, convert_type, get_setting, get_infolabel, get_condvisibility
 from resources.lib.addon.decorators import try_except_log
+from resources.lib.api.scheduler import request_priority, PRIORITY_BACKGROUND
 from threading import Thread
 
 
@@ -148,12 +149,13 @@ class ListItemMonitor(CommonMonitorFunctions):
     def process_ratings(self, details, tmdb_type):
         if tmdb_type not in ['movie', 'tv']:
             return
-        details = self.get_omdb_ratings(details)
-        if tmdb_type == 'movie':
-            details = self.get_imdb_top250_rank(details)
-        details = self.get_trakt_ratings(
-            details, 'movie' if tmdb_type == 'movie' else 'show',
-            season=self.season, episode=self.episode)
+        with request_priority(PRIORITY_BACKGROUND):  # Ratings can wait until user stops scrolling
+            details = self.get_omdb_ratings(details)
+            if tmdb_type == 'movie':
+                details = self.get_imdb_top250_rank(details)
+            details = self.get_trakt_ratings(
+                details, 'movie' if tmdb_type == 'movie' else 'show',
+                season=self.season, episode=self.episode)
         if not self.is_same_item():
             return
         self.set_iter_properties(details.get('infoproperties', {}), SETPROP_RATINGS)
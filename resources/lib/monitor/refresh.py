@@ -0,0 +1,78 @@
+from xbmc import Monitor
+from xbmcgui import Window
+from threading import Thread
+from resources.lib.addon.plugin import kodi_log
+from resources.lib.files.cache import BasicCache, CACHE_REFRESH_PROPERTY
+from resources.lib.files.simplecache import get_memory_stats
+from resources.lib.api.scheduler import get_scheduler, PRIORITY_BACKGROUND
+from resources.lib.api.tmdb.api import TMDb
+from resources.lib.api.trakt.api import TraktAPI
+from resources.lib.api.fanarttv.api import FanartTV
+from resources.lib.api.omdb.api import OMDb
+
+
+REFRESH_APIS = {
+    'TMDb': lambda: TMDb(),
+    'TraktAPI': lambda: TraktAPI(),
+    'FanartTV': lambda: FanartTV(),
+    'OMDb': lambda: OMDb()}
+CLEANUP_FILES = ['TMDb.db', 'TraktAPI.db', 'FanartTV.db', 'OMDb.db', 'ItemBuilder.db', 'KodiLibrary.db']
+CLEANUP_BUDGET = 2  # Seconds per database file for each slice of cleanup in the service
+
+
+class CacheRefreshMonitor(Thread):
+    def __init__(self, poll_time=60, batch_size=20):
+        """
+        Drains the stale-while-revalidate refresh queues which plugin processes leave in each API cache
+        Also runs cache cleanup in time-limited slices
+        """
+        Thread.__init__(self)
+        self.exit = False
+        self.poll_time = poll_time
+        self.batch_size = batch_size
+        self.xbmc_monitor = Monitor()
+        self._apis = {}
+        self._caches = {}
+
+    def get_api(self, api_name):
+        if api_name not in self._apis:
+            self._apis[api_name] = REFRESH_APIS[api_name]()
+        return self._apis[api_name]
+
+    def refresh(self, api_name):
+        queue = self.get_cache(f'{api_name}.db').pop_refresh_queue(self.batch_size)
+        if not queue:
+            return 0
+        api = self.get_api(api_name)
+        with get_scheduler().request_priority(PRIORITY_BACKGROUND):  # Refreshes wait for requests the user is waiting on
+            for i in queue:
+                if self.exit or self.xbmc_monitor.abortRequested():
+                    break
+                api.get_refresh_request(**i)
+        kodi_log(f'CacheRefreshMonitor: Refreshed {len(queue)} stale {api_name} items', 2)
+        return len(queue)
+
+    def get_cache(self, filename):
+        if filename not in self._caches:
+            self._caches[filename] = BasicCache(filename=filename)
+        return self._caches[filename]
+
+    def cleanup(self):
+        """ Run a time-limited slice of any due cleanup so that plugin processes rarely need to """
+        for i in CLEANUP_FILES:
+            if self.exit or self.xbmc_monitor.abortRequested():
+                return
+            self.get_cache(i).ret_cache().check_cleanup(time_budget=CLEANUP_BUDGET, full_vacuum=True)
+
+    def run(self):
+        Window(10000).setProperty(CACHE_REFRESH_PROPERTY, 'True')  # Plugin processes queue stale objects for us instead of refreshing them
+        try:
+            while not self.xbmc_monitor.abortRequested() and not self.exit:
+                self.cleanup()
+                # Keep draining without waiting whilst there are full batches in the queue
+                if sum(self.refresh(i) for i in REFRESH_APIS) < self.batch_size:
+                    self.xbmc_monitor.waitForAbort(self.poll_time)
+        finally:
+            Window(10000).clearProperty(CACHE_REFRESH_PROPERTY)
+        kodi_log(f'CacheRefreshMonitor: Service memory cache {get_memory_stats()}', 2)
+        del self.xbmc_monitor
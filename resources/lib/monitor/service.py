@@ -1,9 +1,13 @@
 from xbmc import Monitor
-from resources.lib.addon.plugin import get_setting, get_condvisibility
+from resources.lib.addon.plugin import get_setting, get_condvisibility, kodi_log
 from resources.lib.addon.window import get_property, wait_for_property
 from resources.lib.monitor.cronjob import CronJobMonitor
 from resources.lib.monitor.listitem import ListItemMonitor
 from resources.lib.monitor.player import PlayerMonitor
+from resources.lib.monitor.refresh import CacheRefreshMonitor
+from resources.lib.monitor.cachewriter import CacheWriterMonitor
+from resources.lib.api.scheduler import get_scheduler_stats
+from resources.lib.api.request import close_sessions
 from threading import Thread
 
 
@@ -20,6 +24,10 @@ class ServiceMonitor(object):
         self.listitem = None
         self.cron_job = CronJobMonitor(get_setting('library_autoupdate_hour', 'int'))
         self.cron_job.setName('Cron Thread')
+        self.cache_refresh = CacheRefreshMonitor()
+        self.cache_refresh.setName('Cache Refresh Thread')
+        self.cache_writer = CacheWriterMonitor()
+        self.cache_writer.setName('Cache Writer Thread')
         self.player_monitor = None
         self.listitem_monitor = ListItemMonitor()
         self.xbmc_monitor = Monitor()
@@ -58,6 +66,8 @@ class ServiceMonitor(object):
             self.listitem_monitor.clear_properties()
             get_property('ServiceStarted', clear_property=True)
             get_property('ServiceStop', clear_property=True)
+        kodi_log(f'ServiceMonitor: Request queue waits {get_scheduler_stats()}', 2)
+        close_sessions()
         del self.player_monitor
         del self.listitem_monitor
         del self.xbmc_monitor
@@ -66,6 +76,8 @@ class ServiceMonitor(object):
         while not self.xbmc_monitor.abortRequested() and not self.exit:
             if get_property('ServiceStop'):
                 self.cron_job.exit = True
+                self.cache_refresh.exit = True
+                self.cache_writer.exit = True
                 self.exit = True
 
             # If we're in fullscreen video then we should update the playermonitor time
@@ -117,6 +129,8 @@ class ServiceMonitor(object):
 
     def run(self):
         get_property('ServiceStarted', 'True')
+        self.cache_writer.start()
         self.cron_job.start()
+        self.cache_refresh.start()
         self.player_monitor = PlayerMonitor()
         self.poller()
@@ -8,9 +8,12 @@ from xbmcgui import Dialog
 from resources.lib.addon.window import get_property
 from resources.lib.addon.plugin import reconfigure_legacy_params, kodi_log, format_folderpath, convert_type, get_localized, get_setting, set_setting, executebuiltin, get_infolabel
 from resources.lib.addon.decorators import busy_dialog
-from resources.lib.addon.parser import encode_url, parse_paramstring
+from resources.lib.addon.parser import encode_url, parse_paramstring, try_int, try_float
+from resources.lib.addon.timedate import get_datetime_now
 from resources.lib.files.downloader import Downloader
-from resources.lib.files.utils import dumps_to_file, validify_filename, read_file
+from resources.lib.files.utils import dumps_to_file, validify_filename, read_file, get_file_path, get_write_path
+from resources.lib.files.snapshot import export_snapshot, import_snapshot, SNAPSHOT_FILES
+from resources.lib.files.simplecache import STATS_PREFIX_DEPTH
 from resources.lib.items.basedir import get_basedir_details
 from resources.lib.items.builder import ItemBuilder
 from resources.lib.api.fanarttv.api import FanartTV
@@ -18,6 +21,8 @@ from resources.lib.api.tmdb.api import TMDb
 from resources.lib.api.trakt.api import TraktAPI, get_sort_methods
 from resources.lib.api.omdb.api import OMDb
 from resources.lib.api.kodi.rpc import get_jsonrpc
+from resources.lib.api.fixtures import get_replay_url, FIXTURES_RECORD_PROPERTY, FIXTURES_REPLAY_PROPERTY
+from resources.lib.api.metrics import get_metrics_report
 from resources.lib.update.library import add_to_library
 from resources.lib.update.userlist import monitor_userlist, library_autoupdate
 from resources.lib.window.manager import WindowManager
@@ -76,13 +81,17 @@ def container_refresh():
     executebuiltin('UpdateLibrary(video,/fake/path/to/force/refresh/on/home)')
 
 
-def delete_cache(delete_cache, **kwargs):
-    d = {
-        'TMDb': lambda: TMDb(),
-        'Trakt': lambda: TraktAPI(),
-        'FanartTV': lambda: FanartTV(),
-        'OMDb': lambda: OMDb(),
-        'Item Details': lambda: ItemBuilder()}
+CACHE_APIS = {
+    'TMDb': lambda: TMDb(),
+    'Trakt': lambda: TraktAPI(),
+    'FanartTV': lambda: FanartTV(),
+    'OMDb': lambda: OMDb(),
+    'Item Details': lambda: ItemBuilder()}
+
+
+def delete_cache(delete_cache, prefix=None, days=None, **kwargs):
+    """ Delete whole cache or only objects with names starting with prefix and/or not accessed for days """
+    d = CACHE_APIS
     if delete_cache == 'select':
         m = [i for i in d]
         x = Dialog().contextmenu([get_localized(32387).format(i) for i in m])
@@ -94,11 +103,115 @@ def delete_cache(delete_cache, **kwargs):
         return
     if not Dialog().yesno(get_localized(32387).format(delete_cache), get_localized(32388).format(delete_cache)):
         return
+    if prefix or days:
+        with busy_dialog():
+            count = z()._cache.purge_cache(prefix=prefix, days=try_float(days) if days else None)
+        Dialog().ok(get_localized(32387).format(delete_cache), get_localized(32410).format(count or 0))
+        return
     with busy_dialog():
         z()._cache.ret_cache()._do_delete()
     Dialog().ok(get_localized(32387).format(delete_cache), get_localized(32389))
 
 
+def cache_report(cache_report=None, depth=None, **kwargs):
+    """ Write statistics for caches grouped by cache name prefix to addon_data/cache_report as JSON """
+    names = [cache_report] if cache_report in CACHE_APIS else [i for i in CACHE_APIS]
+    with busy_dialog():
+        report = {
+            'created': get_datetime_now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'caches': {i: CACHE_APIS[i]()._cache.get_cache_report(depth=try_int(depth) or STATS_PREFIX_DEPTH) or {} for i in names}}
+        filename = validify_filename(f'cache_report_{report["created"]}.json')
+        dumps_to_file(report, 'cache_report', filename)
+
+    summary = []
+    for name, prefixes in report['caches'].items():
+        summary.append(f'[B]{name}[/B]')
+        for k, v in sorted(prefixes.items(), key=lambda x: x[1]['bytes'], reverse=True):
+            hit_rate = f'{v["hit_rate"]:.0%}' if v['hit_rate'] is not None else '-'
+            summary.append(f'{k}: {v["rows"]} rows | {v["bytes"] // 1024} KB | {v["expires"]["expired"]} expired | {hit_rate} hits')
+        summary.append('')
+    msg = f'{xbmcvfs.translatePath("special://profile/addon_data/")}\nplugin.video.themoviedb.helper/cache_report\n{filename}'
+    Dialog().textviewer(get_localized(32409), '\n'.join([msg, ''] + summary))
+
+
+def api_report(api_report=None, hours=None, **kwargs):
+    """ Write latency, transfer and cache statistics per API and endpoint to addon_data/api_report as JSON """
+    with busy_dialog():
+        apis = get_metrics_report(hours=try_int(hours) or 24)
+        if api_report in apis:
+            apis = {api_report: apis[api_report]}
+        report = {
+            'created': get_datetime_now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'hours': try_int(hours) or 24,
+            'apis': apis}
+        filename = validify_filename(f'api_report_{report["created"]}.json')
+        dumps_to_file(report, 'api_report', filename)
+
+    def get_line(k, v):
+        hit_rate = f'{v["cache_hit_rate"]:.0%}' if v['cache_hit_rate'] is not None else '-'
+        latency = f'{v["latency_avg"]:.3f}s avg | {v["latency_p95"]}s p95' if v['requests'] else '-'
+        return f'{k}: {v["requests"]} requests | {v["latency_total"]:.1f}s total | {latency} | {v["wire_bytes"] // 1024} KB | {v["retries"]} retries | {hit_rate} hits'
+
+    # Sort by total time spent waiting so that the slowest API and endpoints are first
+    summary = []
+    for name, api in sorted(apis.items(), key=lambda x: x[1]['total']['latency_total'], reverse=True):
+        summary.append(f'[B]{get_line(name, api["total"])}[/B]')
+        for k, v in sorted(api['templates'].items(), key=lambda x: x[1]['latency_total'], reverse=True):
+            summary.append(get_line(k, v))
+        summary.append('')
+    msg = f'{xbmcvfs.translatePath("special://profile/addon_data/")}\nplugin.video.themoviedb.helper/api_report\n{filename}'
+    Dialog().textviewer(get_localized(32417), '\n'.join([msg, ''] + summary))
+
+
+def export_cache(export_cache=None, prefix=None, language=None, **kwargs):
+    """ Write snapshot of cached objects which haven't expired to addon_data/cache_snapshot for importing elsewhere """
+    filenames = [export_cache] if export_cache in SNAPSHOT_FILES else SNAPSHOT_FILES
+    with busy_dialog():
+        filename = validify_filename(f'cache_snapshot_{get_datetime_now().strftime("%Y-%m-%dT%H%M%S")}.tmdbcache')
+        path = get_file_path('cache_snapshot', filename)
+        counts = export_snapshot(path, filenames=filenames, prefix=prefix, language=language)
+    Dialog().ok(get_localized(32411), '\n'.join([path] + [f'{k}: {v}' for k, v in counts.items()]))
+
+
+def import_cache(import_cache=None, **kwargs):
+    """ Merge snapshot made by export_cache into cache. Browse for snapshot if path isn't given """
+    path = import_cache if isinstance(import_cache, str) else Dialog().browse(1, get_localized(32412), 'files', '.tmdbcache')
+    if not path:
+        return
+    try:
+        with busy_dialog():
+            counts = import_snapshot(xbmcvfs.translatePath(path))
+    except (OSError, ValueError, KeyError, IndexError) as exc:
+        kodi_log(f'Cache snapshot import failed: {path}\n{exc}', 1)
+        Dialog().ok(get_localized(32412), f'{path}\n{exc}')
+        return
+    Dialog().ok(get_localized(32412), '\n'.join([path] + [f'{k}: {v}' for k, v in counts.items()]))
+
+
+def record_fixtures(record_fixtures=None, **kwargs):
+    """ Toggle recording of API responses to addon_data/fixtures for replaying offline. Pass record_fixtures=off to stop """
+    if get_property(FIXTURES_RECORD_PROPERTY) or record_fixtures == 'off':
+        get_property(FIXTURES_RECORD_PROPERTY, clear_property=True)
+        return Dialog().notification(get_localized(32415), get_localized(1223))
+    path = get_write_path('fixtures')
+    get_property(FIXTURES_RECORD_PROPERTY, path)
+    Dialog().ok(get_localized(32415), path)
+
+
+def replay_fixtures(replay_fixtures=None, **kwargs):
+    """ Point API requests at replay server url e.g. replay_fixtures=http://127.0.0.1:8765 or stop with replay_fixtures=off """
+    if replay_fixtures == 'off' or (not isinstance(replay_fixtures, str) and get_property(FIXTURES_REPLAY_PROPERTY)):
+        get_property(FIXTURES_REPLAY_PROPERTY, clear_property=True)
+        return Dialog().notification(get_localized(32416), get_localized(1223))
+    url = replay_fixtures if isinstance(replay_fixtures, str) else Dialog().input(get_localized(32416), 'http://127.0.0.1:8765')
+    if not url:
+        return
+    if not get_replay_url(url):  # Requests are only redirected to a server on this device
+        return Dialog().ok(get_localized(32416), f'{url}\n{get_localized(32418)}')
+    get_property(FIXTURES_REPLAY_PROPERTY, get_replay_url(url))
+    Dialog().notification(get_localized(32416), url)
+
+
 @map_kwargs({'play': 'tmdb_type'})
 @get_tmdb_id
 def play_external(**kwargs):
@@ -394,6 +507,12 @@ class Script(object):
         'log_jsonrpc': lambda **kwargs: log_jsonrpc(**kwargs),
         'log_request': lambda **kwargs: log_request(**kwargs),
         'delete_cache': lambda **kwargs: delete_cache(**kwargs),
+        'cache_report': lambda **kwargs: cache_report(**kwargs),
+        'api_report': lambda **kwargs: api_report(**kwargs),
+        'export_cache': lambda **kwargs: export_cache(**kwargs),
+        'import_cache': lambda **kwargs: import_cache(**kwargs),
+        'record_fixtures': lambda **kwargs: record_fixtures(**kwargs),
+        'replay_fixtures': lambda **kwargs: replay_fixtures(**kwargs),
         'play': lambda **kwargs: play_external(**kwargs),
         'play_using': lambda **kwargs: play_using(**kwargs),
         'add_path': lambda **kwargs: WindowManager(**kwargs).router(),
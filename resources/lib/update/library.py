@@ -10,6 +10,8 @@ from resources.lib.update.update import BASEDIR_MOVIE, BASEDIR_TV, STRM_MOVIE, S
 from resources.lib.update.cacher import _TVShowCache
 from resources.lib.api.tmdb.api import TMDb
 
+PREFETCH_CHUNK = 20  # Shows fetched concurrently between updates of the progress dialog
+
 
 def add_to_library(info, busy_spinner=True, library_adder=None, finished=True, **kwargs):
     if not info:
@@ -109,11 +111,23 @@ class LibraryAdder():
     def update_tvshows(self, force=False, **kwargs):
         nfos = self.get_tv_folder_nfos()
 
+        # Get details of shows due a check concurrently in chunks so that progress is shown whilst waiting
+        caches = {i['tmdb_id']: _TVShowCache(i['tmdb_id'], force) for i in nfos}
+        tmdb_ids = [k for k, v in caches.items() if force or not v.get_next_check()]
+        tmdb_ids_total = len(tmdb_ids)
+        tmdb_api = TMDb()
+        details = {}
+        for x in range(0, tmdb_ids_total, PREFETCH_CHUNK):
+            self._update(x, tmdb_ids_total, message=f'{get_localized(32375)} {x}/{tmdb_ids_total}...')
+            chunk = tmdb_ids[x:x + PREFETCH_CHUNK]
+            details.update(zip(chunk, tmdb_api.get_request_many([
+                (('tv', i), {'append_to_response': 'external_ids'}) for i in chunk], func=tmdb_api.get_request_sc)))
+
         # Update each show in folder
         nfos_total = len(nfos)
         for x, i in enumerate(nfos):
             self._update(x, nfos_total, message=f'{get_localized(32167)} {i["folder"]}...')
-            self.add_tvshow(tmdb_id=i['tmdb_id'], force=force)
+            self.add_tvshow(tmdb_id=i['tmdb_id'], force=force, cache=caches[i['tmdb_id']], details=details.get(i['tmdb_id']))
 
         # Update last updated stamp
         set_setting('last_autoupdate', f'Last updated {get_current_date_time()}', 'str')
@@ -182,8 +196,8 @@ class LibraryAdder():
         # Return our playlist rule
         return ('filename', file.replace('\\', '/').split('/')[-1])
 
-    def add_tvshow(self, tmdb_id=None, force=False, **kwargs):
-        self.tv = _TVShow(tmdb_id, force)
+    def add_tvshow(self, tmdb_id=None, force=False, cache=None, details=None, **kwargs):
+        self.tv = _TVShow(tmdb_id, force, cache=cache, details=details)
 
         # Return playlist rule if we don't need to check show this time
         if self._log._add('tv', tmdb_id, self.tv._cache.get_next_check()):
@@ -259,14 +273,14 @@ class LibraryAdder():
 
 
 class _TVShow():
-    def __init__(self, tmdb_id, force=False):
-        self._cache = _TVShowCache(tmdb_id, force)
+    def __init__(self, tmdb_id, force=False, cache=None, details=None):
+        self._cache = cache or _TVShowCache(tmdb_id, force)
         self.tmdb_id = tmdb_id
-        self.details = None
+        self.details = details  # Already fetched by update_tvshows
         self.name = None
 
     def get_details(self):
-        self.details = TMDb().get_request_sc('tv', self.tmdb_id, append_to_response='external_ids')
+        self.details = self.details or TMDb().get_request_sc('tv', self.tmdb_id, append_to_response='external_ids')
         if not self.details:
             return
         self.tvdb_id = self.details.get('external_ids', {}).get('tvdb_id')
@@ -0,0 +1,47 @@
+""" Sequential requests against get_request_many for the seasons of a show (user-023)
+Requests go to a local replay server with a fixed latency per response using the connection limit of the TMDb host
+"""
+import common  # noqa: F401 Sets up paths before resources imports
+import json
+from timeit import default_timer as timer
+from resources.lib.addon.window import get_property
+from resources.lib.api.fixtures import ReplayServer, FIXTURES_REPLAY_PROPERTY
+from resources.lib.api.request import RequestAPI
+from resources.lib.addon.decorators import get_worker_pool_stats
+
+API_NAME = 'TMDb'
+REQUEST_COUNTS = [10, 50]
+LATENCY = 0.05  # Seconds per API response
+
+
+def main():
+    fixtures = {
+        (API_NAME, 'GET', f'/{name}{n}/tv/1/season/{x}'): {
+            'status': 200, 'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'season_number': x, 'episodes': [{'id': i} for i in range(20)]})}
+        for name in ('sequential', 'batch') for n in REQUEST_COUNTS for x in range(n)}
+    server = ReplayServer(fixtures, latency=LATENCY)
+    get_property(FIXTURES_REPLAY_PROPERTY, set_property=server.start())
+    api = RequestAPI(req_api_url='https://api.themoviedb.org/3', req_api_name=API_NAME)
+
+    print(f'{"requests":>8} | {"sequential":>10} | {"batch":>8} | {"batch cached":>12}')
+    for n in REQUEST_COUNTS:
+        timer_a = timer()
+        sequential = [api.get_request_sc(f'sequential{n}', 'tv', 1, 'season', x) for x in range(n)]
+        sequential_time = timer() - timer_a
+        specs = [((f'batch{n}', 'tv', 1, 'season', x), {}) for x in range(n)]
+        timer_a = timer()
+        batch = api.get_request_many(specs, func=api.get_request_sc)
+        batch_time = timer() - timer_a
+        timer_a = timer()
+        cached = api.get_request_many(specs, func=api.get_request_sc)
+        cached_time = timer() - timer_a
+        assert [i['season_number'] for i in batch] == [i['season_number'] for i in sequential] == list(range(n))
+        assert cached == batch
+        print(f'{n:8} | {sequential_time:9.3f}s | {batch_time:7.3f}s | {cached_time:11.3f}s')
+    print(f'worker pool: {get_worker_pool_stats()}')
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+""" Latency of SimpleCache.set from many plugin processes writing at once (user-016)
+Compares every process writing directly with handing off rows to the service single writer
+"""
+from common import percentile
+import os
+import multiprocessing
+from time import sleep
+from timeit import default_timer as timer
+from xbmcgui import Window
+from resources.lib.files.cachewriter import CACHE_WRITER_PROPERTY
+from resources.lib.files.simplecache import SimpleCache
+
+PROCESSES = 16
+ROWS = 200  # Per process
+
+
+def write_rows(process, writer_property):
+    if writer_property:
+        Window(10000).setProperty(CACHE_WRITER_PROPERTY, writer_property)
+    cache = SimpleCache(filename='bench_writer.db')
+    latency = []
+    for x in range(ROWS):
+        timer_a = timer()
+        cache.set(f'key.{process}.{x}', {'data': os.urandom(1000).hex()})
+        latency.append(timer() - timer_a)
+    return latency
+
+
+def run(writer_property=None):
+    with multiprocessing.get_context('spawn').Pool(PROCESSES) as pool:
+        latency = [i for result in pool.starmap(write_rows, [(x, writer_property) for x in range(PROCESSES)]) for i in result]
+    return f'p50 {percentile(latency, 0.5) * 1000:6.2f}ms | p99 {percentile(latency, 0.99) * 1000:6.2f}ms | max {max(latency) * 1000:7.1f}ms'
+
+
+def main():
+    from resources.lib.monitor.cachewriter import CacheWriterMonitor
+    print(f'direct  | {run()}')
+    writer = CacheWriterMonitor()
+    writer.start()
+    while not Window(10000).getProperty(CACHE_WRITER_PROPERTY):
+        sleep(0.05)
+    print(f'service | {run(Window(10000).getProperty(CACHE_WRITER_PROPERTY))}')
+    writer.exit = True
+    writer.join()
+
+
+if __name__ == '__main__':
+    main()
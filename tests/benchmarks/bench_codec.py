@@ -0,0 +1,67 @@
+""" Stored size and decode time of cached objects for each codec (user-011)
+Compares the JSON text rows written before the codec layer with each versioned blob codec
+Payloads are JSON responses recorded with the record_fixtures script action if a fixtures folder is given:
+    python3 tests/benchmarks/bench_codec.py /path/to/addon_data/fixtures
+Otherwise the payload is a synthetic TMDb tv details response with credits and images appended
+"""
+import common  # noqa: F401 Sets up paths before resources imports
+import sys
+import json
+from timeit import default_timer as timer
+from resources.lib.api.fixtures import load_fixtures
+from resources.lib.files import codec
+from resources.lib.files.utils import json_loads
+
+REPEATS = 50
+SEASONS = 10
+CAST = 150
+IMAGES = 200
+
+
+def get_payload():
+    person = {'id': 0, 'name': 'Firstname Lastname', 'character': 'Character Name', 'profile_path': '/abcdefghijklmnop.jpg', 'order': 0}
+    image = {'file_path': '/abcdefghijklmnopqrstuvwxyz.jpg', 'width': 1920, 'height': 1080, 'iso_639_1': 'en', 'vote_average': 5.3}
+    return {
+        'id': 1399, 'name': 'Game of Thrones', 'overview': 'Seven noble families fight for control. ' * 10,
+        'genres': [{'id': 10765, 'name': 'Sci-Fi & Fantasy'}, {'id': 18, 'name': 'Drama'}],
+        'seasons': [{'id': 3624 + x, 'season_number': x, 'episode_count': 10, 'overview': 'Season overview. ' * 20} for x in range(SEASONS)],
+        'credits': {'cast': [dict(person, id=x, order=x) for x in range(CAST)], 'crew': [dict(person, id=x) for x in range(CAST)]},
+        'images': {k: [dict(image, file_path=f'/{k}{x:020d}.jpg', vote_average=x % 10) for x in range(IMAGES)] for k in ('posters', 'backdrops')},
+        'external_ids': {'imdb_id': 'tt0944947', 'tvdb_id': 121361}}
+
+
+def get_fixture_payloads(folder):
+    """ Bodies of successful JSON responses in fixtures folder """
+    return [
+        json.loads(i['body']) for i in load_fixtures(folder).values()
+        if i['status'] == 200 and 'json' in i['headers'].get('Content-Type', '') and i['body']]
+
+
+def time_decode(func, data, repeats=REPEATS):
+    timer_a = timer()
+    for _ in range(repeats):
+        func(data)
+    return (timer() - timer_a) / repeats
+
+
+def main(folder=None):
+    payloads = get_fixture_payloads(folder) if folder else [get_payload()]
+    repeats = max(REPEATS // len(payloads), 1)
+    codecs = [('json text', lambda obj: json.dumps(obj, separators=(',', ':')), json_loads)]
+    codecs += [(name, lambda obj, i=i: codec.encode(obj, codec=i), codec.decode) for name, i in (
+        ('marshal', codec.CODEC_MARSHAL), ('zlib', codec.CODEC_ZLIB), ('lzma', codec.CODEC_LZMA))]
+
+    print(f'{len(payloads)} payloads from {folder or "synthetic tv details"}')
+    print(f'{"codec":<10} | {"size":>10} | {"decode":>9} per payload')
+    for name, encode, decode in codecs:
+        size, seconds = 0, 0
+        for payload in payloads:
+            data = encode(payload)
+            assert decode(data) == codec.int_keys(payload)
+            size += len(data)
+            seconds += time_decode(decode, data, repeats)
+        print(f'{name:<10} | {size / 1024:8.1f}KB | {seconds / len(payloads) * 1000:7.3f}ms')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
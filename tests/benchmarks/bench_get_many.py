@@ -0,0 +1,32 @@
+""" Database queries and time to load cached details for every item on a page (user-007)
+Compares one SimpleCache.get per item as ItemBuilder threads did before with a single get_many preload
+"""
+from common import clear_memory_tiers, count_queries
+from time import time
+from resources.lib.files.simplecache import SimpleCache, data_encode
+from resources.lib.files.cache import get_cache_key
+
+PAGE_SIZES = [20, 200]
+PAYLOAD = {'listitem': {'label': 'x' * 200, 'infolabels': {'plot': 'y' * 1000}}, 'artwork': {'tmdb': {'poster': '/p.jpg'}}}
+
+
+def main():
+    cache = SimpleCache(filename='ItemBuilder.db')
+    expires = int(time()) + 3600
+    names = [f'en-US.movie.{x}.None.None' for x in range(max(PAGE_SIZES))]
+    cache._set_db_cache_many([(get_cache_key(i), expires, data_encode(PAYLOAD), i) for i in names])
+
+    print(f'{"items":>5} | {"per item get":>22} | {"get_many":>22}')
+    for size in PAGE_SIZES:
+        keys = [get_cache_key(i) for i in names[:size]]
+        clear_memory_tiers(cache)
+        results, single_time, single_queries = count_queries(cache, lambda: [cache.get(i) for i in keys])
+        assert all(results)
+        clear_memory_tiers(cache)
+        results, many_time, many_queries = count_queries(cache, cache.get_many, keys)
+        assert len(results) == size
+        print(f'{size:5} | {single_queries:4} SELECTs {single_time * 1000:7.2f}ms | {many_queries:4} SELECTs {many_time * 1000:7.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
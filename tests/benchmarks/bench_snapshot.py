@@ -0,0 +1,62 @@
+""" First browse latency on a fresh profile with and without importing a snapshot (user-018)
+A source profile caches details for every item from a local replay server with a fixed latency then exports a snapshot
+Each fresh profile then requests the same items as the first visit to a list would
+"""
+from common import clear_memory_tiers, percentile
+import os
+import json
+import tempfile
+from timeit import default_timer as timer
+from resources.lib.api.fixtures import ReplayServer
+from resources.lib.api.request import RequestAPI
+from resources.lib.files.snapshot import export_snapshot, import_snapshot
+
+API_NAME = 'TMDb'
+ITEMS = 50
+LATENCY = 0.1  # Seconds per API response
+
+
+def use_profile(api):
+    """ Switch to a new empty Kodi profile. Returns api with its cache opened in that profile """
+    os.environ['TMDBHELPER_TEST_PROFILE'] = tempfile.mkdtemp(prefix='tmdbhelper_benchmark_')
+    clear_memory_tiers(api._cache.ret_cache())
+    return RequestAPI(req_api_url=api.req_api_url, req_api_name=API_NAME)
+
+
+def browse(api):
+    latency = []
+    for x in range(ITEMS):
+        timer_a = timer()
+        assert api.get_request_lc('movie', x, append_to_response='credits')
+        latency.append(timer() - timer_a)
+    return latency
+
+
+def main():
+    fixtures = {
+        (API_NAME, 'GET', f'/movie/{x}?append_to_response=credits'): {
+            'status': 200, 'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'id': x, 'title': f'Movie {x}', 'credits': {'cast': [{'id': i, 'name': f'Person {i}'} for i in range(50)]}})}
+        for x in range(ITEMS)}
+    server = ReplayServer(fixtures, latency=LATENCY)
+    api = RequestAPI(req_api_url=f'{server.start()}/{API_NAME}', req_api_name=API_NAME)
+
+    api = use_profile(api)
+    browse(api)
+    api._cache.ret_cache().flush()
+    snapshot = os.path.join(os.environ['TMDBHELPER_TEST_PROFILE'], 'snapshot.bin')
+    export_snapshot(snapshot, filenames=[f'{API_NAME}.db'])
+
+    print(f'{"profile":<9} | {"requests":>8} | {"first browse":>12} | {"p50 item":>9}')
+    for name, is_seeded in (('cold', False), ('seeded', True)):
+        api = use_profile(api)
+        if is_seeded:
+            import_snapshot(snapshot)
+        requests = server.stats['replayed']
+        latency = browse(api)
+        print(f'{name:<9} | {server.stats["replayed"] - requests:8} | {sum(latency) * 1000:10.1f}ms | {percentile(latency, 0.5) * 1000:7.2f}ms')
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+""" Wall time and peak memory of ParallelThread against a thread per item (user-021)
+Each run is in a new process so that peak RSS is only from that run
+Items sleep as a request would then do a little mapping work
+"""
+import common  # noqa: F401 Sets up paths before resources imports
+import resource
+import multiprocessing
+from threading import Thread
+from time import sleep
+from timeit import default_timer as timer
+from resources.lib.addon.decorators import ParallelThread
+
+ITEM_COUNTS = [50, 500, 5000]
+ITEM_TIME = 0.02  # Seconds each item waits as if for a response
+
+
+class ThreadPerItem():
+    """ ParallelThread as it was before the shared pool """
+    def __init__(self, items, func, *args, **kwargs):
+        self.queue = [None] * len(items)
+        self._pool = [Thread(target=self._run, args=[x, i, func, *args], kwargs=kwargs) for x, i in enumerate(items)]
+        for i in self._pool:
+            i.start()
+
+    def _run(self, x, i, func, *args, **kwargs):
+        self.queue[x] = func(i, *args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        for i in self._pool:
+            i.join()
+
+
+def work(i):
+    sleep(ITEM_TIME)
+    return sum(range(2000)) + i
+
+
+def run(is_pool, count):
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timer_a = timer()
+    with (ParallelThread if is_pool else ThreadPerItem)(list(range(count)), work) as pt:
+        pass
+    wall = timer() - timer_a
+    assert pt.queue == [sum(range(2000)) + i for i in range(count)]
+    return wall, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) / 1024
+
+
+def main():
+    context = multiprocessing.get_context('spawn')
+    print(f'{"items":>5} | {"thread per item":>24} | {"worker pool":>24}')
+    for count in ITEM_COUNTS:
+        results = []
+        for is_pool in (False, True):
+            with context.Pool(1) as pool:
+                results.append(pool.apply(run, (is_pool, count)))
+        print(f'{count:5} | ' + ' | '.join(f'{wall:7.3f}s +{rss:6.1f}MB peak RSS' for wall, rss in results))
+
+
+if __name__ == '__main__':
+    main()
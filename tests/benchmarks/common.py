@@ -0,0 +1,40 @@
+""" Shared setup for benchmark scripts which run outside Kodi using the stand-ins in tests/stubs
+Run from the repository root e.g. python3 tests/benchmarks/bench_get_many.py
+Each run uses a new temporary Kodi profile unless TMDBHELPER_TEST_PROFILE is set
+"""
+import os
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+TESTS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(TESTS_PATH))
+sys.path.insert(0, os.path.join(TESTS_PATH, 'stubs'))
+os.environ['PYTHONPATH'] = os.pathsep.join([os.path.join(TESTS_PATH, 'stubs'), os.path.dirname(TESTS_PATH)])
+os.environ.setdefault('TMDBHELPER_TEST_PROFILE', tempfile.mkdtemp(prefix='tmdbhelper_benchmark_'))
+
+
+def clear_memory_tiers(cache):
+    """ Forget objects of cache held by the in-process memory tier and window properties as a new plugin process would """
+    import xbmcgui
+    from resources.lib.files import simplecache
+    xbmcgui._properties.clear()
+    simplecache._memory_cache.clear(cache._sc_name)
+
+
+def count_queries(cache, func, *args, **kwargs):
+    """ Returns (result, seconds, number of statements run on the connection of the current thread) """
+    statements = []
+    connection = cache._get_database()
+    connection.set_trace_callback(statements.append)
+    try:
+        timer_a = timer()
+        result = func(*args, **kwargs)
+        return result, timer() - timer_a, len([i for i in statements if i.lstrip().upper().startswith('SELECT')])
+    finally:
+        connection.set_trace_callback(None)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent), len(values) - 1)] if values else 0
@@ -0,0 +1,32 @@
+""" Tests run outside Kodi so the Kodi modules are replaced by the minimal stand-ins in tests/stubs
+Each test gets its own Kodi profile folder so that cache databases don't leak between tests
+Child processes started by tests inherit sys.path and the profile folder through the environment
+"""
+import os
+import sys
+import pytest
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_PATH))
+sys.path.insert(0, os.path.join(TESTS_PATH, 'stubs'))
+os.environ['PYTHONPATH'] = os.pathsep.join([os.path.join(TESTS_PATH, 'stubs'), os.path.dirname(TESTS_PATH)])
+os.environ.setdefault('TMDBHELPER_TEST_PROFILE', os.path.join(TESTS_PATH, '.profile'))
+
+
+@pytest.fixture(autouse=True)
+def profile(tmp_path, monkeypatch):
+    """ Empty Kodi profile folder for the test """
+    monkeypatch.setenv('TMDBHELPER_TEST_PROFILE', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def kodi_log(profile):
+    """ Function returning everything logged through xbmc.log by the test and its child processes """
+    def read_log():
+        try:
+            with open(os.path.join(profile, 'kodi.log')) as file:
+                return file.read()
+        except FileNotFoundError:
+            return ''
+    return read_log
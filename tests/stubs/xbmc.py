@@ -0,0 +1,79 @@
+""" Minimal stand-in for the Kodi xbmc module so that addon modules can be imported by tests """
+import os
+import time
+
+LOGDEBUG, LOGINFO, LOGWARNING, LOGERROR = 0, 1, 2, 3
+ISO_639_1 = 0
+PLAYLIST_VIDEO = 1
+
+
+def log(msg, level=LOGDEBUG):
+    with open(os.path.join(os.environ['TMDBHELPER_TEST_PROFILE'], 'kodi.log'), 'a') as file:
+        file.write(f'{os.getpid()} {level} {msg}\n')
+
+
+def sleep(ms):
+    time.sleep(ms / 1000)
+
+
+def executebuiltin(*args, **kwargs):
+    return
+
+
+def executeJSONRPC(*args, **kwargs):
+    return '{}'
+
+
+def getCondVisibility(*args):
+    return True
+
+
+def getInfoLabel(*args):
+    return ''
+
+
+def getLocalizedString(string_id):
+    return f'{string_id}'
+
+
+def getSkinDir():
+    return 'skin.estuary'
+
+
+def getLanguage(*args):
+    return 'English'
+
+
+def getRegion(key):
+    return {'dateshort': '%d/%m/%Y', 'datelong': '%A, %d %B %Y', 'time': '%H:%M:%S'}.get(key, '')
+
+
+def getCacheThumbName(path):
+    return ''
+
+
+def skinHasImage(image):
+    return False
+
+
+class Monitor():
+    def abortRequested(self):
+        return False
+
+    def waitForAbort(self, timeout=0):
+        time.sleep(timeout or 0)
+        return False
+
+
+class Player():
+    def isPlaying(self):
+        return False
+
+
+class PlayList():
+    def __init__(self, *args):
+        return
+
+
+class InfoTagVideo():
+    pass
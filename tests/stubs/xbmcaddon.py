@@ -0,0 +1,34 @@
+""" Minimal stand-in for the Kodi xbmcaddon module. Settings are empty so that defaults apply """
+import os
+
+
+class Addon():
+    def __init__(self, *args):
+        return
+
+    def getAddonInfo(self, key):
+        return {
+            'id': 'plugin.video.themoviedb.helper',
+            'path': os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+            'version': '0.0.0'}.get(key, '')
+
+    def getSetting(self, key):
+        return ''
+
+    def getSettingBool(self, key):
+        return False
+
+    def getSettingInt(self, key):
+        return 0
+
+    def getSettingString(self, key):
+        return ''
+
+    def getLocalizedString(self, string_id):
+        return f'{string_id}'
+
+    def setSetting(self, *args):
+        return
+
+    def setSettingString(self, *args):
+        return
@@ -0,0 +1,47 @@
+""" Minimal stand-in for the Kodi xbmcgui module. Window properties are kept per process """
+INPUT_ALPHANUM, INPUT_NUMERIC, ALPHANUM_HIDE_INPUT = 0, 1, 2
+
+_properties = {}
+
+
+class Window():
+    def __init__(self, window_id=10000):
+        return
+
+    def getProperty(self, key):
+        return _properties.get(key.lower(), '')
+
+    def setProperty(self, key, value):
+        _properties[key.lower()] = value
+
+    def clearProperty(self, key):
+        _properties.pop(key.lower(), None)
+
+
+class Dialog():
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class DialogProgress(Dialog):
+    pass
+
+
+class DialogProgressBG(Dialog):
+    pass
+
+
+class ListItem():
+    def __init__(self, *args, **kwargs):
+        return
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def getCurrentWindowId():
+    return 10000
+
+
+def getCurrentWindowDialogId():
+    return 9999
@@ -0,0 +1,71 @@
+""" Minimal stand-in for the Kodi xbmcvfs module. special://profile is TMDBHELPER_TEST_PROFILE """
+import os
+
+
+def translatePath(path):
+    return path.replace('special://profile/', os.path.join(os.environ['TMDBHELPER_TEST_PROFILE'], ''))
+
+
+def validatePath(path):
+    return path
+
+
+def exists(path):
+    return os.path.exists(path)
+
+
+def mkdirs(path):
+    os.makedirs(path, exist_ok=True)
+    return True
+
+
+def mkdir(path):
+    return mkdirs(path)
+
+
+def delete(path):
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+def rmdir(path, force=False):
+    return True
+
+
+def listdir(path):
+    return ([], [])
+
+
+class Stat():
+    def __init__(self, path):
+        self._stat = os.stat(path)
+
+    def st_mtime(self):
+        return self._stat.st_mtime
+
+    def st_size(self):
+        return self._stat.st_size
+
+
+class File():
+    def __init__(self, path, mode='r'):
+        self._file = open(path, mode)
+
+    def read(self):
+        return self._file.read()
+
+    def write(self, data):
+        self._file.write(data)
+        return True
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
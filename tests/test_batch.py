@@ -0,0 +1,42 @@
+import threading
+from time import sleep
+from resources.lib.api.batch import run_batch
+from resources.lib.addon.decorators import get_worker_pool
+
+
+def test_host_limits_and_order():
+    """ Results come back in order with no more calls in flight per host than its limit """
+    in_flight, peaks, lock = {}, {}, threading.Lock()
+
+    def call(host, x):
+        with lock:
+            in_flight[host] = in_flight.get(host, 0) + 1
+            peaks[host] = max(peaks.get(host, 0), in_flight[host])
+        sleep(0.02)
+        with lock:
+            in_flight[host] -= 1
+        return (host, x)
+
+    calls = [(host, call, (host, x), {}) for x in range(20) for host in ('a', 'b')]
+    assert run_batch(calls, host_limits={'a': 2, 'b': 5}) == [(host, x) for x in range(20) for host in ('a', 'b')]
+    assert peaks == {'a': 2, 'b': 5}
+
+
+def test_failed_calls_return_none():
+    def call(x):
+        if x == 1:
+            raise ValueError(x)
+        return x
+
+    assert run_batch([('a', call, (x, ), {}) for x in range(3)]) == [0, None, 2]
+
+
+def test_batches_share_worker_pool():
+    """ Repeated batches run in the shared pool rather than starting threads of their own """
+    run_batch([('a', sleep, (0.01, ), {}) for _ in range(8)])
+    threads = threading.active_count()
+    submitted = get_worker_pool().get_stats()['submitted']
+    for _ in range(10):
+        run_batch([('a', sleep, (0.01, ), {}) for _ in range(8)])
+    assert threading.active_count() <= threads
+    assert get_worker_pool().get_stats()['submitted'] == submitted + 10 * 4
@@ -0,0 +1,115 @@
+import os
+import socket
+import multiprocessing
+from time import time, sleep
+from xbmcgui import Window
+from resources.lib.files.cachewriter import CACHE_WRITER_PROPERTY, get_cache_writer_stats
+from resources.lib.monitor.cachewriter import CacheWriterMonitor
+from resources.lib.files.simplecache import SimpleCache
+
+FILENAME = 'test.db'
+PROCESSES = 8
+ROWS = 100  # Per process
+
+
+def _write_rows(start_time, process, writer_property, pause=0):
+    """ Plugin process storing objects whilst other processes do the same """
+    from resources.lib.files.cachewriter import get_cache_writer_stats
+    Window(10000).setProperty(CACHE_WRITER_PROPERTY, writer_property)
+    cache = SimpleCache(filename=FILENAME)
+    sleep(max(start_time - time(), 0))
+    for x in range(ROWS):
+        cache.set(f'key.{process}.{x}', {'data': os.urandom(500).hex()})
+        sleep(pause)
+    return dict(get_cache_writer_stats())
+
+
+def run_writers(writer_property, pause=0, stop=None):
+    with multiprocessing.get_context('spawn').Pool(PROCESSES) as pool:
+        results = pool.starmap_async(_write_rows, [(time() + 3, x, writer_property, pause) for x in range(PROCESSES)])
+        if stop:
+            sleep(3.5)
+            stop()
+        results = results.get()
+    return {k: sum(i[k] for i in results) for k in ('handed_off', 'direct')}
+
+
+def count_rows():
+    return SimpleCache(filename=FILENAME)._execute_sql("SELECT count(*) FROM simplecache").fetchone()[0]
+
+
+def start_writer():
+    writer = CacheWriterMonitor(flush_time=0.1)
+    writer.start()
+    while not Window(10000).getProperty(CACHE_WRITER_PROPERTY):
+        sleep(0.05)
+    return writer
+
+
+def stop_writer(writer):
+    writer.exit = True
+    writer.join()
+
+
+def test_writes_are_handed_off_under_load():
+    """ Every row from many processes writing at once is queued by the service and written """
+    writer = start_writer()
+    stats = run_writers(Window(10000).getProperty(CACHE_WRITER_PROPERTY))
+    stop_writer(writer)
+    assert stats == {'handed_off': PROCESSES * ROWS, 'direct': 0}
+    assert count_rows() == PROCESSES * ROWS
+
+
+def test_service_down_writes_directly():
+    """ Plugins write directly when the advertised service isn't listening """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    stats = run_writers(f'{port} token')
+    assert stats == {'handed_off': 0, 'direct': PROCESSES * ROWS}
+    assert count_rows() == PROCESSES * ROWS
+
+
+def test_service_stopping_under_load_loses_nothing():
+    """ Rows queued before the service stops are written by it and later rows are written directly """
+    writer = start_writer()
+    stats = run_writers(Window(10000).getProperty(CACHE_WRITER_PROPERTY), pause=0.01, stop=lambda: stop_writer(writer))
+    assert stats['handed_off'] and stats['direct']
+    assert stats['handed_off'] + stats['direct'] == PROCESSES * ROWS
+    assert count_rows() == PROCESSES * ROWS
+
+
+def test_deleted_object_is_not_read_back_whilst_writer_is_running():
+    """ Deleting an object written by the service or still in its queue isn't undone by the service or by reads """
+    writer = start_writer()
+    try:
+        cache = SimpleCache(filename=FILENAME)
+        cache.set('written', {'a': 1})
+        sleep(0.5)
+        cache.set('queued', {'b': 2})
+        for endpoint in ('written', 'queued'):
+            cache.set(endpoint, None, cache_days=0)
+            assert cache.get(endpoint) is None
+        sleep(0.5)
+    finally:
+        stop_writer(writer)
+    for endpoint in ('written', 'queued'):
+        assert cache.get(endpoint) is None
+        assert SimpleCache(filename=FILENAME, mem_only=True).get(endpoint) is None
+    assert cache._get_db_cache('written', time()) is None
+
+
+def test_validators_are_handed_off():
+    """ Validators are written by the service along with objects and validators without values are deleted """
+    writer = start_writer()
+    try:
+        cache = SimpleCache(filename=FILENAME)
+        handed_off = get_cache_writer_stats()['handed_off']
+        cache.set_validators('kept', etag='"v1"')
+        cache.set_validators('deleted', modified='Wed, 21 Oct 2015 07:28:00 GMT')
+        cache.set_validators('deleted')
+        assert get_cache_writer_stats()['handed_off'] == handed_off + 3
+    finally:
+        stop_writer(writer)
+    assert cache.get_validators('kept') == {'etag': '"v1"', 'modified': None}
+    assert cache.get_validators('deleted') is None
@@ -0,0 +1,33 @@
+import threading
+from resources.lib.addon import decorators
+from resources.lib.addon.decorators import ParallelThread, get_worker_pool
+
+
+def test_worker_pool_is_created_once(monkeypatch):
+    """ Threads asking for the pool at the same moment all get the same pool """
+    monkeypatch.setattr(decorators, '_worker_pool', None)
+    barrier = threading.Barrier(16)
+    pools = []
+
+    def get_pool():
+        barrier.wait()
+        pools.append(get_worker_pool())
+
+    threads = [threading.Thread(target=get_pool) for _ in range(16)]
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    assert len(pools) == 16 and len({id(i) for i in pools}) == 1
+
+
+def test_nested_parallel_threads_return_in_order():
+    """ Items queued from inside pool workers finish even with more items than workers """
+    def outer(i):
+        with ParallelThread(list(range(10)), lambda x: i * 10 + x) as pt:
+            pass
+        return pt.queue
+
+    with ParallelThread(list(range(get_worker_pool().max_workers * 2)), outer) as pt:
+        pass
+    assert pt.queue == [[i * 10 + x for x in range(10)] for i in range(get_worker_pool().max_workers * 2)]
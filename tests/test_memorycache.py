@@ -0,0 +1,39 @@
+from resources.lib.files.simplecache import MemoryCache
+
+KEY = ('test.db', 'key')
+
+
+def test_large_value_replaces_stale_value():
+    """ Setting an object too large for the memory tier still drops the previous object for that key """
+    cache = MemoryCache(budget=1000)
+    cache.set(KEY, 2000, b'old', 1000)
+    assert cache.get(KEY, 1000) == b'old'
+    cache.set(KEY, 2000, b'x' * 500, 1000)
+    assert cache.get(KEY, 1000) is None
+    assert cache.get_stats()['bytes'] == 0
+
+
+def test_least_recently_used_are_evicted():
+    cache = MemoryCache(budget=1000)
+    for x in range(5):
+        cache.set(('test.db', x), 2000, b'x' * 200, 1000)
+    cache.get(('test.db', 0), 1000)
+    cache.set(('test.db', 5), 2000, b'x' * 200, 1000)
+    assert cache.get(('test.db', 0), 1000) == b'x' * 200
+    assert cache.get(('test.db', 1), 1000) is None
+    assert cache.get_stats()['bytes'] == 1000
+
+
+def test_objects_are_checked_again_after_ttl():
+    cache = MemoryCache(budget=1000, ttl=60)
+    cache.set(KEY, 5000, b'value', 1000)
+    assert cache.get(KEY, 1059) == b'value'
+    assert cache.get(KEY, 1060) is None
+
+
+def test_objects_read_from_slower_tier_do_not_replace_newer():
+    """ An object read from window properties before a newer object was set is not added over it """
+    cache = MemoryCache(budget=1000)
+    cache.set(KEY, 2000, b'new', 1000)
+    cache.set(KEY, 2000, b'old', 1000, replace=False)
+    assert cache.get(KEY, 1000) == b'new'
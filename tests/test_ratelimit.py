@@ -0,0 +1,33 @@
+import multiprocessing
+from time import time, sleep
+from resources.lib.api.ratelimit import RateLimiter
+
+CAPACITY = 5
+RATE = 20.0
+REQUESTS = 20  # Per process
+
+
+def _acquire_many(start_time):
+    """ Plugin process making requests to the same API as another process at the same moment """
+    limiter = RateLimiter('Test', CAPACITY, RATE)
+    sleep(max(start_time - time(), 0))
+    return [time() for _ in range(REQUESTS) if limiter.acquire()]
+
+
+def test_quota_is_shared_across_processes():
+    """ Two processes drawing from one bucket together never exceed its capacity plus refill """
+    with multiprocessing.get_context('spawn').Pool(2) as pool:
+        results = pool.map(_acquire_many, [time() + 3] * 2)
+    acquired = sorted(i for result in results for i in result)
+    assert len(acquired) == REQUESTS * 2
+    for x, i in enumerate(acquired):
+        assert x + 1 <= CAPACITY + (i - acquired[0]) * RATE + 1
+    assert acquired[-1] - acquired[0] >= (REQUESTS * 2 - CAPACITY) / RATE * 0.9
+
+
+def test_block_pauses_requests():
+    limiter = RateLimiter('Test', CAPACITY, RATE)
+    limiter.block(0.5)
+    timer_a = time()
+    assert limiter.acquire()
+    assert time() - timer_a >= 0.45
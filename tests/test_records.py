@@ -0,0 +1,51 @@
+import os
+from resources.lib.files.records import RecordList, get_records, set_records, add_records, get_records_path, RECORDS_CHUNK
+
+CACHE_NAME = 'test.records'
+
+
+def get_items(start, stop):
+    return [{'id': x, 'title': f'Title {x}'} for x in range(start, stop)]
+
+
+def test_records_read_back_by_index_slice_and_iteration():
+    """ Pages of a store spanning several write chunks decode only the records asked for """
+    count = RECORDS_CHUNK * 2 + 500
+    records = set_records((i for i in get_items(0, count)), CACHE_NAME)
+    assert isinstance(records, RecordList)
+    assert len(records) == count
+    assert records[0] == {'id': 0, 'title': 'Title 0'}
+    assert records[-1] == {'id': count - 1, 'title': f'Title {count - 1}'}
+    assert records[RECORDS_CHUNK - 1:RECORDS_CHUNK + 1] == get_items(RECORDS_CHUNK - 1, RECORDS_CHUNK + 1)
+    assert records[10:20:5] == [get_items(10, 11)[0], get_items(15, 16)[0]]
+    assert list(records) == get_items(0, count)
+    assert set_records([], 'test.empty') is None and get_records('test.empty') is None
+
+
+def test_appended_records_are_read_after_reopen():
+    """ Lists opened before an append keep their length and a reopened list reads old and new records """
+    set_records(get_items(0, 10), CACHE_NAME)
+    records = get_records(CACHE_NAME)
+    assert add_records(get_items(10, 25), CACHE_NAME) == 15
+    assert len(records) == 10 and records[9] == get_items(9, 10)[0]
+    reopened = get_records(CACHE_NAME)
+    assert len(reopened) == 25
+    assert list(reopened) == get_items(0, 25)
+    assert add_records(get_items(0, 1), 'test.missing') == 0
+
+
+def test_partial_append_is_written_over():
+    """ Data and index entries left by an append which didn't finish are ignored then replaced by the next append """
+    set_records(get_items(0, 10), CACHE_NAME)
+    path = get_records_path(CACHE_NAME)
+    sizes = os.path.getsize(f'{path}.dat'), os.path.getsize(f'{path}.idx')
+    with open(f'{path}.dat', 'ab') as dat:
+        dat.write(b'{"id":10,"tit')  # Record without its index entry
+    with open(f'{path}.idx', 'ab') as idx:
+        idx.write((sizes[0] + 1000).to_bytes(8, 'little') + b'\x01\x02\x03')  # Entry past end of data then a torn entry
+    assert len(get_records(CACHE_NAME)) == 11
+    assert add_records(get_items(10, 12), CACHE_NAME) == 2
+    records = get_records(CACHE_NAME)
+    assert len(records) == 12
+    assert list(records) == get_items(0, 12)
+    assert os.path.getsize(f'{path}.idx') == sizes[1] + 2 * 8
@@ -0,0 +1,73 @@
+import json
+import pytest
+import xbmcgui
+from time import time, sleep
+from resources.lib.api.fixtures import ReplayServer
+from resources.lib.api.request import RequestAPI
+from resources.lib.api.scheduler import get_scheduler_stats, FOREGROUND_PROPERTY
+from resources.lib.addon.window import get_property
+from resources.lib.files import simplecache
+from resources.lib.files.cache import BasicCache, CACHE_REFRESH_PROPERTY
+from resources.lib.monitor import refresh
+from resources.lib.monitor.refresh import CacheRefreshMonitor
+
+API_NAME = 'Refresh'  # Objects stay in the memory tiers of the test process so keep them apart from other tests
+
+
+@pytest.fixture
+def server():
+    fixtures = {
+        (API_NAME, 'GET', '/movie/550'): {'status': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'id': 550})}}
+    server = ReplayServer(fixtures, latency=0)
+    server.start()
+    yield server
+    server.stop()
+
+
+def expire_cache(api):
+    """ Expire every object cached by api and forget copies held in memory as a new plugin process would """
+    cache = api._cache.ret_cache()
+    cache._execute_sql("UPDATE simplecache SET expires = ?", (int(time()) - 60, ))
+    xbmcgui._properties.clear()
+    simplecache._memory_cache.clear(cache._sc_name)
+
+
+def wait_for_replayed(server, count, timeout=5):
+    timeout = time() + timeout
+    while server.stats['replayed'] < count and time() < timeout:
+        sleep(0.01)
+    return server.stats['replayed']
+
+
+def test_stale_objects_are_refreshed_without_service(server):
+    """ Stale objects are only left in the refresh queue whilst the service is running to drain it """
+    api = RequestAPI(req_api_url=f'{server.url}/{API_NAME}', req_api_name=API_NAME)
+    assert api.get_request_lc('movie', 550) == {'id': 550}
+    expire_cache(api)
+    assert api.get_request_lc('movie', 550) == {'id': 550}
+    assert wait_for_replayed(server, 2) == 2
+    assert api._cache.pop_refresh_queue() == []
+
+    expire_cache(api)
+    xbmcgui.Window(10000).setProperty(CACHE_REFRESH_PROPERTY, 'True')
+    try:
+        assert api.get_request_lc('movie', 550) == {'id': 550}
+    finally:
+        xbmcgui.Window(10000).clearProperty(CACHE_REFRESH_PROPERTY)
+    assert len(api._cache.pop_refresh_queue()) == 1
+    assert server.stats['replayed'] == 2
+
+
+def test_refresh_requests_are_background(server, monkeypatch):
+    """ Stale objects are refreshed in the background lane without signalling foreground requests to other processes """
+    api = RequestAPI(req_api_url=f'{server.url}/{API_NAME}', req_api_name=API_NAME)
+    monkeypatch.setattr(refresh, 'REFRESH_APIS', {API_NAME: lambda: api})
+    BasicCache(f'{API_NAME}.db').queue_refresh('movie/550', api.get_stale_refresh(('movie', 550), {}, cache_days=1))
+    get_property(FOREGROUND_PROPERTY, clear_property=True)
+    before = get_scheduler_stats()
+    assert CacheRefreshMonitor().refresh(API_NAME) == 1
+    after = get_scheduler_stats()
+    assert server.stats['replayed'] == 1
+    assert after['background']['requests'] - before['background']['requests'] == 1
+    assert after['foreground']['requests'] == before['foreground']['requests']
+    assert not get_property(FOREGROUND_PROPERTY)
@@ -0,0 +1,223 @@
+import json
+import socket
+import threading
+import pytest
+import xbmcgui
+from time import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from resources.lib.api import metrics
+from resources.lib.addon.window import get_property
+from resources.lib.api.fixtures import ReplayServer, get_replay_url, FIXTURES_REPLAY_PROPERTY
+from resources.lib.api.metrics import get_metrics_report
+from resources.lib.api.request import RequestAPI
+from resources.lib.api.tmdb.api import TMDb
+from resources.lib.api.omdb.api import OMDb
+from resources.lib.files import simplecache
+
+API_NAME = 'Test'
+ETAG = '"v1"'
+TMDB_LANGUAGE = 'region=US&language=en-US&include_image_language=en%2Cnull'  # Added to every TMDb request by the stub settings
+
+
+@pytest.fixture
+def server():
+    fixtures = {
+        (API_NAME, 'GET', '/movie/550'): {'status': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'id': 550})}}
+    server = ReplayServer(fixtures, latency=0)
+    server.start()
+    yield server
+    server.stop()
+
+
+def get_api(server):
+    return RequestAPI(req_api_url=f'{server.url}/{API_NAME}', req_api_name=API_NAME)
+
+
+def test_not_found_is_not_requested_again(server):
+    """ Requests which were not found are answered by the negative cache instead of the API """
+    assert get_api(server).get_request_sc('movie', 1) == {}
+    assert get_api(server).get_request_sc('movie', 1) == {}
+    assert server.stats['missing'] == 1
+
+
+def test_cached_objects_skip_negative_lookup(server):
+    """ Objects found in cache are returned without looking for a negative marker or counting one in statistics """
+    assert get_api(server).get_request_sc('movie', 550) == {'id': 550}
+    api = get_api(server)
+    assert api.get_request_sc('movie', 550) == {'id': 550}
+    assert api._negative_cache._cache is None
+    assert server.stats['replayed'] == 1
+    assert not [i for i in api._cache.get_cache_report() if i.startswith('negative')]
+
+
+@pytest.fixture
+def empty_server():
+    """ Replay server answering with the responses TMDb and OMDb give when nothing matched. APIs replay from it """
+    fixtures = {
+        ('TMDb', 'GET', f'/search/movie?query=nothing&{TMDB_LANGUAGE}'): {
+            'status': 200, 'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'page': 1, 'results': [], 'total_pages': 0, 'total_results': 0})},
+        ('TMDb', 'GET', f'/find/tt0000000?external_source=imdb_id&{TMDB_LANGUAGE}'): {
+            'status': 200, 'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'movie_results': [], 'person_results': [], 'tv_results': [], 'tv_episode_results': [], 'tv_season_results': []})},
+        ('OMDb', 'GET', '/?r=xml&i=tt0000000&plot=full&tomatoes=True'): {
+            'status': 200, 'headers': {'Content-Type': 'text/xml; charset=utf-8'},
+            'body': '<?xml version="1.0" encoding="UTF-8"?><root response="False"><error>Incorrect IMDb ID.</error></root>'}}
+    server = ReplayServer(fixtures, latency=0)
+    get_property(FIXTURES_REPLAY_PROPERTY, set_property=server.start())
+    yield server
+    get_property(FIXTURES_REPLAY_PROPERTY, clear_property=True)
+    server.stop()
+
+
+def test_empty_results_are_negatively_cached(empty_server):
+    """ Searches which found nothing are remembered by the negative cache rather than stored as objects """
+    for x in range(2):
+        assert TMDb().get_request_lc('search', 'movie', query='nothing') == {}
+        assert TMDb().get_request_lc('find', 'tt0000000', external_source='imdb_id') == {}
+        assert OMDb(api_key='key').get_request_item(imdb_id='tt0000000') == {}
+    assert empty_server.stats == {'replayed': 3, 'missing': 0, 'fault_429': 0, 'fault_5xx': 0}
+    report = TMDb()._negative_cache.get_cache_report()
+    assert report['negative.TMDb.search.movie']['expires']['1d'] == report['negative.TMDb.find']['expires']['1d'] == 1
+    assert sum(i['expires']['1d'] for i in OMDb(api_key='key')._negative_cache.get_cache_report().values()) == 1
+
+
+class _ETagHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == ETAG and not self.server.is_full:
+            self.server.statuses.append(304)
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps({'id': 550}).encode('utf-8')
+        self.server.statuses.append(200)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+@pytest.fixture
+def etag_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ETagHandler)
+    server.statuses = []
+    server.is_full = False  # Send full response with the same ETag instead of not modified
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class _CaptureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.capture(b'')
+
+    def do_POST(self):
+        self.capture(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+
+    def capture(self, body):
+        self.server.requests.append((self.command, self.path, dict(self.headers), body))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, format, *args):
+        return
+
+
+@pytest.fixture
+def capture_server():
+    """ Server recording every request it gets. APIs replay from it """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _CaptureHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    get_property(FIXTURES_REPLAY_PROPERTY, set_property=f'http://127.0.0.1:{server.server_address[1]}')
+    yield server
+    get_property(FIXTURES_REPLAY_PROPERTY, clear_property=True)
+    server.shutdown()
+    server.server_close()
+
+
+def test_replay_never_sends_credentials(capture_server):
+    """ Key params, authorization headers and posted credentials aren't sent to the replay server """
+    api = RequestAPI(req_api_url='https://api.example.org/2', req_api_key='api_key=secret', req_api_name='Capture')
+    headers = {'trakt-api-version': '2', 'trakt-api-key': 'secret', 'Authorization': 'Bearer secret'}
+    api.get_api_request(api.get_request_url('movie', 550, language='en'), headers=headers)
+    api.get_api_request(api.get_request_url('oauth', 'token'), postdata={'client_secret': 'secret'}, headers=headers)
+    assert [(i[0], i[1]) for i in capture_server.requests] == [('GET', '/Capture/movie/550?language=en'), ('POST', '/Capture/oauth/token')]
+    assert all('secret' not in json.dumps(i[2]) and i[2]['trakt-api-version'] == '2' and not i[3] for i in capture_server.requests)
+
+
+def test_replay_is_only_from_this_device():
+    """ Replay urls for servers on other hosts are ignored so that requests still go to the API """
+    assert get_replay_url('http://127.0.0.1:8765/') == 'http://127.0.0.1:8765'
+    assert get_replay_url('http://localhost:8765') == 'http://localhost:8765'
+    for url in ('http://example.com:8765', 'http://127.0.0.1.example.com:8765', 'https://127.0.0.1:8765', 'http://127.0.0.1', 'http://127.0.0.1:x', ''):
+        assert get_replay_url(url) is None
+    get_property(FIXTURES_REPLAY_PROPERTY, set_property='http://example.com:8765')
+    try:
+        assert RequestAPI(req_api_url='https://api.example.org/2', req_api_name='Capture').req_api_url == 'https://api.example.org/2'
+    finally:
+        get_property(FIXTURES_REPLAY_PROPERTY, clear_property=True)
+
+
+def expire_cache(api):
+    """ Expire every object cached by api and forget copies held in memory as a new plugin process would """
+    cache = api._cache.ret_cache()
+    cache._execute_sql("UPDATE simplecache SET expires = ?", (int(time()) - 60, ))
+    xbmcgui._properties.clear()
+    simplecache._memory_cache.clear(cache._sc_name)
+
+
+def get_cache_outcomes(api_name):
+    return get_metrics_report(hours=1)[api_name]['total']['cache']
+
+
+def test_not_modified_returns_cached_object(etag_server, monkeypatch):
+    """ Expired objects revalidated with a 304 response are returned rather than the not modified sentinel """
+    monkeypatch.setattr(metrics, '_pending', {})
+    api = RequestAPI(req_api_url=f'http://127.0.0.1:{etag_server.server_address[1]}', req_api_name='ETag')
+    assert api.get_request_sc('movie', 550) == {'id': 550}
+    expire_cache(api)
+    assert api.get_request_sc('movie', 550) == {'id': 550}
+    assert api.get_request_sc('movie', 550) == {'id': 550}
+    assert etag_server.statuses == [200, 304]
+    assert get_cache_outcomes('ETag') == {'miss': 1, 'not_modified': 1, 'hit': 1}
+
+
+def test_unchanged_validators_are_not_written(etag_server, monkeypatch):
+    """ Refreshed objects with the same validators as before don't write them again """
+    writes = []
+    set_validators = simplecache.SimpleCache.set_validators
+    monkeypatch.setattr(simplecache.SimpleCache, 'set_validators', lambda self, *args, **kwargs: writes.append(1) or set_validators(self, *args, **kwargs))
+    etag_server.is_full = True
+    api = RequestAPI(req_api_url=f'http://127.0.0.1:{etag_server.server_address[1]}', req_api_name='ETagFull')
+    assert api.get_request_sc('movie', 550) == {'id': 550}
+    expire_cache(api)
+    assert api.get_request_sc('movie', 550) == {'id': 550}
+    assert etag_server.statuses == [200, 200]
+    assert len(writes) == 1
+
+
+def test_failed_requests_are_not_hits(monkeypatch):
+    """ Requests which failed without a response are counted as misses """
+    monkeypatch.setattr(metrics, '_pending', {})
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    api = RequestAPI(req_api_url=f'http://127.0.0.1:{port}', req_api_name='Down')
+    assert api.get_request_sc('movie', 550) == {}
+    assert get_cache_outcomes('Down') == {'miss': 1}
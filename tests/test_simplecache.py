@@ -0,0 +1,310 @@
+import gc
+import os
+import json
+import sqlite3
+import threading
+import multiprocessing
+import xbmcgui
+from time import time, sleep
+from timeit import default_timer as timer
+from resources.lib.files import simplecache
+from resources.lib.files.simplecache import SimpleCache
+from resources.lib.files import cache as cachemodule
+from resources.lib.files.cache import BasicCache, get_cache_key, get_search_history, SEARCH_HISTORY, PREWARM_HISTORY
+from resources.lib.files.cache import get_prewarm_paths, set_prewarm_path, get_prewarm_stats, set_prewarm_window
+
+FILENAME = 'test.db'
+
+
+def run_in_thread(func, *args):
+    """ Run func in a new thread so that it gets its own persistent connection which closes when the thread ends """
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func(*args)))
+    thread.start()
+    thread.join()
+    gc.collect()
+    return result[0] if result else None
+
+
+def populate(count, filename=FILENAME):
+    cache = SimpleCache(filename=filename)
+    expires = int(time()) + 3600
+    cache._set_db_cache_many([(f'key.{x}', expires, simplecache.data_encode({'x': x}), f'name.{x}') for x in range(count)])
+    return cache._db_file
+
+
+def count_rows(db_file):
+    with sqlite3.connect(db_file) as connection:
+        return connection.execute("SELECT count(*) FROM simplecache").fetchone()[0]
+
+
+def test_locked_database_is_kept(monkeypatch, kodi_log):
+    """ A lock held by another process for longer than the busy timeout is waited out rather than treated as corruption """
+    db_file = run_in_thread(populate, 1000)
+    monkeypatch.setattr(simplecache, 'DATABASE_TIMEOUT', 0.1)
+    monkeypatch.setattr(simplecache, 'DATABASE_BUSY_WAIT', 0.2)
+
+    locker = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+    locker.execute("PRAGMA journal_mode=DELETE")  # Exclusive lock in rollback journal mode blocks readers too
+    locker.execute("BEGIN EXCLUSIVE")
+    threading.Timer(0.3, lambda: locker.execute("COMMIT")).start()
+
+    assert run_in_thread(lambda: SimpleCache(filename=FILENAME).get('key.10')) == {'x': 10}
+    locker.close()
+    assert count_rows(db_file) == 1000
+    assert 'Busy while opening' in kodi_log()
+    assert 'Deleting Corrupt File' not in kodi_log()
+
+
+def test_corrupt_database_is_recreated(kodi_log):
+    db_file = run_in_thread(populate, 10)
+    with open(db_file, 'wb') as file:
+        file.write(b'not a database' * 100)
+    assert run_in_thread(lambda: SimpleCache(filename=FILENAME).get('key.1')) is None
+    assert 'Deleting Corrupt File' in kodi_log()
+    run_in_thread(lambda: SimpleCache(filename=FILENAME).set('key.1', {'x': 1}))
+    assert count_rows(db_file) == 1
+
+
+def _fetch_with_lease(start_time, calls_file):
+    """ Plugin process fetching the same object as several others at the same moment """
+    def fetch():
+        with open(calls_file, 'a') as file:
+            file.write(f'{os.getpid()}\n')
+        sleep(0.5)
+        return {'id': 550}
+
+    sleep(max(start_time - time(), 0))
+    return BasicCache(filename='TMDb.db').use_cache(fetch, cache_name='movie.550', cache_days=1)
+
+
+def test_lease_fetches_once_across_processes(profile):
+    """ Processes which miss the cache whilst another process holds the lease wait for its result instead of fetching """
+    calls_file = str(profile / 'calls.txt')
+    processes = 6
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        results = pool.starmap(_fetch_with_lease, [(time() + 3, calls_file)] * processes)
+    with open(calls_file) as file:
+        calls = file.read().split()
+    assert results == [{'id': 550}] * processes
+    assert len(calls) == 1
+
+
+def test_get_many_uses_one_query():
+    """ A page of items not in memory is loaded with one SELECT and then served from memory """
+    def get_page():
+        cache = SimpleCache(filename=FILENAME)
+        statements = []
+        cache._get_database().set_trace_callback(statements.append)
+        results = cache.get_many([f'key.{x}' for x in range(200)] + ['key.missing'])
+        again = [cache.get(f'key.{x}') for x in range(200)]
+        return results, again, [i for i in statements if i.startswith('SELECT')]
+
+    run_in_thread(populate, 200)
+    results, again, selects = run_in_thread(get_page)
+    assert len(results) == 200 and results['key.199'] == {'x': 199}
+    assert again == [{'x': x} for x in range(200)]
+    assert len(selects) == 1
+
+
+def test_lock_wait_stats_are_running_totals(monkeypatch):
+    """ Writes which wait on the writer lock are counted as running totals rather than kept one by one """
+    monkeypatch.setattr(simplecache, '_lock_waits', {'count': 0, 'total': 0, 'max': 0})
+    cache = SimpleCache(filename=FILENAME)
+    cache.set('key.0', {'x': 0})
+    lock = simplecache._writer_locks[cache._db_file]
+    for wait in (0.05, 0.1):
+        with lock:  # Another thread writing
+            thread = threading.Thread(target=cache.set, args=('key.1', {'x': 1}))
+            thread.start()
+            sleep(wait)
+        thread.join()
+    stats = simplecache.get_lock_wait_stats()
+    assert set(stats) == {'count', 'total', 'max'}
+    assert stats['count'] == 2
+    assert stats['total'] >= 0.12 and 0.08 <= stats['max'] < stats['total']  # Writer thread starts timing just after the lock is taken
+
+
+def create_v4_database(count, filename=FILENAME):
+    """ Populated database in the schema written by versions before migrations were added. Ids are names munged by get_pickle_name """
+    db_file = SimpleCache(filename=filename)._db_file
+    with sqlite3.connect(db_file) as connection:
+        connection.execute("CREATE TABLE simplecache(id TEXT UNIQUE, expires INTEGER, data TEXT, checksum INTEGER)")
+        connection.execute("CREATE INDEX idx ON simplecache(id)")
+        connection.executemany(
+            "INSERT INTO simplecache(id, expires, data, checksum) VALUES (?, ?, ?, 0)",
+            [(f'key{x}', int(time()) + 3600, json.dumps({'x': x})) for x in range(count)])
+    connection.close()
+    return db_file
+
+
+def get_schema(db_file):
+    with sqlite3.connect(db_file) as connection:
+        columns = {i[1] for i in connection.execute("PRAGMA table_info(simplecache)")}
+        indexes = {i[1] for i in connection.execute("PRAGMA index_list(simplecache)")}
+        user_version = connection.execute("PRAGMA user_version").fetchone()[0]
+    connection.close()
+    return columns, indexes, user_version
+
+
+def test_v4_database_is_migrated(kodi_log):
+    """ Objects written by database_v4 are kept and readable after the schema is upgraded in place """
+    db_file = create_v4_database(500)
+    assert run_in_thread(lambda: [BasicCache(FILENAME).get_cache(f'key{x}') for x in (0, 250, 499)]) == [{'x': 0}, {'x': 250}, {'x': 499}]
+    columns, indexes, user_version = get_schema(db_file)
+    assert {'accessed', 'name'} <= columns
+    assert {'idx_expires', 'idx_accessed'} <= indexes
+    assert user_version == simplecache.DATABASE_VERSION
+    assert count_rows(db_file) == 500
+    assert 'Migrating' in kodi_log()
+
+
+def test_busy_migration_is_retried(monkeypatch, kodi_log):
+    """ A migration blocked by another process backs off and tries again without deleting the database """
+    db_file = create_v4_database(100)
+    monkeypatch.setattr(simplecache, 'DATABASE_BUSY_WAIT', 0.1)
+    migrate, calls = SimpleCache._migrate, []
+
+    def busy_migrate(self, connection):
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError('database is locked')
+        return migrate(self, connection)
+
+    monkeypatch.setattr(SimpleCache, '_migrate', busy_migrate)
+    assert run_in_thread(lambda: BasicCache(FILENAME).get_cache('key10')) == {'x': 10}
+    assert len(calls) == 2
+    assert count_rows(db_file) == 100
+    assert 'Busy while migrating' in kodi_log()
+    assert 'Deleting Corrupt File' not in kodi_log()
+
+
+def test_full_vacuum_keeps_to_time_budget():
+    """ Conversion to incremental vacuum rewrites the whole file so is skipped if it won't fit in the time budget """
+    def get_auto_vacuum():
+        return SimpleCache(filename=FILENAME)._execute_sql("PRAGMA auto_vacuum").fetchone()[0]
+
+    def convert(budget):
+        cache = SimpleCache(filename=FILENAME)
+        cache._do_cleanup_vacuum(timer_z=timer() + budget if budget else None, full_vacuum=True)
+        return get_auto_vacuum()
+
+    create_v4_database(2000)
+    assert run_in_thread(get_auto_vacuum) != simplecache.AUTO_VACUUM_INCREMENTAL
+    assert run_in_thread(convert, 0.001) != simplecache.AUTO_VACUUM_INCREMENTAL
+    assert run_in_thread(convert, None) == simplecache.AUTO_VACUUM_INCREMENTAL
+
+
+QUOTA_EVICT_BATCH = 20  # Keep eviction batches a small part of the test quota as EVICT_BATCH is for real databases
+
+
+def _write_over_quota(start_time, process, quota):
+    """ Plugin process filling the cache and evicting after each page as another process does the same """
+    cache = SimpleCache(filename=FILENAME, quota=quota)
+    expires = int(time()) + 3600
+    sleep(max(start_time - time(), 0))
+    for page in range(20):
+        cache._set_db_cache_many([(f'key.{process}.{page}.{x}', expires, os.urandom(1000), None) for x in range(20)])
+        cache._do_cleanup_quota(evict_batch=QUOTA_EVICT_BATCH)
+    return cache._get_db_size()
+
+
+def test_quota_holds_under_load(profile):
+    """ Two processes each writing several times the quota leave the database within quota """
+    quota = 256 * 1024
+    with multiprocessing.get_context('spawn').Pool(2) as pool:
+        results = pool.starmap(_write_over_quota, [(time() + 3, x, quota) for x in range(2)])
+    cache = SimpleCache(filename=FILENAME, quota=quota)
+    assert min(results) <= quota
+    assert 0 < cache._get_db_size() <= quota
+    assert 0 < count_rows(cache._db_file) < 800
+
+
+def test_purge_matches_report_prefixes():
+    """ Prefixes shown in the cache report purge the objects they group however the names are separated """
+    def purge():
+        cache = SimpleCache(filename=FILENAME)
+        cache._set_db_cache_many([(get_cache_key(i), int(time()) + 3600, simplecache.data_encode({}), i) for i in (
+            'TMDb/tv/1399/credits', 'TMDb/tv/1400?language=en', 'TMDb/tvshows/1', 'TMDb/movie/550')])
+        report = cache.get_report()
+        return report, cache.purge('TMDb.tv'), cache.purge('TMDb/movie/'), count_rows(cache._db_file)
+
+    report, purged_tv, purged_movie, remaining = run_in_thread(purge)
+    assert report['TMDb.tv']['rows'] == 2
+    assert purged_tv == 2 and purged_movie == 1 and remaining == 1
+
+
+def test_legacy_rows_are_rekeyed(profile):
+    """ Objects stored under names which munging left unchanged such as search history are rekeyed by the migration """
+    create_v4_database(0, filename=SEARCH_HISTORY)
+    with sqlite3.connect(SimpleCache(filename=SEARCH_HISTORY)._db_file) as connection:
+        connection.executemany("INSERT INTO simplecache(id, expires, data, checksum) VALUES (?, ?, ?, 0)", [
+            ('movie', int(time()) + 3600, json.dumps(['alien'])),
+            ('https_api_themoviedb_org_3_tv_1399_language_en-US', int(time()) + 3600, json.dumps({'id': 1399}))])
+    connection.close()
+
+    def get_cache():
+        return get_search_history('movie'), BasicCache(SEARCH_HISTORY).get_cache('https://api.themoviedb.org/3/tv/1399?language=en-US')
+
+    assert run_in_thread(get_cache) == (['alien'], None)
+    with sqlite3.connect(SimpleCache(filename=SEARCH_HISTORY)._db_file) as connection:
+        assert connection.execute("SELECT id, name FROM simplecache").fetchall() == [(get_cache_key('movie'), 'movie')]
+    connection.close()
+
+
+def test_expired_rows_are_only_kept_by_stale_caches():
+    """ Expired rows are kept for serving stale only by caches which serve stale objects """
+    for filename, stale_retention, expected in (('stale.db', 7 * 86400, 1), ('fresh.db', None, 0)):
+        cache = SimpleCache(filename=filename, stale_retention=stale_retention)
+        cache._set_db_cache_many([('key.1', int(time()) - 86400, simplecache.data_encode({'x': 1}), 'name.1')])
+        assert cache._do_cleanup()
+        assert count_rows(cache._db_file) == expected
+
+
+def clear_prewarm_history():
+    """ Forget history held in memory by earlier tests since each test has its own profile """
+    xbmcgui._properties.clear()
+    simplecache._memory_cache.clear(BasicCache(PREWARM_HISTORY).ret_cache()._sc_name)
+
+
+def test_prewarm_history_is_only_written_when_changed(monkeypatch):
+    """ Listing the same path again within the interval doesn't write history unless it is newly used as a widget """
+    clear_prewarm_history()
+    writes = []
+    set_cache = BasicCache.set_cache
+    monkeypatch.setattr(BasicCache, 'set_cache', lambda self, *args, **kwargs: writes.append(1) or set_cache(self, *args, **kwargs))
+    for is_widget in (False, False, True, False):
+        set_prewarm_path('info=popular&tmdb_type=movie', is_widget=is_widget)
+    assert len(writes) == 2
+    assert get_prewarm_paths()['info=popular&tmdb_type=movie'][::2] == [1, True]
+    monkeypatch.setattr(cachemodule, 'PREWARM_INTERVAL', 1)
+    sleep(1)
+    set_prewarm_path('info=popular&tmdb_type=movie')
+    assert get_prewarm_paths()['info=popular&tmdb_type=movie'][0] == 2
+
+
+def test_prewarm_paths_used_at_once_are_all_kept():
+    """ Processes updating history at the same time take turns instead of overwriting each other """
+    clear_prewarm_history()
+    threads = [threading.Thread(target=set_prewarm_path, args=[f'info=list&page={x}']) for x in range(8)]
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    assert sorted(get_prewarm_paths()) == sorted(f'info=list&page={x}' for x in range(8))
+
+
+def test_prewarm_counts_refreshed_objects():
+    """ Expiring objects are only counted as refreshed once a replacement was fetched """
+    cache = BasicCache(filename=FILENAME)
+    cache.set_cache({'x': 1}, 'prewarm.1', cache_days=0.001)
+    cache.set_cache({'x': 1}, 'prewarm.2', cache_days=0.001)
+    refreshed = get_prewarm_stats()['refreshed']
+    set_prewarm_window(3600)
+    try:
+        assert cache.use_cache(lambda: None, cache_name='prewarm.1') is None
+        assert get_prewarm_stats()['refreshed'] == refreshed
+        assert cache.use_cache(lambda: {'x': 2}, cache_name='prewarm.2') == {'x': 2}
+        assert get_prewarm_stats()['refreshed'] == refreshed + 1
+    finally:
+        set_prewarm_window(0)
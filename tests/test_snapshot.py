@@ -0,0 +1,65 @@
+import os
+import pickle
+import pytest
+import xbmcgui
+from resources.lib.files import simplecache, codec
+from resources.lib.files import snapshot as snapshotmodule
+from resources.lib.files.cache import BasicCache
+from resources.lib.files.snapshot import export_snapshot, import_snapshot
+
+
+class _Exploit():
+    """ Pickle which runs a function when loaded """
+    def __reduce__(self):
+        return (os.getpid, ())
+
+
+def use_new_profile(monkeypatch, tmp_path, name):
+    """ Switch to a new Kodi profile and forget objects held in memory as a new plugin process would """
+    monkeypatch.setenv('TMDBHELPER_TEST_PROFILE', str(tmp_path / name))
+    xbmcgui._properties.clear()
+    simplecache._memory_cache.clear(BasicCache(filename='TMDb.db').ret_cache()._sc_name)
+
+
+def test_snapshot_seeds_fresh_profile(monkeypatch, tmp_path):
+    """ Objects exported from one profile are found on first lookup in a fresh profile after import """
+    use_new_profile(monkeypatch, tmp_path, 'source')
+    BasicCache(filename='TMDb.db').set_cache({'id': 550}, 'TMDb/movie/550', cache_days=1)
+    BasicCache(filename='TMDb.db').set_cache({'id': 1399}, 'TMDb/tv/1399', cache_days=1)
+    snapshot = str(tmp_path / 'snapshot.bin')
+    assert export_snapshot(snapshot, filenames=['TMDb.db'], prefix='TMDb/movie') == {'TMDb.db': 1}
+
+    use_new_profile(monkeypatch, tmp_path, 'fresh')
+    assert BasicCache(filename='TMDb.db').get_cache('TMDb/movie/550') is None
+    assert import_snapshot(snapshot) == {'TMDb.db': 1}
+    assert BasicCache(filename='TMDb.db').get_cache('TMDb/movie/550') == {'id': 550}
+    assert BasicCache(filename='TMDb.db').get_cache('TMDb/tv/1399') is None
+
+
+def test_corrupt_snapshot_is_rejected(tmp_path):
+    BasicCache(filename='TMDb.db').set_cache({'id': 550}, 'TMDb/movie/550', cache_days=1)
+    snapshot = str(tmp_path / 'snapshot.bin')
+    export_snapshot(snapshot, filenames=['TMDb.db'])
+    with open(snapshot, 'r+b') as file:
+        file.seek(os.path.getsize(snapshot) // 2)
+        byte = file.read(1)
+        file.seek(-1, 1)
+        file.write(bytes((byte[0] ^ 0xff,)))
+    with pytest.raises(ValueError):
+        import_snapshot(snapshot)
+
+
+def test_objects_which_are_not_data_are_not_imported(monkeypatch, tmp_path):
+    """ Objects in a crafted snapshot with a valid checksum are only merged if they decode as plain data """
+    BasicCache(filename='TMDb.db').set_cache({'id': 550}, 'TMDb/movie/550', cache_days=1)
+    BasicCache(filename='TMDb.db').set_cache({'id': 1399}, 'TMDb/tv/1399', cache_days=1)
+    snapshot = str(tmp_path / 'snapshot.bin')
+    monkeypatch.setattr(
+        snapshotmodule, 'encode',
+        lambda obj: b'\x01' + pickle.dumps(_Exploit()) if obj['id'] == 550 else codec.encode(obj))
+    assert export_snapshot(snapshot, filenames=['TMDb.db']) == {'TMDb.db': 2}
+
+    use_new_profile(monkeypatch, tmp_path, 'fresh')
+    assert import_snapshot(snapshot) == {'TMDb.db': 1}
+    assert BasicCache(filename='TMDb.db').get_cache('TMDb/movie/550') is None
+    assert BasicCache(filename='TMDb.db').get_cache('TMDb/tv/1399') == {'id': 1399}